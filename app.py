@@ -1,80 +1,293 @@
 # app.py
 
 import os
-import json
 import base64
-import requests
+import hmac
 import uuid
 import io
+import time
+import threading
+import tempfile
+from contextlib import nullcontext
 
-from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler 
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, Response
+import click
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, Response, g, abort, session, has_request_context, send_file, stream_with_context
 from dotenv import load_dotenv
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
-import google.generativeai as genai
 from urllib.parse import urlparse, parse_qs
 from werkzeug.utils import secure_filename
-from PIL import Image
-import pillow_heif
-import click
+
+from sqlalchemy.orm import defer
 
 from models import db, User, History
+from history_writer import history_writer
+from db_routing import db_router, replica_binds
+from user_cache import get_cached_user, cache_user, invalidate_user, attach_user, user_snapshot
 from forms import RegistrationForm, LoginForm, UpdateAccountForm
 from utils.gemini_answer import (
-    get_gemini_answer, get_meme_suggestion, google_search_for_answer, 
-    generate_conversational_answer, search_for_image_on_google, 
-    search_for_video_on_youtube, search_for_gif_on_giphy
+    get_meme_suggestion, google_search_for_answer, 
+    generate_conversational_answer, search_images_on_google, 
+    search_videos_on_youtube, search_gifs_on_giphy, search_videos_on_pexels
 )
-from utils.text_to_speech import convert_text_to_speech
+from utils.intent_batcher import classify_intent
+from utils.text_to_speech import get_tts_backend, split_into_sentences, synthesize_sentences
 from utils.sketch_generator import generate_sketch
-from utils.meme_generator import generate_meme
+from utils.meme_generator import generate_meme, render_meme_preview
+from utils import metrics
+from utils.metrics import span
+from utils.rate_limit import RateLimiter, RateLimitExceeded
+from utils.video_delivery import video_cache, choose_rendition, client_hints, is_allowed_video_url, VideoNotAllowed
+from utils.video_sketch import video_sketch_jobs, JobsFull, VIDEO_SKETCH_MAX_MB
+from utils.uploads import UploadRejected, check_upload_size, open_image_upload, UPLOAD_MAX_IMAGE_MB
+from utils.static_assets import static_assets
+from utils.response_cache import response_cache
+from utils.model_router import model_router
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a-very-secret-key-for-dev')
-
-# Database Configuration
-database_url = os.getenv('DATABASE_URL')
+# Heavy third-party modules are imported lazily by the code that needs them.
+# preload_heavy_modules() imports them up front, e.g. in the gunicorn master
+# with --preload so all workers share the pages copy-on-write.
+HEAVY_MODULES = [
+    "cv2", "numpy", "PIL.Image", "PIL.ImageDraw", "PIL.ImageFont", "pillow_heif",
+    "google.generativeai", "serpapi", "gtts",
+]
+
+def preload_heavy_modules():
+    """Imports every heavy module now instead of on first use."""
+    import importlib
+    for module_name in HEAVY_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            print(f"Could not preload {module_name}: {e}")
 
-# Debug: Print what we're getting (remove after fixing)
-print(f"DATABASE_URL found: {bool(database_url)}")
-if database_url:
-    print(f"DATABASE_URL starts with: {database_url[:20]}...")
+app = Flask(__name__)
+login_manager = LoginManager()
 
-if database_url:
+def normalize_database_url(url):
     # Render uses postgres://, but SQLAlchemy 1.4+ needs postgresql://
-    if database_url.startswith('postgres://'):
-        database_url = database_url.replace('postgres://', 'postgresql://', 1)
-    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-    print(f"✓ Using PostgreSQL database")
-else:
-    # Local SQLite fallback
-    instance_path = os.path.join(app.root_path, 'instance')
-    os.makedirs(instance_path, exist_ok=True)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///instance/site.db'
-    print(f"⚠ WARNING: Using SQLite fallback - DATABASE_URL not found!")
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,  # Verify connections before using them
-    'pool_recycle': 300,    # Recycle connections after 5 minutes
-}
-
-# Initialize the db object with the app
-db.init_app(app)
-
-# Initialize Flask-Login
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-login_manager.login_message_category = 'info'
-
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def create_app():
+    """
+    Configures the Flask app and its extensions.
+    This does not touch the database or start any threads, so it is cheap
+    to import and safe to run in a gunicorn master before forking.
+    """
+    if app.extensions.get('sqlalchemy'):
+        return app
+
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a-very-secret-key-for-dev')
+
+    # Database Configuration
+    database_url = os.getenv('DATABASE_URL')
+
+    if database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(database_url)
+        print(f"✓ Using PostgreSQL database")
+    else:
+        # Local SQLite fallback
+        instance_path = os.path.join(app.root_path, 'instance')
+        os.makedirs(instance_path, exist_ok=True)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///instance/site.db'
+        print(f"⚠ WARNING: Using SQLite fallback - DATABASE_URL not found!")
+
+    # Read replicas, if any; db_routing.py decides which queries may use them
+    app.config['SQLALCHEMY_BINDS'] = {key: normalize_database_url(url) for key, url in
+                                      replica_binds(os.getenv('DATABASE_REPLICA_URLS', '')).items()}
+    if app.config['SQLALCHEMY_BINDS']:
+        print(f"✓ Routing reads to {len(app.config['SQLALCHEMY_BINDS'])} replica(s)")
+
+    # The largest upload any route accepts, plus room for the other form fields. Routes check their own limits first.
+    app.config['MAX_CONTENT_LENGTH'] = int((max(UPLOAD_MAX_IMAGE_MB, VIDEO_SKETCH_MAX_MB) + 1) * 1024 * 1024)
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,  # Verify connections before using them
+        'pool_recycle': 300,    # Recycle connections after 5 minutes
+    }
+
+    # Initialize the db object with the app
+    db.init_app(app)
+    db_router.init_app(app, db)
+
+    # Initialize Flask-Login
+    login_manager.init_app(app)
+    login_manager.login_view = 'login'
+    login_manager.login_message_category = 'info'
+
+    history_writer.init_app(app)
+    static_assets.init_app(app)
+    return app
+
+create_app()
+
+# audio_id -> (future, mimetype, created_at). Entries the browser never fetches expire after AUDIO_STORE_TTL seconds.
 in_memory_audio_store = {}
+_audio_store_lock = threading.Lock()
+AUDIO_STORE_TTL = float(os.getenv("AUDIO_STORE_TTL", "300"))
+
+KNOWN_INTENTS = {"fact_check", "answer_text", "find_image", "find_pexels_video", "find_youtube_video", "find_gif"}
+
+rate_limiter = RateLimiter()
+# How long a request may wait in line for rate-limit capacity before it gets a 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+
+def request_deadline():
+    """The moment this request stops waiting for capacity (time.monotonic())."""
+    if 'rate_limit_deadline' not in g:
+        g.rate_limit_deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT
+    return g.rate_limit_deadline
+
+def limit_user_request():
+    """
+    Takes one token from the current user's bucket and one from the global bucket, both or neither,
+    waiting up to RATE_LIMIT_MAX_WAIT for them. A 429 from either bucket therefore never spends the other's token.
+    """
+    rate_limiter.acquire(request_deadline(), user_id=current_user.id, include_global=True)
+
+def upstream_call(provider):
+    """Holds a rate-limit token and concurrency slot for one call to the given provider."""
+    return rate_limiter.upstream_slot(provider, request_deadline())
+
+def cache_miss_upstream_call(provider):
+    """Rate-limits the calls response_cache makes on a miss. Prewarming runs outside requests and has its own budget."""
+    return upstream_call(provider) if has_request_context() else nullcontext()
+
+response_cache.set_upstream_guard(cache_miss_upstream_call)
+
+def hedge_upstream_call(provider):
+    """Rate-limits model_router's hedges. A hedge never waits for capacity; it is skipped instead."""
+    return rate_limiter.upstream_slot(provider, time.monotonic())
+
+model_router.set_hedge_guard(hedge_upstream_call)
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    return jsonify({'error': str(e)}), e.status_code
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'That upload is too large.'}), 413
+
+@app.errorhandler(RateLimitExceeded)
+def rate_limit_exceeded(e):
+    message = "You're sending requests too quickly. Please try again in a moment."
+    response = jsonify({'error': message, 'text_response': message, 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+if metrics.METRICS_ENABLED:
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_db_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+            metrics.increment("db_queries_total", route=request.endpoint or "")
+
+    @app.before_request
+    def start_request_trace():
+        metrics.start_profiler()
+        g.trace_token = metrics.start_trace(route=request.endpoint or "")
+        g.trace_start = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        spans = metrics.current_spans()
+        if spans:
+            response.headers['Server-Timing'] = metrics.server_timing_header(spans)
+        response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+        return response
+
+    @app.teardown_request
+    def finish_request_trace(exc=None):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            metrics.finish_trace(token)
+            metrics.observe(f"route:{request.endpoint or 'unknown'}", time.perf_counter() - g.trace_start)
+            # db_queries_total / http_requests_total gives queries per request for each route
+            metrics.increment("http_requests_total", route=request.endpoint or "")
+
+# Bearer token for /metrics and /debug/*. /debug/profile is only served when it is set.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def require_metrics_token(required=False):
+    """Aborts with 404 if required and no METRICS_TOKEN is configured, or 401 if the request doesn't carry it."""
+    if not METRICS_TOKEN:
+        if required:
+            abort(404)
+        return
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+        abort(401)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        abort(404)
+    require_metrics_token()
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile')
+def profile_endpoint():
+    profiler = metrics.get_profiler()
+    if profiler is None:
+        abort(404)
+    # Stacks show code paths and timings, so never serve them unauthenticated
+    require_metrics_token(required=True)
+    return Response(profiler.folded(), mimetype='text/plain')
+
+@app.route('/debug/models')
+def model_stats_endpoint():
+    if not metrics.METRICS_ENABLED:
+        abort(404)
+    require_metrics_token()
+    return jsonify(model_router.stats())
+
+# Optionally keep the user's identity in the signed session cookie as well,
+# so a warm session needs neither the cache nor the database.
+USER_SESSION_CLAIMS = os.getenv("USER_SESSION_CLAIMS", "false").lower() == "true"
+USER_SESSION_CLAIMS_TTL = float(os.getenv("USER_SESSION_CLAIMS_TTL", "300"))
+
+def store_session_claims(user):
+    if USER_SESSION_CLAIMS:
+        session['user_claims'] = dict(user_snapshot(user), iat=time.time())
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    claims = session.get('user_claims') if USER_SESSION_CLAIMS else None
+    if claims and claims.get('id') == user_id and time.time() - claims.get('iat', 0) < USER_SESSION_CLAIMS_TTL:
+        metrics.increment("user_loader_lookups_total", source="session")
+        return attach_user({field: claims[field] for field in ('id', 'username', 'email')})
+
+    snapshot = get_cached_user(user_id)
+    if snapshot:
+        metrics.increment("user_loader_lookups_total", source="cache")
+        user = attach_user(snapshot)
+    else:
+        metrics.increment("user_loader_lookups_total", source="database")
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        cache_user(user)
+    store_session_claims(user)
+    return user
+
+def create_test_user():
+    """Creates the development test user if it does not exist yet."""
+    if not User.query.filter_by(email='test@example.com').first():
+        user = User(username='test', email='test@example.com')
+        user.set_password('test123')
+        db.session.add(user)
+        db.session.commit()
+        print("✓ Created test user")
 
 # Database initialization - ONLY runs when explicitly called via CLI
 @app.cli.command("init-db")
@@ -83,74 +296,97 @@ def init_db_command():
     try:
         db.create_all()
         print("✓ Database tables created successfully")
+        from transcripts import ensure_history_columns
+        ensure_history_columns()
         
         # Optional: Create test user (remove in production)
-        if not User.query.filter_by(email='test@example.com').first():
-            user = User(username='test', email='test@example.com')
-            user.set_password('test123')
-            db.session.add(user)
-            db.session.commit()
-            print("✓ Created test user")
+        create_test_user()
     except Exception as e:
         print(f"✗ Error initializing database: {e}")
         raise
 
-# Ensure tables are created when app starts
+@app.cli.group()
+def maintenance():
+    """Periodic jobs such as history retention (see maintenance.py)."""
+
+@maintenance.command("run")
+@click.option("--once", is_flag=True, help="Run every due job once and exit.")
+@click.option("--job", "jobs", multiple=True, help="Only run this job (repeatable).")
+def maintenance_run_command(once, jobs):
+    """Run the maintenance jobs in this process."""
+    from maintenance import run
+    run(once=once, only=jobs)
+
+@maintenance.command("clean-media")
+def maintenance_clean_media_command():
+    """Delete this instance's old generated media once (gunicorn runs media_cleanup.py for this)."""
+    from media_cleanup import delete_old_generated_media
+    print(f"✓ Deleted {delete_old_generated_media(app.static_folder)} file(s)")
+
+@app.cli.group()
+def transcripts():
+    """Compact transcript storage (see transcripts.py)."""
+
+@transcripts.command("migrate")
+@click.option("--batch-size", default=500, show_default=True)
+def transcripts_migrate_command(batch_size):
+    """Convert JSON conversations in History.answer to the compact format."""
+    from transcripts import migrate_transcripts
+    converted, before, after = migrate_transcripts(batch_size)
+    print(f"✓ Converted {converted} conversation(s): {before} -> {after} bytes")
+
+@transcripts.command("train-dict")
+@click.option("--output", default=None, help="Also write a copy of the dictionary to this file.")
+@click.option("--samples", default=5000, show_default=True)
+def transcripts_train_dict_command(output, samples):
+    """Train a zstd dictionary on stored transcripts and store it in the database. Workers use it for new rows after a restart."""
+    from transcripts import train_transcript_dictionary
+    dict_id, used = train_transcript_dictionary(output, samples)
+    print(f"✓ Trained on {used} transcript(s), stored dictionary {dict_id}")
+
+@transcripts.command("import-dicts")
+@click.option("--dir", "directory", default=None, help="Folder with .dict files (default: TRANSCRIPT_DICT_DIR).")
+def transcripts_import_dicts_command(directory):
+    """Store dictionary files trained before dictionaries were kept in the database."""
+    from transcripts import import_dictionaries, TRANSCRIPT_DICT_DIR
+    dict_ids = import_dictionaries(directory or TRANSCRIPT_DICT_DIR)
+    print(f"✓ Stored {len(dict_ids)} dictionary(ies): {dict_ids}")
+
+@app.cli.group()
+def assets():
+    """Fingerprinted, precompressed CSS and JS (see utils/static_assets.py)."""
+
+@assets.command("build")
+def assets_build_command():
+    """Minify, fingerprint and compress static/css and static/js into static/dist."""
+    from utils.static_assets import build_assets
+    manifest = build_assets(app.static_folder)
+    print(f"✓ Built {len(manifest)} asset(s) into static/dist. Restart the workers to pick them up.")
+
 def ensure_tables_exist():
-    """Ensure database tables exist."""
+    """
+    Ensure database tables exist.
+    Called once at server start (gunicorn master or `python app.py`), never on import.
+    """
     try:
         with app.app_context():
             # Test connection first
-            db.engine.connect()
-            print("✓ Database connection successful")
+            with db.engine.connect():
+                print("✓ Database connection successful")
             
             # Create tables if they don't exist
             db.create_all()
             print("✓ Database tables verified/created")
-            
+            from transcripts import ensure_history_columns
+            ensure_history_columns()
+
+            # Don't hand pooled connections from this process to forked workers
+            db.engine.dispose()
             return True
     except Exception as e:
         print(f"✗ Database error: {e}")
         return False
 
-# Call this after app configuration
-ensure_tables_exist()
-
-def delete_old_history():
-    """A function that runs in the background to delete old history."""
-    with app.app_context():
-        try:
-            cutoff_date = datetime.utcnow() - timedelta(days=15)
-            old_records = History.query.filter(History.date_posted < cutoff_date).all()
-            
-            if old_records:
-                print(f"[{datetime.now()}] Deleting {len(old_records)} records older than {cutoff_date}...")
-                for record in old_records:
-                    db.session.delete(record)
-                db.session.commit()
-                print("Cleanup complete.")
-            else:
-                print(f"[{datetime.now()}] No old history records to delete.")
-        except Exception as e:
-            print(f"Error during cleanup: {e}")
-
-def process_uploaded_image(file_storage):
-    filename = secure_filename(file_storage.filename)
-    file_storage.seek(0)
-    if filename.lower().endswith(('.heic', '.heif')):
-        try:
-            pillow_heif.register_heif_opener()
-            image = Image.open(file_storage).convert("RGB")
-            buffer = io.BytesIO()
-            image.save(buffer, format="JPEG")
-            return buffer.getvalue(), ".jpg"
-        except Exception as e:
-            print(f"Error converting HEIC in memory: {e}")
-            return None, None
-    else:
-        _, ext = os.path.splitext(filename)
-        return file_storage.read(), ext
-
 def extract_youtube_id(url: str):
     if not url: return None
     try:
@@ -169,7 +405,10 @@ def extract_youtube_id(url: str):
 @app.route('/')
 @login_required
 def index():
-    user_history = History.query.filter_by(user_id=current_user.id).order_by(History.id.desc()).all()
+    # The sidebar only shows questions; transcripts are fetched from /history/<id> when opened
+    user_history = (History.query.filter_by(user_id=current_user.id)
+                    .options(defer(History.answer), defer(History.transcript))
+                    .order_by(History.id.desc()).all())
     return render_template('index.html', history=user_history)
 
 @app.route('/favicon.ico')
@@ -181,20 +420,58 @@ def favicon():
 def stream_video(encoded_url):
     try:
         video_url = base64.urlsafe_b64decode(encoded_url).decode('utf-8')
-        req = requests.get(video_url, stream=True, proxies={"http": None, "https": None})
-        req.raise_for_status()
-        return Response(req.iter_content(chunk_size=1024*1024), content_type=req.headers['content-type'])
+    except ValueError:
+        return "Invalid video URL.", 400
+    # Only Pexels clips are proxied; anything else would let callers make the server fetch arbitrary URLs
+    if not is_allowed_video_url(video_url):
+        return "Video host not allowed.", 400
+    try:
+        cached = video_cache.lookup(video_url)
+        if cached:
+            path, mimetype = cached
+            # conditional=True answers Range requests, so seeking works without refetching
+            response = send_file(path, mimetype=mimetype, conditional=True, max_age=86400)
+            response.headers['X-Video-Cache'] = 'hit'
+            return response
+        chunks, content_type = video_cache.stream(video_url)
+        return Response(chunks, content_type=content_type, headers={'X-Video-Cache': 'miss'})
+    except VideoNotAllowed:
+        return "Video host not allowed.", 400
     except Exception as e:
         print(f"Error streaming video: {e}")
         return "Failed to stream video.", 500
 
+def expire_audio_store():
+    """Drops audio the browser never fetched, e.g. because the tab was closed mid-answer."""
+    cutoff = time.monotonic() - AUDIO_STORE_TTL
+    with _audio_store_lock:
+        # Entries are kept in insertion order, so stop at the first fresh one
+        while in_memory_audio_store:
+            audio_id = next(iter(in_memory_audio_store))
+            future, _, created_at = in_memory_audio_store[audio_id]
+            if created_at > cutoff:
+                break
+            del in_memory_audio_store[audio_id]
+            future.cancel()
+            metrics.increment("audio_store_expired_total")
+
 @app.route('/stream-audio/<audio_id>')
 @login_required
 def stream_audio(audio_id):
-    audio_data = in_memory_audio_store.get(audio_id)
+    with _audio_store_lock:
+        entry = in_memory_audio_store.pop(audio_id, None)
+    if not entry:
+        return "Audio not found.", 404
+    future, mimetype, _ = entry
+    try:
+        # Waits only if this sentence is still being synthesized in the background
+        with span("tts_wait"):
+            audio_data = future.result(timeout=30)
+    except Exception as e:
+        print(f"Error waiting for audio {audio_id}: {e}")
+        audio_data = None
     if audio_data:
-        in_memory_audio_store.pop(audio_id, None)
-        return Response(audio_data, mimetype='audio/mpeg')
+        return Response(audio_data, mimetype=mimetype)
     else:
         return "Audio not found.", 404
 
@@ -208,27 +485,51 @@ def process_text_route():
     response_data = {}
     answer_for_db = ""
     status_code = 200
-    gemini_response = get_gemini_answer(user_text)
+    limit_user_request()
+    with span("intent_detection", provider="gemini"):
+        gemini_response = classify_intent(user_text)
     intent = gemini_response.get("intent")
     content = gemini_response.get("content")
+    metrics.set_trace_label("intent", intent if intent in KNOWN_INTENTS else "unknown")
 
+    # The tools take their provider's rate-limit slot only if they have to call it (see utils/response_cache.py)
     if intent == "fact_check":
         model_response = google_search_for_answer(content, conversation_history)
         answer_for_db = model_response
     elif intent == "find_image":
-        image_url, attribution = search_for_image_on_google(content)
+        candidates, attribution = search_images_on_google(content)
         answer_for_db = attribution or f"Couldn't find an image for '{content}'."
-        response_data["image_url"] = image_url
+        response_data["image_url"] = candidates[0]["url"] if candidates else None
+        response_data["media"] = {"type": "image", "candidates": candidates}
     elif intent == "find_gif":
-        gif_url, attribution = search_for_gif_on_giphy(content)
+        candidates, attribution = search_gifs_on_giphy(content)
         answer_for_db = attribution or f"Couldn't find a GIF for '{content}'."
-        response_data["gif_url"] = gif_url
+        response_data["gif_url"] = candidates[0]["url"] if candidates else None
+        response_data["media"] = {"type": "gif", "candidates": candidates}
     elif intent == "find_youtube_video":
-        video_url, attribution = search_for_video_on_youtube(content)
-        video_id = extract_youtube_id(video_url)
+        candidates, attribution = search_videos_on_youtube(content)
+        answer_for_db = attribution or f"Couldn't find a video for '{content}'."
+        embeddable = []
+        for candidate in candidates:
+            video_id = extract_youtube_id(candidate["url"])
+            if video_id:
+                embeddable.append(dict(candidate, embed_url=f"https://www.youtube.com/embed/{video_id}",
+                                       thumbnail=candidate.get("thumbnail") or f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"))
+        if embeddable:
+            response_data["youtube_embed_url"] = embeddable[0]["embed_url"]
+        response_data["media"] = {"type": "youtube", "candidates": embeddable}
+    elif intent == "find_pexels_video":
+        videos, attribution = search_videos_on_pexels(content)
         answer_for_db = attribution or f"Couldn't find a video for '{content}'."
-        if video_id:
-            response_data["youtube_embed_url"] = f"https://www.youtube.com/embed/{video_id}"
+        hints = client_hints(request.headers, data.get('client'))
+        candidates = []
+        for video in videos:
+            rendition = choose_rendition(video["renditions"], **hints)
+            encoded_url = base64.urlsafe_b64encode(rendition["link"].encode('utf-8')).decode('ascii')
+            candidates.append({"url": url_for('stream_video', encoded_url=encoded_url), "width": rendition["width"],
+                               "thumbnail": video["thumbnail"], "attribution": video["attribution"]})
+        response_data["video_url"] = candidates[0]["url"] if candidates else None
+        response_data["media"] = {"type": "video", "candidates": candidates}
     elif intent == "answer_text":
         model_response = generate_conversational_answer(content, conversation_history)
         answer_for_db = model_response
@@ -236,38 +537,75 @@ def process_text_route():
         answer_for_db = "Sorry, I couldn't understand that."
         status_code = 400
 
-    summary_for_speech = (answer_for_db.split('.')[0] + '.') if '.' in answer_for_db else answer_for_db
-    audio_bytes = convert_text_to_speech(summary_for_speech)
-
-    if audio_bytes:
-        audio_id = str(uuid.uuid4())
-        in_memory_audio_store[audio_id] = audio_bytes
-        audio_url = url_for('stream_audio', audio_id=audio_id)
-        response_data["audio_url"] = audio_url
-    else:
-        response_data["audio_url"] = None
+    # Each sentence is synthesized in the background; the browser plays them in order
+    expire_audio_store()
+    tts_backend = get_tts_backend()
+    audio_urls = []
+    with span("tts_queue", provider=tts_backend.name):
+        for future in synthesize_sentences(split_into_sentences(answer_for_db), tts_backend):
+            audio_id = str(uuid.uuid4())
+            with _audio_store_lock:
+                in_memory_audio_store[audio_id] = (future, tts_backend.mimetype, time.monotonic())
+            audio_urls.append(url_for('stream_audio', audio_id=audio_id))
+    response_data["audio_urls"] = audio_urls
+    response_data["audio_url"] = audio_urls[0] if audio_urls else None
 
     response_data["text_response"] = answer_for_db
 
     if answer_for_db and status_code == 200:
         full_conversation = conversation_history + [{"role": "user", "parts": [{"text": user_text}]}, {"role": "model", "parts": [{"text": answer_for_db}]}]
-        if not db_id:
-            new_log = History(question=user_text, answer=json.dumps(full_conversation), author=current_user)
-            db.session.add(new_log)
-            db.session.commit()
-            response_data['db_id'] = new_log.id
-        else:
-            existing_log = db.session.get(History, db_id)
-            if existing_log and existing_log.user_id == current_user.id:
-                existing_log.answer = json.dumps(full_conversation)
+        with span("db_commit", provider="database"):
+            if not db_id:
+                new_log = History(question=user_text, conversation=full_conversation, author=current_user)
+                db.session.add(new_log)
                 db.session.commit()
+                response_data['db_id'] = new_log.id
+            else:
+                # Committed in the background; the browser doesn't need to wait for it
+                history_writer.update(int(db_id), current_user.id, full_conversation)
+                # Once committed it may take a moment to reach the replicas; read it from the primary until then
+                db_router.stick()
     return jsonify(response_data), status_code
 
+@app.route('/history/export')
+@login_required
+def export_history():
+    """
+    Streams the user's conversations as NDJSON (default) or as a zip holding the same file.
+    A long export ends with a resume_after_id record; pass it back as after_id for the rest.
+    """
+    from history_export import export_ndjson, export_zip
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'zip'):
+        return jsonify({'error': 'format must be ndjson or zip.'}), 400
+    exporter, mimetype = (export_zip, 'application/zip') if export_format == 'zip' else (export_ndjson, 'application/x-ndjson')
+    after_id = request.args.get('after_id', 0, type=int)
+    filename = f"history-{current_user.username}-{time.strftime('%Y%m%d')}.{export_format}"
+    return Response(stream_with_context(exporter(current_user.id, after_id=after_id)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{secure_filename(filename)}"',
+        'Cache-Control': 'no-store',
+        # Let proxies pass chunks through as they come instead of buffering the whole export
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/history/<int:history_id>')
+@login_required
+def get_history(history_id):
+    """One saved conversation, loaded when the user opens it instead of with every page."""
+    history_item = db.session.get(History, history_id)
+    if not history_item or history_item.user_id != current_user.id:
+        return jsonify({'error': 'Item not found or unauthorized.'}), 404
+    conversation = history_writer.pending_conversation(history_id, current_user.id) or history_item.conversation
+    if conversation is None:
+        return jsonify({'question': history_item.question, 'answer': history_item.answer})
+    return jsonify({'question': history_item.question, 'conversation': conversation})
+
 @app.route('/delete-history/<int:history_id>', methods=['POST'])
 @login_required
 def delete_history(history_id):
     history_item = db.session.get(History, history_id)
     if history_item and history_item.user_id == current_user.id:
+        history_writer.discard(history_id)
         db.session.delete(history_item)
         db.session.commit()
         return jsonify({'success': True, 'message': 'History deleted.'})
@@ -277,6 +615,7 @@ def delete_history(history_id):
 @login_required
 def upload_image_route():
     print("DEBUG: /upload-image called")  # Added debug
+    check_upload_size()
     if 'image' not in request.files: 
         print("ERROR: No image in request")  # Added debug
         return jsonify({'error': 'No image file provided'}), 400
@@ -285,22 +624,19 @@ def upload_image_route():
     if file.filename == '': return jsonify({'error': 'No image selected'}), 400
 
     if file:
+        upload = open_image_upload(file)
         try:  # Added try-except
-            image_bytes, ext = process_uploaded_image(file)
-            if not image_bytes:
-                print("ERROR: Failed to process image")  # Added debug
-                return jsonify({'error': 'Failed to process image file.'}), 500
-
-            print(f"DEBUG: Image processed, {len(image_bytes)} bytes")  # Added debug
+            print(f"DEBUG: Image processed, {len(upload.data)} bytes")  # Added debug
             sketch_folder = os.path.join(app.static_folder, 'sketches')
             os.makedirs(sketch_folder, exist_ok=True)
             
             base_name, _ = os.path.splitext(secure_filename(file.filename))
-            unique_filename = f"{current_user.id}_{os.urandom(8).hex()}_{base_name}{ext}"
+            unique_filename = f"{current_user.id}_{os.urandom(8).hex()}_{base_name}{upload.ext}"
             output_path = os.path.join(sketch_folder, unique_filename)
             
             print(f"DEBUG: Output path: {output_path}")  # Added debug
-            success = generate_sketch(image_bytes, output_path)
+            with span("sketch_render"):
+                success = generate_sketch(upload.data, output_path)
             
             if success:
                 sketch_url = url_for('static', filename=f'sketches/{unique_filename}')
@@ -314,10 +650,45 @@ def upload_image_route():
             import traceback
             traceback.print_exc()
             return jsonify({'error': f'Server error: {str(e)}'}), 500
+        finally:
+            upload.close()
+
+@app.route('/sketch-video', methods=['POST'])
+@login_required
+def sketch_video_route():
+    """Starts turning an uploaded clip into a sketch video; poll the returned status_url for progress."""
+    check_upload_size(VIDEO_SKETCH_MAX_MB)
+    if 'video' not in request.files: return jsonify({'error': 'No video file provided'}), 400
+    file = request.files['video']
+    if file.filename == '': return jsonify({'error': 'No video selected'}), 400
+
+    _, ext = os.path.splitext(secure_filename(file.filename))
+    fd, input_path = tempfile.mkstemp(prefix='sketch-upload-', suffix=ext)
+    with os.fdopen(fd, 'wb') as f:
+        file.save(f)
+    output_dir = os.path.join(app.static_folder, 'sketch_videos')
+    try:
+        job_id = video_sketch_jobs.submit(input_path, output_dir, current_user.id)
+    except JobsFull:
+        os.unlink(input_path)
+        return jsonify({'error': 'Too many videos are being sketched right now. Please try again shortly.'}), 503
+    return jsonify({'job_id': job_id, 'status_url': url_for('sketch_video_status', job_id=job_id)}), 202
+
+@app.route('/sketch-video/<job_id>')
+@login_required
+def sketch_video_status(job_id):
+    status = video_sketch_jobs.status(job_id)
+    if not status or status.get('user_id') != current_user.id:
+        return jsonify({'error': 'Job not found.'}), 404
+    response = {key: value for key, value in status.items() if key not in ('user_id', 'filename')}
+    if status.get('filename'):
+        response['video_url'] = url_for('static', filename=f"sketch_videos/{status['filename']}")
+    return jsonify(response)
 
 @app.route('/generate-meme', methods=['POST'])
 @login_required
 def generate_meme_route():
+    check_upload_size()
     if 'image' not in request.files: return jsonify({'error': 'No image file provided'}), 400
     file = request.files['image']
     top_text = request.form.get('top_text', '')
@@ -325,18 +696,16 @@ def generate_meme_route():
     if file.filename == '': return jsonify({'error': 'No image selected'}), 400
 
     if file:
-        image_bytes, ext = process_uploaded_image(file)
-        if not image_bytes:
-            return jsonify({'error': 'Failed to process image file.'}), 500
-            
         meme_folder = os.path.join(app.static_folder, 'memes')
         os.makedirs(meme_folder, exist_ok=True)
 
-        base_name, _ = os.path.splitext(secure_filename(file.filename))
-        unique_filename = f"{current_user.id}_{os.urandom(8).hex()}_{base_name}{ext}"
-        output_path = os.path.join(meme_folder, unique_filename)
+        with open_image_upload(file) as upload:
+            base_name, _ = os.path.splitext(secure_filename(file.filename))
+            unique_filename = f"{current_user.id}_{os.urandom(8).hex()}_{base_name}{upload.ext}"
+            output_path = os.path.join(meme_folder, unique_filename)
 
-        success = generate_meme(image_bytes, output_path, top_text, bottom_text)
+            with span("meme_render"):
+                success = generate_meme(upload.data, output_path, top_text, bottom_text)
 
         if success:
             meme_url = url_for('static', filename=f'memes/{unique_filename}')
@@ -344,19 +713,39 @@ def generate_meme_route():
         else:
             return jsonify({'error': 'Failed to generate meme'}), 500
 
+@app.route('/meme-preview', methods=['POST'])
+@login_required
+def meme_preview_route():
+    """Small JPEG of the meme as it will look, re-rendered as the user types a caption."""
+    check_upload_size()
+    if 'image' not in request.files: return jsonify({'error': 'No image file provided'}), 400
+    try:
+        with open_image_upload(request.files['image']) as upload, span("meme_preview"):
+            preview = render_meme_preview(upload.data, request.form.get('top_text', ''),
+                                          request.form.get('bottom_text', ''))
+    except UploadRejected:
+        raise
+    except Exception as e:
+        print(f"Error rendering meme preview: {e}")
+        return jsonify({'error': 'Failed to render preview'}), 500
+    return Response(preview, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
 @app.route('/suggest-meme-text', methods=['POST'])
 @login_required
 def suggest_meme_text_route():
+    check_upload_size()
     if 'image' not in request.files: return jsonify({'error': 'No image file provided'}), 400
     file = request.files['image']
     if file.filename == '': return jsonify({'error': 'No image selected'}), 400
 
     if file:
-        image_bytes, _ = process_uploaded_image(file)
-        if not image_bytes:
-            return jsonify({'error': 'Could not process image for suggestion.'}), 500
-            
-        success, suggestion = get_meme_suggestion(image_bytes)
+        with open_image_upload(file) as upload:
+            # Gemini needs the bytes themselves
+            image_bytes = bytes(upload.data)
+
+        limit_user_request()
+        with upstream_call("gemini"):
+            success, suggestion = get_meme_suggestion(image_bytes)
         if success:
             return jsonify(suggestion)
         else:
@@ -383,6 +772,8 @@ def login():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
             login_user(user, remember=form.remember.data)
+            cache_user(user)
+            store_session_claims(user)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
@@ -392,6 +783,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    session.pop('user_claims', None)
     logout_user()
     return redirect(url_for('login'))
 
@@ -413,6 +805,9 @@ def edit_profile():
         if form.password.data:
             current_user.set_password(form.password.data)
         db.session.commit()
+        invalidate_user(current_user.id)
+        session.pop('user_claims', None)
+        store_session_claims(current_user)
         flash('Your account has been updated!', 'success')
         return redirect(url_for('profile'))
     elif request.method == 'GET':
@@ -420,11 +815,7 @@ def edit_profile():
         form.email.data = current_user.email
     return render_template('edit_profile.html', title='Edit Profile', form=form)
 
-# START THE SCHEDULER
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(delete_old_history, 'interval', hours=24)
-scheduler.start()
-
 # Required for Render deployment
 if __name__ == '__main__':
-    app.run(debug=False)
\ No newline at end of file
+    ensure_tables_exist()
+    app.run(debug=False)
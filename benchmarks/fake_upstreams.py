@@ -0,0 +1,277 @@
+# benchmarks/fake_upstreams.py
+"""
+Local stand-ins for Gemini, SerpApi, Giphy, Pexels and gTTS.
+
+Each fake runs on its own port and answers with canned payloads shaped like the
+real API, after a random delay drawn from a configurable distribution. A share
+of requests can be failed on purpose to exercise error paths.
+
+    python benchmarks/fake_upstreams.py --config benchmarks/upstreams.example.json
+
+prints the env vars that point the app at the fakes and serves until Ctrl+C.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_CONFIG = {
+    "gemini": {"latency_ms": {"dist": "lognormal", "median": 600, "sigma": 0.4}, "error_rate": 0.0},
+    "serpapi": {"latency_ms": {"dist": "lognormal", "median": 900, "sigma": 0.5}, "error_rate": 0.0},
+    "giphy": {"latency_ms": {"dist": "lognormal", "median": 150, "sigma": 0.3}, "error_rate": 0.0},
+    "pexels": {"latency_ms": {"dist": "lognormal", "median": 200, "sigma": 0.3}, "error_rate": 0.0},
+    "gtts": {"latency_ms": {"dist": "lognormal", "median": 250, "sigma": 0.3}, "error_rate": 0.0},
+}
+
+# A few hundred bytes that look enough like MP3 for the browser-less benchmark
+FAKE_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\xff\xfb\x90\x64" + b"\x00" * 400
+
+
+def sample_latency(spec):
+    """Returns a delay in seconds for a latency spec such as {"dist": "lognormal", "median": 300, "sigma": 0.5}."""
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        ms = spec.get("value", 0)
+    elif dist == "uniform":
+        ms = random.uniform(spec.get("min", 0), spec.get("max", 0))
+    elif dist == "normal":
+        ms = random.gauss(spec.get("mean", 0), spec.get("stddev", 0))
+    elif dist == "lognormal":
+        ms = random.lognormvariate(0, spec.get("sigma", 0.5)) * spec.get("median", 0)
+    elif dist == "exponential":
+        ms = random.expovariate(1.0 / spec["mean"]) if spec.get("mean") else 0
+    else:
+        raise ValueError(f"Unknown latency distribution '{dist}'")
+    return max(ms, 0) / 1000.0
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Base handler: applies latency and error injection, then calls respond()."""
+    protocol_version = "HTTP/1.1"
+    settings = {}
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        time.sleep(sample_latency(self.settings.get("latency_ms", {})))
+        with self.stats["lock"]:
+            self.stats["requests"] += 1
+        if random.random() < self.settings.get("error_rate", 0):
+            with self.stats["lock"]:
+                self.stats["errors"] += 1
+            self._send(self.settings.get("error_status", 503), {"error": "injected failure"})
+            return
+        url = urlparse(self.path)
+        self.respond(url.path, {k: v[0] for k, v in parse_qs(url.query).items()}, body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def _send(self, status, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def respond(self, path, params, body):
+        raise NotImplementedError
+
+
+INTENT_KEYWORDS = [
+    ("gif", "find_gif"),
+    ("picture", "find_image"),
+    ("image", "find_image"),
+    ("photo", "find_image"),
+    ("song", "find_youtube_video"),
+    ("video of the", "find_pexels_video"),
+    ("video", "find_youtube_video"),
+    ("when", "fact_check"),
+    ("what is", "fact_check"),
+]
+
+
+def fake_intent(user_text):
+    intent = next((i for kw, i in INTENT_KEYWORDS if kw in user_text.lower()), "answer_text")
+    return {"intent": intent, "content": user_text}
+
+
+class GeminiHandler(FakeHandler):
+    """Answers generateContent calls; intent prompts get a JSON intent back."""
+
+    def respond(self, path, params, body):
+        request = json.loads(body or b"{}")
+        prompt = " ".join(
+            part.get("text", "")
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        if "User's Requests:" in prompt:
+            # Batched intent prompt from utils/intent_batcher.py
+            user_requests = json.loads(prompt.split("User's Requests:", 1)[1].strip())
+            text = json.dumps([dict(fake_intent(item["text"]), id=item["id"]) for item in user_requests])
+        elif "Analyze the user's request" in prompt:
+            match = re.search(r'User\'s Request: "(.*)"', prompt)
+            text = json.dumps(fake_intent(match.group(1) if match else ""))
+        elif "meme expert" in prompt:
+            text = json.dumps({"top_text": "WHEN THE BENCHMARK", "bottom_text": "FINALLY PASSES"})
+        else:
+            text = "This is a canned answer. It has a few sentences. Each one is spoken separately."
+        self._send(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+        })
+
+
+class SerpApiHandler(FakeHandler):
+    def respond(self, path, params, body):
+        engine = params.get("engine", "google")
+        query = params.get("q", "")
+        if engine == "google_images":
+            payload = {"images_results": [
+                {"original": f"https://images.example.com/{i}.jpg", "thumbnail": f"https://images.example.com/{i}_t.jpg",
+                 "title": f"{query} {i}"} for i in range(10)
+            ]}
+        elif engine == "google_videos":
+            payload = {"video_results": [
+                {"link": f"https://www.youtube.com/watch?v=vid{i:08d}", "title": f"{query} official video {i}",
+                 "channel": "T-Series" if i == 3 else f"channel {i}", "length": "4:12"} for i in range(10)
+            ]}
+        else:
+            payload = {"answer_box": {"answer": f"A canned fact about {query}."}}
+        self._send(200, payload)
+
+
+class GiphyHandler(FakeHandler):
+    def respond(self, path, params, body):
+        limit = int(params.get("limit", 1))
+        self._send(200, {"data": [
+            {"id": f"gif{i}", "images": {"original": {"url": f"https://media.giphy.example/{i}.gif"},
+                                          "fixed_width_small": {"url": f"https://media.giphy.example/{i}_s.gif"}}}
+            for i in range(limit)
+        ]})
+
+
+class PexelsHandler(FakeHandler):
+    def respond(self, path, params, body):
+        per_page = int(params.get("per_page", 1))
+        if path.endswith("/videos/search"):
+            self._send(200, {"videos": [
+                {"id": i, "user": {"name": "Fake Pexels"}, "image": f"https://pexels.example/{i}.jpg", "video_files": [
+                    {"file_type": "video/mp4", "width": w, "height": w * 9 // 16, "quality": q,
+                     "link": f"https://pexels.example/{i}_{w}.mp4"}
+                    for w, q in ((640, "sd"), (1280, "hd"), (1920, "hd"))
+                ]} for i in range(per_page)
+            ]})
+        else:
+            self._send(200, {"photos": [
+                {"id": i, "photographer": "Fake Pexels", "src": {"large": f"https://pexels.example/{i}.jpg"}}
+                for i in range(per_page)
+            ]})
+
+
+class GTTSHandler(FakeHandler):
+    """Mimics Google Translate's batchexecute endpoint that gTTS parses line by line."""
+
+    def respond(self, path, params, body):
+        audio = base64.b64encode(FAKE_MP3).decode("ascii")
+        line = ')]}\'\n\n[["wrb.fr","jQ1olc","[\\"' + audio + '\\"]",null,null,null,"generic"]]\n'
+        self._send(200, line.encode("utf-8"), content_type="application/json; charset=utf-8")
+
+
+HANDLERS = {
+    "gemini": GeminiHandler,
+    "serpapi": SerpApiHandler,
+    "giphy": GiphyHandler,
+    "pexels": PexelsHandler,
+    "gtts": GTTSHandler,
+}
+
+
+class FakeUpstreams:
+    """Starts every fake on its own localhost port in background threads."""
+
+    def __init__(self, config=None, host="127.0.0.1"):
+        self.config = {name: dict(DEFAULT_CONFIG[name], **(config or {}).get(name, {})) for name in HANDLERS}
+        self.host = host
+        self.servers = {}
+        self.stats = {}
+
+    def start(self):
+        for name, handler in HANDLERS.items():
+            stats = {"requests": 0, "errors": 0, "lock": threading.Lock()}
+            handler_class = type(f"{handler.__name__}Configured", (handler,),
+                                 {"settings": self.config[name], "stats": stats})
+            server = ThreadingHTTPServer((self.host, 0), handler_class)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"fake-{name}", daemon=True).start()
+            self.servers[name] = server
+            self.stats[name] = stats
+        return self
+
+    def url(self, name):
+        host, port = self.servers[name].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables that point the app (and benchmarks/loadtest_app.py) at the fakes."""
+        return {
+            "GEMINI_API_ENDPOINT": self.url("gemini"),
+            "SERPAPI_BASE": self.url("serpapi"),
+            "GIPHY_API_BASE": self.url("giphy"),
+            "PEXELS_API_BASE": self.url("pexels"),
+            "GTTS_BASE": self.url("gtts"),
+            "GOOGLE_API_KEY": "fake-key",
+            "SERPAPI_API_KEY": "fake-key",
+            "GIPHY_API_KEY": "fake-key",
+            "PEXELS_API_KEY": "fake-key",
+            "TTS_BACKEND": "gtts",
+        }
+
+    def snapshot(self):
+        return {name: {"requests": s["requests"], "errors": s["errors"]} for name, s in self.stats.items()}
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def load_config(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="JSON file with per-upstream latency/error settings")
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(load_config(args.config)).start()
+    for key, value in upstreams.env().items():
+        print(f"export {key}='{value}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
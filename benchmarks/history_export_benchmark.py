@@ -0,0 +1,117 @@
+# benchmarks/history_export_benchmark.py
+"""
+Measures memory and throughput of the history export on a large fixture.
+
+    python benchmarks/history_export_benchmark.py --conversations 20000 --turns 20
+
+Fills a throwaway SQLite database with one user's history, then exports it
+three ways: the naive way (History.query...all() plus one json.dumps), and
+the streaming NDJSON and zip exports from history_export.py. For each it
+reports output bytes, rows per second, and peak Python memory (tracemalloc,
+measured in a separate pass so it doesn't skew the timing). Results are
+printed as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="history-export-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ["HISTORY_WRITE_BEHIND"] = "false"
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, History  # noqa: E402
+from history_export import export_ndjson, export_zip  # noqa: E402
+from utils.transcript_codec import encode_transcript  # noqa: E402
+
+WORDS = ("the a is of to and in that it for you with on this be are as at can your video song image gif "
+         "sure here's what I found about weather today rain sunny temperature match score final").split()
+
+
+def make_conversation(rng, turns):
+    conversation = []
+    for _ in range(turns // 2):
+        conversation.append({"role": "user", "parts": [{"text": " ".join(rng.choice(WORDS) for _ in range(8))}]})
+        answer = " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+        conversation.append({"role": "model", "parts": [{"text": answer}]})
+    return conversation
+
+
+def build_fixture(conversations, turns):
+    rng = random.Random(0)
+    db.create_all()
+    user = User(username="bench", email="bench@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    batch = []
+    for _ in range(conversations):
+        conversation = make_conversation(rng, turns)
+        batch.append({"question": conversation[0]["parts"][0]["text"], "answer": "", "user_id": user.id,
+                      "transcript": encode_transcript(conversation), "turn_count": len(conversation)})
+        if len(batch) == 1000:
+            db.session.execute(insert(History), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(History), batch)
+    db.session.commit()
+    return user.id
+
+
+def naive_export(user_id):
+    rows = History.query.filter_by(user_id=user_id).order_by(History.id).all()
+    data = json.dumps([{"id": row.id, "question": row.question, "date_posted": row.date_posted.isoformat(),
+                        "conversation": row.conversation} for row in rows])
+    yield data.encode("utf-8")
+
+
+def run(exporter, user_id, trace):
+    db.session.expunge_all()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    total = sum(len(chunk) for chunk in exporter(user_id))
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    db.session.rollback()
+    return total, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--skip-naive", action="store_true", help="Leave out the load-everything export.")
+    args = parser.parse_args()
+
+    # Without the time limit, so every run exports the whole history
+    exporters = [("ndjson", lambda user_id: export_ndjson(user_id, max_seconds=0)),
+                 ("zip", lambda user_id: export_zip(user_id, max_seconds=0))]
+    if not args.skip_naive:
+        exporters.insert(0, ("naive", naive_export))
+    with app.app_context():
+        user_id = build_fixture(args.conversations, args.turns)
+        results = []
+        for name, exporter in exporters:
+            total, elapsed, _ = run(exporter, user_id, trace=False)
+            _, _, peak = run(exporter, user_id, trace=True)
+            results.append({"export": name, "bytes": total, "seconds": elapsed,
+                            "rows_per_second": args.conversations / elapsed, "peak_mb": peak / 2 ** 20})
+    print(json.dumps({"conversations": args.conversations, "turns": args.conversations * args.turns,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# benchmarks/loadtest.py
+"""
+Offline load test: runs the app under different worker models against the
+fake upstreams and reports latency percentiles and throughput as JSON.
+
+    python benchmarks/loadtest.py --models sync gthread --concurrency 16 --duration 20 --output results.json
+    python benchmarks/loadtest.py --upstreams benchmarks/upstreams.example.json
+
+Worker models whose server package is not installed (gevent, uvicorn/asgiref)
+are reported as skipped. Compare two result files with --compare OLD NEW.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstreams import FakeUpstreams, load_config  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Created by loadtest_app.py in the server's throwaway database
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+ENDPOINTS = ["/process-text", "/upload-image", "/generate-meme"]
+
+PROMPTS = [
+    "what is the capital of France",
+    "write a short poem about the sea",
+    "find a gif of a cat typing",
+    "show me a picture of the Eiffel Tower",
+    "arijit singh song video",
+    "when was diwali celebrated in 2024",
+]
+
+
+def server_command(model, workers, threads, port):
+    """Returns the command that serves benchmarks/loadtest_app.py with the given worker model."""
+    gunicorn = [sys.executable, "-m", "gunicorn", "--pythonpath", BENCH_DIR, "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers), "--timeout", "120"]
+    if model == "sync":
+        return gunicorn + ["--worker-class", "sync", "loadtest_app:app"]
+    if model == "gthread":
+        return gunicorn + ["--worker-class", "gthread", "--threads", str(threads), "loadtest_app:app"]
+    if model == "gevent":
+        return gunicorn + ["--worker-class", "gevent", "--worker-connections", "1000", "loadtest_app:app"]
+    if model == "asgi":
+        return [sys.executable, "-m", "uvicorn", "--app-dir", BENCH_DIR, "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning", "loadtest_app:asgi_app"]
+    raise ValueError(f"Unknown worker model '{model}'")
+
+
+REQUIRED_MODULES = {"sync": ["gunicorn"], "gthread": ["gunicorn"], "gevent": ["gunicorn", "gevent"],
+                    "asgi": ["uvicorn", "asgiref"]}
+
+
+def missing_modules(model):
+    import importlib.util
+    return [m for m in REQUIRED_MODULES[model] if importlib.util.find_spec(m) is None]
+
+
+def make_test_image():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.effect_noise((640, 480), 64).convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(ms for ms, ok in samples if ok)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "requests_per_sec": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+    }
+
+
+def wait_until_ready(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/login", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def logged_in_session(base_url):
+    session = requests.Session()
+    response = session.post(f"{base_url}/login", data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD},
+                             allow_redirects=False, timeout=10)
+    if response.status_code != 302:
+        raise RuntimeError(f"Benchmark login failed with status {response.status_code}")
+    return session
+
+
+def send(session, base_url, endpoint, image_bytes, prompt):
+    if endpoint == "/process-text":
+        return session.post(f"{base_url}{endpoint}", json={"text_input": prompt, "history": []}, timeout=120)
+    files = {"image": ("bench.jpg", image_bytes, "image/jpeg")}
+    data = {"top_text": "load test", "bottom_text": "in progress"} if endpoint == "/generate-meme" else None
+    return session.post(f"{base_url}{endpoint}", files=files, data=data, timeout=120)
+
+
+def run_phase(base_url, endpoint, concurrency, duration, image_bytes):
+    """Hammers one endpoint with `concurrency` logged-in clients for `duration` seconds."""
+    samples = []
+    lock = threading.Lock()
+    prompts = itertools.cycle(PROMPTS)
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        session = logged_in_session(base_url)
+        local = []
+        while time.perf_counter() < stop_at:
+            with lock:
+                prompt = next(prompts)
+            start = time.perf_counter()
+            try:
+                ok = send(session, base_url, endpoint, image_bytes, prompt).status_code < 500
+            except requests.RequestException:
+                ok = False
+            local.append(((time.perf_counter() - start) * 1000, ok))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - start)
+
+
+def run_model(model, args, upstreams, image_bytes):
+    missing = missing_modules(model)
+    if missing:
+        return {"status": "skipped", "reason": f"missing modules: {', '.join(missing)}"}
+
+    port = random.randint(20000, 40000)
+    base_url = f"http://127.0.0.1:{port}"
+    db_dir = tempfile.mkdtemp(prefix="loadtest-")
+    env = dict(os.environ, **upstreams.env())
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(db_dir, 'bench.db')}",
+        "PYTHONUNBUFFERED": "true",
+        # Every client logs in as the same bench user; measure the app, not the per-user limit
+        "RATE_LIMIT_USER": os.getenv("RATE_LIMIT_USER", ""),
+    })
+    proc = subprocess.Popen(server_command(model, args.workers, args.threads, port), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        if not wait_until_ready(base_url):
+            return {"status": "failed", "reason": "server did not become ready"}
+        before = upstreams.snapshot()
+        endpoints = {}
+        for endpoint in args.endpoints:
+            if endpoint != "/process-text" and image_bytes is None:
+                endpoints[endpoint] = {"status": "skipped", "reason": "Pillow is needed to build the test image"}
+                continue
+            endpoints[endpoint] = run_phase(base_url, endpoint, args.concurrency, args.duration, image_bytes)
+        after = upstreams.snapshot()
+        return {
+            "status": "ok",
+            "endpoints": endpoints,
+            "upstream_requests": {name: after[name]["requests"] - before[name]["requests"] for name in after},
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def compare(old_path, new_path):
+    """Prints the p95 and requests/sec change for every model and endpoint present in both files."""
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    report = {}
+    for model, new_result in new.items():
+        old_endpoints = old.get(model, {}).get("endpoints", {})
+        for endpoint, stats in new_result.get("endpoints", {}).items():
+            before = old_endpoints.get(endpoint)
+            if not before or "p95_ms" not in before or "p95_ms" not in stats or not before["p95_ms"]:
+                continue
+            report[f"{model} {endpoint}"] = {
+                "p95_change_pct": round((stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100, 1),
+                "rps_change_pct": round((stats["requests_per_sec"] - before["requests_per_sec"])
+                                        / before["requests_per_sec"] * 100, 1) if before["requests_per_sec"] else None,
+            }
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["sync", "gthread", "gevent", "asgi"],
+                        choices=["sync", "gthread", "gevent", "asgi"])
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="threads per gthread worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent logged-in clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per endpoint")
+    parser.add_argument("--upstreams", help="JSON file with fake upstream latency/error settings")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports and exit")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    try:
+        image_bytes = make_test_image()
+    except ImportError:
+        image_bytes = None
+
+    upstreams = FakeUpstreams(load_config(args.upstreams)).start()
+    try:
+        results = {model: run_model(model, args, upstreams, image_bytes) for model in args.models}
+    finally:
+        upstreams.stop()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+        "upstreams": upstreams.config,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# benchmarks/loadtest_app.py
+"""
+WSGI/ASGI entry point used by benchmarks/loadtest.py.
+
+It is the normal app plus the bits a headless load test needs: gTTS is sent to
+the fake upstream (GTTS_BASE), CSRF is off so the driver can log in with a
+plain POST, and a benchmark user exists. Never deploy this module.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+from loadtest import BENCH_EMAIL, BENCH_PASSWORD  # noqa: E402
+
+if os.getenv("GTTS_BASE"):
+    import gtts.tts
+
+    def _fake_translate_url(tld="com", path=""):
+        return f"{os.environ['GTTS_BASE']}/{path}"
+
+    gtts.tts._translate_url = _fake_translate_url
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+with app.app_context():
+    db.create_all()
+    if not User.query.filter_by(email=BENCH_EMAIL).first():
+        user = User(username="bench", email=BENCH_EMAIL)
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+    db.engine.dispose()
+
+
+def _asgi_app():
+    from asgiref.wsgi import WsgiToAsgi
+    return WsgiToAsgi(app)
+
+
+def __getattr__(name):
+    # Only build the ASGI wrapper (and import asgiref) when uvicorn asks for it
+    if name == "asgi_app":
+        return _asgi_app()
+    raise AttributeError(name)
@@ -0,0 +1,92 @@
+# benchmarks/ranking_benchmark.py
+"""
+Microbenchmark for YouTube result ranking.
+
+    python benchmarks/ranking_benchmark.py --sizes 10 1000 100000
+
+Times the original three-bucket ranking (list scans and .lower() per video)
+against utils/youtube_ranking.py on synthetic SerpApi results and prints JSON.
+top_overlap counts how many of the leading --top videos both rankings share;
+they differ only where an official channel uploads a playlist, which the new
+ranking puts after that channel's regular videos.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.youtube_ranking import ranking_config  # noqa: E402
+
+LEGACY_OFFICIAL_CHANNELS = [
+    "t-series", "sonymusic", "yrf", "saregama", "shemaroo",
+    "tips official", "zee music", "eros now", "universal music"
+]
+LEGACY_PLAYLIST_KEYWORDS = ["playlist", "jukebox", "compilation", "hits"]
+
+
+def legacy_rank(videos):
+    """The ranking search_videos_on_youtube used before utils/youtube_ranking.py."""
+    official, regular, fallback = [], [], []
+    for video in videos:
+        channel_name = video.get("channel", "").lower()
+        title = video.get("title", "").lower()
+        length = video.get("length", "")
+        if any(official_name in channel_name for official_name in LEGACY_OFFICIAL_CHANNELS):
+            official.append(video)
+        elif any(kw in title for kw in LEGACY_PLAYLIST_KEYWORDS) or length.count(':') == 2:
+            fallback.append(video)
+        else:
+            regular.append(video)
+    return official + regular + fallback
+
+
+def make_videos(count, seed=0):
+    rng = random.Random(seed)
+    channels = ["T-Series", "Sony Music India", "SonyMusicIndiaVEVO", "Random Vlogs", "Cover Artist",
+                "Lyrics Hub", "Zee Music Company", "Indie Label", "Fan Edits"]
+    titles = ["Official Video", "Lyrical", "Full Song", "Audio Jukebox", "Top 50 Hits Playlist",
+              "Live Performance", "Reaction", "Cover", "Non-Stop Compilation"]
+    return [{
+        "link": f"https://www.youtube.com/watch?v={i:011d}",
+        "channel": rng.choice(channels),
+        "title": f"Song {i} | {rng.choice(titles)}",
+        "length": rng.choice(["3:45", "4:12", "5:01", "1:02:33", "58:10"]),
+    } for i in range(count)]
+
+
+def bench(fn, videos):
+    timer = timeit.Timer(lambda: fn(videos))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--top", type=int, default=10, help="how many leading results must agree")
+    args = parser.parse_args()
+
+    ranker = ranking_config.ranker()
+    results = []
+    for size in args.sizes:
+        videos = make_videos(size)
+        legacy_top = {v["link"] for v in legacy_rank(videos)[:args.top]}
+        ranked_top = {v["link"] for v in ranker.rank(videos, args.top)}
+        legacy_seconds = bench(legacy_rank, videos)
+        ranked_seconds = bench(ranker.rank, videos)
+        results.append({
+            "videos": size,
+            "legacy_us": legacy_seconds * 1e6,
+            "ranker_us": ranked_seconds * 1e6,
+            "speedup": legacy_seconds / ranked_seconds if ranked_seconds else None,
+            "top_overlap": len(legacy_top & ranked_top),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/replica_routing_check.py
+"""
+Shows where queries go with a read replica configured, using two local
+SQLite files.
+
+    python benchmarks/replica_routing_check.py
+    python benchmarks/replica_routing_check.py --primary postgresql://... --replica postgresql://...
+
+With SQLite, the replica is a copy of the primary taken once at the start
+and never updated, i.e. a replica with unbounded lag. That makes stale reads
+visible: the script deletes a conversation and reads it back, once within
+DB_REPLICA_STICKY_SECONDS (served by the primary, so it is gone) and once
+after (served by the replica, which still has it). With real Postgres URLs,
+point --replica at a streaming replica of --primary and no copy is made.
+
+For each step it prints the statements each engine ran and the HTTP status,
+as JSON.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--primary", help="Primary database URL (default: a temporary SQLite file).")
+    parser.add_argument("--replica", help="Replica database URL (default: a copy of the SQLite primary).")
+    parser.add_argument("--sticky-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="replica-check-")
+    primary_path = os.path.join(work_dir, "primary.db")
+    replica_path = os.path.join(work_dir, "replica.db")
+    os.environ["DATABASE_URL"] = args.primary or f"sqlite:///{primary_path}"
+    os.environ["DATABASE_REPLICA_URLS"] = args.replica or f"sqlite:///{replica_path}"
+    os.environ["DB_REPLICA_STICKY_SECONDS"] = str(args.sticky_seconds)
+    os.environ["HISTORY_WRITE_BEHIND"] = "false"
+
+    from sqlalchemy import event
+
+    from app import app
+    from models import db, User, History
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    statements = {}
+
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(email="replica@example.com").first()
+        if user is None:
+            user = User(username="replica", email="replica@example.com")
+            user.set_password("replica")
+            db.session.add(user)
+            db.session.commit()
+        history = History(question="Is this on the replica?", conversation=[], author=user)
+        db.session.add(history)
+        db.session.commit()
+        history_id = history.id
+        for key, engine in db.engines.items():
+            name = key or "primary"
+            event.listen(engine, "before_cursor_execute",
+                         lambda *a, name=name, **kw: statements.__setitem__(name, statements.get(name, 0) + 1))
+        db.engine.dispose()
+
+    if not args.replica:
+        shutil.copy(primary_path, replica_path)
+
+    client = app.test_client()
+    steps = []
+
+    def step(name, method, url, **kwargs):
+        statements.clear()
+        response = getattr(client, method)(url, **kwargs)
+        steps.append({"step": name, "status": response.status_code, "statements": dict(statements)})
+
+    step("log in", "post", "/login", data={"email": "replica@example.com", "password": "replica"})
+    step("open chat page", "get", "/")
+    step("read conversation", "get", f"/history/{history_id}")
+    step("delete conversation", "post", f"/delete-history/{history_id}")
+    step("read it back within the sticky window", "get", f"/history/{history_id}")
+    time.sleep(args.sticky_seconds + 0.1)
+    step("read it back after the window", "get", f"/history/{history_id}")
+
+    print(json.dumps({"primary": os.environ["DATABASE_URL"], "replica": os.environ["DATABASE_REPLICA_URLS"],
+                      "steps": steps}, indent=2))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/startup_benchmark.py
+"""
+Measures how expensive it is to boot the web app.
+
+    python benchmarks/startup_benchmark.py                 # import time + RSS, lazy vs eager
+    python benchmarks/startup_benchmark.py --gunicorn 4    # also per-worker RSS/PSS, preload on vs off
+
+"eager" imports every heavy module right after `import app`, which is what the
+app did before imports were made lazy. Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import app
+if {eager}:
+    app.preload_heavy_modules()
+elapsed = time.perf_counter() - start
+rss_kb = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+print('RESULT ' + json.dumps({{'import_seconds': elapsed, 'rss_mb': rss_kb / 1024}}))
+"""
+
+
+def measure_import(eager, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(eager=eager)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        line = [l for l in out.splitlines() if l.startswith("RESULT ")][-1]
+        samples.append(json.loads(line[len("RESULT "):]))
+    samples.sort(key=lambda s: s["import_seconds"])
+    median = samples[len(samples) // 2]
+    return {"runs": runs, "import_seconds": median["import_seconds"], "rss_mb": median["rss_mb"]}
+
+
+def read_memory(pid):
+    """Returns RSS and PSS in MB. PSS splits shared pages between the processes sharing them."""
+    memory = {"rss_mb": 0.0, "pss_mb": 0.0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    memory["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("Pss:"):
+                    memory["pss_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def measure_gunicorn(workers, preload, port, settle_seconds):
+    env = dict(os.environ, GUNICORN_PRELOAD="true" if preload else "false",
+               WEB_CONCURRENCY=str(workers), PORT=str(port))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "wsgi:app"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while len(child_pids(proc.pid)) < workers and time.time() < deadline:
+            time.sleep(0.1)
+        boot_seconds = time.perf_counter() - start
+        # Let the workers finish importing before sampling memory
+        time.sleep(settle_seconds)
+        per_worker = [read_memory(pid) for pid in child_pids(proc.pid)]
+        return {
+            "preload": preload,
+            "workers": len(per_worker),
+            "boot_seconds": boot_seconds,
+            "master": read_memory(proc.pid),
+            "per_worker": per_worker,
+            "total_pss_mb": sum(w["pss_mb"] for w in per_worker) + read_memory(proc.pid)["pss_mb"],
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="import runs per mode (median is reported)")
+    parser.add_argument("--gunicorn", type=int, metavar="WORKERS", default=0,
+                        help="also boot gunicorn with this many workers, with and without --preload")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait before sampling worker memory")
+    args = parser.parse_args()
+
+    results = {
+        "import": {
+            "lazy": measure_import(False, args.runs),
+            "eager": measure_import(True, args.runs),
+        }
+    }
+    if args.gunicorn:
+        results["gunicorn"] = [
+            measure_gunicorn(args.gunicorn, preload, args.port, args.settle) for preload in (False, True)
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
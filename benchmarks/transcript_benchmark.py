@@ -0,0 +1,89 @@
+# benchmarks/transcript_benchmark.py
+"""
+Compares the old JSON transcript storage with utils/transcript_codec.py.
+
+    python benchmarks/transcript_benchmark.py --conversations 500 --turns 2 10 40
+
+For each conversation length it reports stored bytes per turn and the time to
+encode and decode one transcript, for json.dumps (what History.answer held),
+the codec as configured here (zstd if zstandard is installed, else zlib) and,
+with zstandard, the codec using a dictionary trained on a separate sample.
+Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import transcript_codec  # noqa: E402
+from utils.transcript_codec import encode_transcript, decode_transcript, transcript_sample  # noqa: E402
+
+WORDS = ("the a is of to and in that it for you with on this be are as at can your video song image gif "
+         "sure here's what I found about Mumbai weather today tomorrow rain sunny temperature degrees "
+         "who won match cricket score India Australia played well final innings runs wickets").split()
+QUESTIONS = ["show me a video of {0}", "what is {0}", "find a gif of {0}", "tell me about {0}", "who is {0}"]
+
+
+def make_conversation(rng, turns):
+    conversation = []
+    for i in range(turns // 2):
+        topic = " ".join(rng.choice(WORDS) for _ in range(2))
+        answer = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))).capitalize() + "."
+        conversation.append({"role": "user", "parts": [{"text": rng.choice(QUESTIONS).format(topic)}]})
+        conversation.append({"role": "model", "parts": [{"text": answer}]})
+    return conversation
+
+
+def measure(conversations, encode, decode):
+    start = time.perf_counter()
+    encoded = [encode(c) for c in conversations]
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_seconds = time.perf_counter() - start
+    turns = sum(len(c) for c in conversations)
+    return {
+        "bytes_per_turn": sum(len(d) for d in encoded) / turns,
+        "encode_us": encode_seconds / len(conversations) * 1e6,
+        "decode_us": decode_seconds / len(conversations) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--turns", type=int, nargs="+", default=[2, 10, 40])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    has_zstd = transcript_codec._zstd() is not None
+    stored = []
+    # Dictionaries come from this list instead of the database; it is empty for the plain runs
+    transcript_codec.dictionaries.set_loader(lambda: stored)
+
+    results = []
+    for turns in args.turns:
+        conversations = [make_conversation(rng, turns) for _ in range(args.conversations)]
+        row = {
+            "turns": turns,
+            "json": measure(conversations, lambda c: json.dumps(c).encode("utf-8"), json.loads),
+            "codec_" + ("zstd" if has_zstd else "zlib"): measure(conversations, encode_transcript, decode_transcript),
+        }
+        if has_zstd:
+            training = [transcript_sample(make_conversation(rng, turns)) for _ in range(2000)]
+            stored.append(transcript_codec.train_dictionary(training, 16 * 1024))
+            transcript_codec.dictionaries.reset()
+            row["codec_zstd_dict"] = measure(conversations, encode_transcript, decode_transcript)
+            stored.clear()
+            transcript_codec.dictionaries.reset()
+        results.append(row)
+    print(json.dumps({"zstandard": has_zstd, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
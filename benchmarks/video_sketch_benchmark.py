@@ -0,0 +1,71 @@
+# benchmarks/video_sketch_benchmark.py
+"""
+Measures how sketch-video throughput scales with the number of worker processes.
+
+    python benchmarks/video_sketch_benchmark.py --seconds 5 --width 1280 --workers 1 2 4
+
+Writes a synthetic clip (moving shapes on a gradient), sketches it with
+utils/video_sketch.sketch_video() once per pool size and reports frames per
+second as JSON. Needs opencv-python.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.video_sketch import pool_context, sketch_video  # noqa: E402
+
+
+def make_clip(path, seconds, width, height, fps=25):
+    import cv2
+    import numpy as np
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    for i in range(int(seconds * fps)):
+        frame = cv2.cvtColor(gradient, cv2.COLOR_GRAY2BGR)
+        x = int((i * 7) % width)
+        cv2.circle(frame, (x, height // 2), height // 6, (40, 120, 220), -1)
+        cv2.rectangle(frame, (width - x, height // 8), (width - x + width // 8, height // 3), (200, 60, 30), -1)
+        writer.write(frame)
+    writer.release()
+    return int(seconds * fps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="video-sketch-bench-")
+    try:
+        clip = os.path.join(work_dir, "input.avi")
+        frames = make_clip(clip, args.seconds, args.width, args.height)
+        results = []
+        for workers in args.workers:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                # Start the worker processes before the clock does
+                list(pool.map(abs, range(workers)))
+                start = time.perf_counter()
+                output = sketch_video(clip, os.path.join(work_dir, f"out-{workers}"), pool,
+                                      in_flight=2 * workers, max_seconds=0, max_width=args.width)
+                elapsed = time.perf_counter() - start
+            results.append({"workers": workers, "seconds": elapsed, "fps": frames / elapsed,
+                            "output_bytes": os.path.getsize(output)})
+        print(json.dumps({"frames": frames, "width": args.width, "height": args.height, "results": results}, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# cache_prewarm.py
+"""
+Off-peak prewarming of the response cache (utils/response_cache.py) from
+what users have been asking.
+
+The most frequent first questions of the last PREWARM_LOOKBACK_HOURS
+(History.question, compared case- and whitespace-insensitively, asked at
+least PREWARM_MIN_COUNT times) are replayed the way /process-text answers
+them: intent detection, then the fact-check, answer or media search, then
+the answer's audio. Each step that isn't cached yet, or whose entry expires
+within PREWARM_REFRESH_HOURS, calls the upstream and stores the result, so
+at peak time those questions are answered without calling anything.
+
+The job only does work during PREWARM_HOURS (UTC, e.g. "2-6" or "22-4")
+and stops once a run has made PREWARM_BUDGET upstream calls. It needs
+REDIS_URL, because that is where the web workers look for entries. With
+METRICS_ENABLED, each question's outcome is counted
+(cache_prewarm_questions_total) and the share of popular questions fully
+cached after the last run is exported as cache_prewarm_coverage_ratio.
+Compare it with response_cache_lookups_total{prewarmed="true"} in the web
+workers to see how often prewarmed entries are actually used.
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import db, History
+from utils import metrics
+from utils.gemini_answer import (
+    generate_conversational_answer, google_search_for_answer, search_images_on_google,
+    search_gifs_on_giphy, search_videos_on_youtube, search_videos_on_pexels,
+)
+from utils.intent_batcher import classify_intent
+from utils.response_cache import response_cache, PrewarmBudgetExhausted
+from utils.single_flight import normalize_query
+from utils.text_to_speech import get_tts_backend, split_into_sentences, synthesize
+
+PREWARM_HOURS = os.getenv("PREWARM_HOURS", "2-6")
+PREWARM_BUDGET = int(os.getenv("PREWARM_BUDGET", "200"))
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "50"))
+PREWARM_MIN_COUNT = int(os.getenv("PREWARM_MIN_COUNT", "2"))
+PREWARM_LOOKBACK_HOURS = float(os.getenv("PREWARM_LOOKBACK_HOURS", "72"))
+PREWARM_REFRESH_HOURS = float(os.getenv("PREWARM_REFRESH_HOURS", "8"))
+
+MEDIA_SEARCHES = {
+    "find_image": search_images_on_google,
+    "find_gif": search_gifs_on_giphy,
+    "find_youtube_video": search_videos_on_youtube,
+    "find_pexels_video": search_videos_on_pexels,
+}
+
+_last_run = {"popular": 0, "covered": 0}
+
+
+def in_prewarm_window(hour, window=PREWARM_HOURS):
+    """Whether hour (0-23) falls in a "start-end" window, end exclusive. Windows may wrap past midnight."""
+    start, end = (int(part) for part in window.split("-"))
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def popular_questions(limit=PREWARM_TOP_N, min_count=PREWARM_MIN_COUNT, lookback_hours=PREWARM_LOOKBACK_HOURS):
+    """[(question, count), ...] for the most frequently asked recent questions, most frequent first."""
+    since = datetime.utcnow() - timedelta(hours=lookback_hours)
+    asked = func.count(History.id)
+    statement = (
+        select(func.min(History.question), asked)
+        .where(History.date_posted >= since)
+        .group_by(func.lower(History.question))
+        .order_by(asked.desc())
+        # Variants that differ only in whitespace are merged below, so read a few more groups than needed
+        .limit(limit * 4)
+    )
+    counts = Counter()
+    questions = {}
+    for question, count in db.session.execute(statement):
+        key = normalize_query(question)
+        counts[key] += count
+        questions.setdefault(key, question)
+    return [(questions[key], count) for key, count in counts.most_common(limit) if count >= min_count]
+
+
+def prewarm_question(question, tts_backend):
+    """Answers question as /process-text would for a new conversation, filling the response cache on the way."""
+    result = classify_intent(question)
+    intent = result.get("intent")
+    content = result.get("content")
+    answer = None
+    if intent == "fact_check":
+        answer = google_search_for_answer(content, [])
+    elif intent == "answer_text":
+        answer = generate_conversational_answer(content, [])
+    elif intent in MEDIA_SEARCHES:
+        candidates, attribution = MEDIA_SEARCHES[intent](content)
+        if candidates:
+            answer = attribution
+    for sentence in split_into_sentences(answer):
+        synthesize(sentence, tts_backend)
+
+
+def prewarm_caches(now=None):
+    """Prewarms the response cache for popular questions during PREWARM_HOURS. Returns how many are now fully cached."""
+    now = now or datetime.utcnow()
+    if not in_prewarm_window(now.hour):
+        return 0
+    if not response_cache.enabled or not response_cache.shared:
+        print("Cache prewarming needs RESPONSE_CACHE_ENABLED and REDIS_URL; skipping.")
+        return 0
+
+    questions = popular_questions()
+    tts_backend = get_tts_backend()
+    outcomes = Counter()
+    with response_cache.prewarming(PREWARM_BUDGET, PREWARM_REFRESH_HOURS * 3600) as state:
+        for question, _ in questions:
+            upstream_calls, uncached = state.upstream_calls, state.uncached
+            try:
+                prewarm_question(question, tts_backend)
+            except PrewarmBudgetExhausted:
+                outcomes["over_budget"] += len(questions) - sum(outcomes.values())
+                break
+            except Exception as e:
+                print(f"Could not prewarm '{question}': {e}")
+                outcomes["failed"] += 1
+                continue
+            if state.uncached > uncached:
+                # An error or empty result; the question still needs the upstream at peak time
+                outcomes["uncacheable"] += 1
+            elif state.upstream_calls > upstream_calls:
+                outcomes["warmed"] += 1
+            else:
+                outcomes["already_cached"] += 1
+
+    for outcome, count in outcomes.items():
+        metrics.increment("cache_prewarm_questions_total", count, outcome=outcome)
+    metrics.increment("cache_prewarm_upstream_calls_total", state.upstream_calls)
+    covered = outcomes["warmed"] + outcomes["already_cached"]
+    _last_run.update(popular=len(questions), covered=covered)
+    print(f"Cache prewarm: {covered}/{len(questions)} popular questions cached, "
+          f"{state.upstream_calls}/{PREWARM_BUDGET} upstream calls, {dict(outcomes)}.")
+    return covered
+
+
+def coverage_stats():
+    """[(labels, value)] for the cache_prewarm_coverage_ratio gauge."""
+    if not _last_run["popular"]:
+        return []
+    return [({}, _last_run["covered"] / _last_run["popular"])]
+
+
+if metrics.METRICS_ENABLED:
+    metrics.register_gauge("cache_prewarm_coverage_ratio", coverage_stats)
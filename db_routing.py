@@ -0,0 +1,126 @@
+# db_routing.py
+"""
+Sends read-only queries to database replicas and everything else to the
+primary.
+
+Replicas are listed in DATABASE_REPLICA_URLS (comma-separated) and become
+Flask-SQLAlchemy binds replica_0, replica_1, ... A query goes to a randomly
+picked replica only if all of these hold:
+
+- it runs inside a web request, so CLI commands, the maintenance process and
+  background writers always see the primary;
+- it is a plain SELECT (not FOR UPDATE, not raw SQL);
+- this session hasn't written anything since its last commit or rollback;
+- the user hasn't committed anything in the last DB_REPLICA_STICKY_SECONDS.
+
+The last rule gives read-your-writes across replication lag. Commits that
+wrote, and write-behind updates queued with stick(), start the window. It is
+kept in the signed session cookie so it holds whichever worker serves the
+next request. Without replicas every query goes to the primary as before.
+
+With METRICS_ENABLED, queries are counted per target and the reason for it
+(db_routed_queries_total), and each engine's pool is exported as the
+db_pool_connections gauge.
+"""
+import os
+import random
+import time
+
+from flask import g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import Select
+
+from utils import metrics
+
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))
+REPLICA_BIND_PREFIX = "replica_"
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs."""
+    return {f"{REPLICA_BIND_PREFIX}{i}": url for i, url in enumerate(u.strip() for u in urls.split(",") if u.strip())}
+
+
+class DatabaseRouter:
+    def __init__(self, sticky_seconds=DB_REPLICA_STICKY_SECONDS):
+        self.sticky_seconds = sticky_seconds
+        self.app = None
+        self.db = None
+        self.replica_keys = []
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.replica_keys = sorted(key for key in app.config.get("SQLALCHEMY_BINDS", {})
+                                   if key.startswith(REPLICA_BIND_PREFIX))
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+        if metrics.METRICS_ENABLED:
+            metrics.register_gauge("db_pool_connections", self.pool_stats)
+
+    def stick(self):
+        """Sends this user's reads to the primary for the next sticky_seconds."""
+        if not has_request_context():
+            return
+        until = time.time() + self.sticky_seconds
+        g.db_primary_until = until
+        flask_session["db_primary_until"] = until
+
+    def _sticky(self):
+        until = g.get("db_primary_until") or flask_session.get("db_primary_until", 0)
+        return until > time.time()
+
+    def route(self, session, clause):
+        """Returns (replica bind key or None for the primary, reason) for one query."""
+        if session._flushing or isinstance(clause, UpdateBase):
+            session.info["db_wrote"] = True
+            return None, "write"
+        if not self.replica_keys or not has_request_context():
+            return None, "default"
+        if not isinstance(clause, Select) or clause._for_update_arg is not None:
+            return None, "write"
+        if session.info.get("db_wrote"):
+            return None, "session_wrote"
+        if self._sticky():
+            return None, "sticky"
+        return random.choice(self.replica_keys), "read"
+
+    def _after_commit(self, session):
+        if session.info.pop("db_wrote", False) and self.replica_keys:
+            self.stick()
+
+    def _after_rollback(self, session):
+        session.info.pop("db_wrote", None)
+
+    def pool_stats(self):
+        """[(labels, value), ...] for every engine's pool, for the db_pool_connections gauge."""
+        rows = []
+        # Scrapes may come from outside a request, e.g. maintenance.py's metrics server
+        with self.app.app_context():
+            engines = dict(self.db.engines)
+        for key, engine in engines.items():
+            pool = engine.pool
+            name = key or "primary"
+            for state in ("size", "checkedin", "checkedout", "overflow"):
+                method = getattr(pool, state, None)
+                # Only QueuePool has all four; SQLite's and NullPool have some or none
+                if callable(method):
+                    rows.append(({"engine": name, "state": state}, method()))
+        return rows
+
+
+db_router = DatabaseRouter()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        # Explicit binds and models with their own bind_key are left alone
+        if bind is not None or engine is not self._db.engines.get(None):
+            return engine
+        key, reason = db_router.route(self, clause)
+        if metrics.METRICS_ENABLED:
+            metrics.increment("db_routed_queries_total", target=key or "primary", reason=reason)
+        return self._db.engines[key] if key else engine
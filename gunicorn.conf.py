@@ -0,0 +1,63 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn wsgi:app` / `gunicorn app:app` from the project root.
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+# Load the app once in the master and fork workers from it. Together with
+# preload_heavy_modules() this lets every worker share the same memory pages
+# for cv2, numpy, PIL and the Gemini client (copy-on-write).
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+# Start media_cleanup.py next to the workers; generated media is on this instance's disk
+MEDIA_CLEANUP_ENABLED = os.getenv("MEDIA_CLEANUP_ENABLED", "true").lower() == "true"
+
+
+def when_ready(server):
+    """Runs once in the master: database bootstrap and this instance's media cleanup. Periodic jobs run in maintenance.py."""
+    from wsgi import init_db
+    from app import preload_heavy_modules
+
+    from utils import metrics
+
+    if preload_app:
+        preload_heavy_modules()
+    init_db()
+    metrics.clear_shared()
+    if MEDIA_CLEANUP_ENABLED:
+        server.media_cleanup = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_cleanup.py")])
+
+
+def on_exit(server):
+    """Stops the media cleanup process with the server."""
+    cleanup = getattr(server, "media_cleanup", None)
+    if cleanup is not None:
+        cleanup.terminate()
+        try:
+            cleanup.wait(5)
+        except subprocess.TimeoutExpired:
+            cleanup.kill()
+
+
+def post_fork(server, worker):
+    """Drop any database connections inherited from the master, and add this worker to the shared metrics."""
+    from app import app, db
+    from utils import metrics
+
+    with app.app_context():
+        # The primary and any read replicas
+        for engine in db.engines.values():
+            engine.dispose()
+    metrics.share_with_workers()
+
+
+def worker_exit(server, worker):
+    """Commit conversation updates still queued in this worker before it goes away."""
+    from history_writer import history_writer
+
+    history_writer.flush()
@@ -0,0 +1,142 @@
+# history_export.py
+"""
+Streaming export of a user's saved conversations, for /history/export.
+
+Rows are read through a server-side cursor (yield_per) as plain column
+tuples, so neither the ORM identity map nor the result set grows with the
+number of conversations. Each row is turned into one NDJSON line, and the
+lines are sent in chunks of about HISTORY_EXPORT_CHUNK_KB as they are read.
+Memory therefore stays flat however much history a user has.
+
+The zip format holds a single history.ndjson member written through
+zipfile's streaming mode. A member per conversation would be friendlier
+to unzip, but zipfile keeps every member's header in memory until the
+central directory is written at the end.
+
+Conversations with an update still queued in history_writer are exported
+with that update.
+
+Once streaming has started there is no way to send an error status, so the
+output stays well-formed instead: a conversation that can't be read becomes
+a record with an "error" field, and if the export fails part way or runs
+for HISTORY_EXPORT_MAX_SECONDS, it ends with an {"incomplete": true,
+"resume_after_id": ...} record and the archive is closed properly. A sync
+gunicorn worker can't heartbeat while it streams, so the default stays under
+gunicorn's 30 second --timeout; the client fetches the rest with
+/history/export?after_id=<resume_after_id>.
+"""
+import json
+import os
+import time
+import zipfile
+
+from sqlalchemy import select
+
+from history_writer import history_writer
+from models import db, History
+
+HISTORY_EXPORT_BATCH_SIZE = int(os.getenv("HISTORY_EXPORT_BATCH_SIZE", "500"))
+HISTORY_EXPORT_CHUNK_KB = int(os.getenv("HISTORY_EXPORT_CHUNK_KB", "64"))
+# 0 means no limit
+HISTORY_EXPORT_MAX_SECONDS = float(os.getenv("HISTORY_EXPORT_MAX_SECONDS", "20"))
+
+
+def iter_history_records(user_id, batch_size=HISTORY_EXPORT_BATCH_SIZE, after_id=0):
+    """Yields one dict per saved conversation of user_id with an id above after_id, oldest first."""
+    statement = (
+        select(History.id, History.question, History.answer, History.transcript, History.date_posted)
+        .where(History.user_id == user_id, History.id > after_id)
+        .order_by(History.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for history_id, question, answer, transcript, date_posted in db.session.execute(statement):
+        record = {"id": history_id, "question": question, "date_posted": date_posted.isoformat()}
+        try:
+            conversation = (history_writer.pending_conversation(history_id, user_id)
+                            or History.decode_conversation(answer, transcript))
+        except Exception as e:
+            print(f"Could not export conversation {history_id}: {e}")
+            record["error"] = "This conversation could not be read."
+            yield record
+            continue
+        if conversation is None:
+            record["answer"] = answer
+        else:
+            record["conversation"] = conversation
+        yield record
+
+
+def _ndjson_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _ndjson_lines(user_id, batch_size, after_id, max_seconds):
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    last_id = after_id
+    try:
+        for record in iter_history_records(user_id, batch_size, after_id):
+            yield _ndjson_line(record)
+            last_id = record["id"]
+            if deadline is not None and time.monotonic() >= deadline:
+                yield _ndjson_line({"incomplete": True, "error": "The export took too long; fetch the rest separately.",
+                                    "resume_after_id": last_id})
+                return
+    except Exception as e:
+        # Headers are long gone; end with a record saying where to pick up instead of a truncated file
+        print(f"History export for user {user_id} failed after conversation {last_id}: {e}")
+        yield _ndjson_line({"incomplete": True, "error": "The export failed part way; fetch the rest separately.",
+                            "resume_after_id": last_id})
+
+
+def export_ndjson(user_id, batch_size=HISTORY_EXPORT_BATCH_SIZE, chunk_bytes=HISTORY_EXPORT_CHUNK_KB * 1024,
+                  after_id=0, max_seconds=HISTORY_EXPORT_MAX_SECONDS):
+    """Yields the user's history after after_id as NDJSON, in chunks of about chunk_bytes."""
+    chunk = []
+    size = 0
+    for line in _ndjson_lines(user_id, batch_size, after_id, max_seconds):
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+class _Sink:
+    """A write-only file for zipfile that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_zip(user_id, batch_size=HISTORY_EXPORT_BATCH_SIZE, chunk_bytes=HISTORY_EXPORT_CHUNK_KB * 1024,
+               after_id=0, max_seconds=HISTORY_EXPORT_MAX_SECONDS):
+    """Yields a zip archive holding history.ndjson, sending what has been compressed after every chunk_bytes of NDJSON."""
+    sink = _Sink()
+    # The sink can't seek, so zipfile writes sizes after each member instead of patching them in
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("history.ndjson", "w", force_zip64=True) as member:
+            size = 0
+            for line in _ndjson_lines(user_id, batch_size, after_id, max_seconds):
+                member.write(line)
+                size += len(line)
+                if size >= chunk_bytes:
+                    size = 0
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain()
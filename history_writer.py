@@ -0,0 +1,216 @@
+# history_writer.py
+"""
+Write-behind persistence for conversation updates.
+
+Every chat turn rewrites the whole conversation, so /process-text doesn't
+need to wait for that commit. Updates are queued and a background thread
+commits them in batches. Queued updates for the same conversation are
+coalesced: only the newest transcript is written, and never before an older
+one, because there is a single writer thread per process. Across worker
+processes, turn_count guards the write, so a late update can't replace a
+longer conversation already stored.
+
+New conversations are still inserted synchronously because the browser
+needs their id. Reads through pending_conversation() see queued updates,
+and flush() (run at exit and from gunicorn's worker_exit hook) writes
+everything still queued. HISTORY_WRITE_BEHIND=false writes in the request
+again.
+
+The user was already told the turn is saved, so a commit that fails because
+the database is unreachable (a failover, a dropped connection) is retried
+with backoff (up to HISTORY_WRITE_MAX_BACKOFF seconds apart) until it is
+back. Any other error can't be fixed by waiting, so the batch is written
+again one row at a time and only the row that still fails is logged, counted
+(status="failed") and dropped. While it is down, updates keep queueing; once
+HISTORY_WRITE_MAX_PENDING conversations are waiting, further ones are written
+in the request, so the user gets an error instead of a silent loss. flush()
+likewise writes whatever the writer thread hasn't managed to itself.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import DisconnectionError, OperationalError
+
+from models import db, History
+from utils import metrics
+from utils.transcript_codec import encode_transcript
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "50"))
+# How long the writer waits for more updates before committing a batch
+HISTORY_WRITE_MAX_DELAY_MS = float(os.getenv("HISTORY_WRITE_MAX_DELAY_MS", "20"))
+HISTORY_WRITE_MAX_BACKOFF = float(os.getenv("HISTORY_WRITE_MAX_BACKOFF", "5"))
+HISTORY_WRITE_MAX_PENDING = int(os.getenv("HISTORY_WRITE_MAX_PENDING", "1000"))
+
+
+class HistoryWriter:
+    def __init__(self, enabled=HISTORY_WRITE_BEHIND, batch_size=HISTORY_WRITE_BATCH_SIZE,
+                 max_delay_ms=HISTORY_WRITE_MAX_DELAY_MS, max_backoff=HISTORY_WRITE_MAX_BACKOFF,
+                 max_pending=HISTORY_WRITE_MAX_PENDING):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.app = None
+        self._cond = threading.Condition()
+        # history_id -> (user_id, conversation), oldest first
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.flush)
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each worker starts its own writer
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pending = OrderedDict()
+            self._in_flight = {}
+            threading.Thread(target=self._run, name="history-writer", daemon=True).start()
+            self._pid = os.getpid()
+
+    def update(self, history_id, user_id, conversation):
+        """Saves the conversation for history_id if user_id owns it, without waiting for the commit."""
+        if not self.enabled:
+            self._write({history_id: (user_id, conversation)})
+            return
+        self._ensure_started()
+        with self._cond:
+            if history_id in self._pending:
+                metrics.increment("history_writes_total", status="coalesced")
+                del self._pending[history_id]
+            elif len(self._pending) >= self.max_pending:
+                full = True
+            else:
+                full = False
+            if not full:
+                self._pending[history_id] = (user_id, conversation)
+                self._cond.notify_all()
+                return
+        # The writer is far behind, most likely because the database is down; don't queue without bound
+        metrics.increment("history_writes_total", status="sync_overflow")
+        self._write({history_id: (user_id, conversation)})
+
+    def pending_conversation(self, history_id, user_id):
+        """The newest not-yet-committed conversation for history_id, or None."""
+        with self._cond:
+            entry = self._pending.get(history_id) or self._in_flight.get(history_id)
+        if entry and entry[0] == user_id:
+            return entry[1]
+        return None
+
+    def discard(self, history_id):
+        """Drops a queued update, e.g. because the conversation is being deleted."""
+        with self._cond:
+            self._pending.pop(history_id, None)
+
+    def flush(self, timeout=10):
+        """Waits until every queued update is committed. Returns False if it timed out."""
+        if self._pid != os.getpid():
+            return True
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            else:
+                return True
+            # The writer thread is stuck retrying; write what's left from here before the process goes away
+            left = dict(self._in_flight)
+            left.update(self._pending)
+        try:
+            self._write(left)
+            metrics.increment("history_writes_total", len(left), status="sync_flush")
+            return True
+        except Exception:
+            pass
+        # Save whatever rows can still be saved; there's no time left to wait for the database
+        lost = 0
+        for history_id, entry in left.items():
+            try:
+                self._write({history_id: entry})
+                metrics.increment("history_writes_total", status="sync_flush")
+            except Exception as e:
+                lost += 1
+                metrics.increment("history_writes_total", status="lost")
+                print(f"History writer: update to conversation {history_id} could not be saved at shutdown: {e}")
+        return not lost
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give concurrent requests a moment to join this batch
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = OrderedDict()
+                while self._pending and len(batch) < self.batch_size:
+                    history_id, entry = self._pending.popitem(last=False)
+                    batch[history_id] = entry
+                self._in_flight = dict(batch)
+
+            self._save(batch)
+            with self._cond:
+                self._in_flight = {}
+                self._cond.notify_all()
+
+    def _save(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self._write(batch)
+                metrics.increment("history_writes_total", len(batch), status="ok")
+                return
+            except (OperationalError, DisconnectionError) as e:
+                # Keep trying through a failover; the turns were already shown to the user as saved
+                metrics.increment("history_writes_total", len(batch), status="retry")
+                print(f"History writer error (attempt {attempt + 1}, {len(batch)} update(s) waiting): {e}")
+                time.sleep(min(0.1 * 2 ** attempt, self.max_backoff))
+                attempt += 1
+            except Exception as e:
+                if len(batch) > 1:
+                    # Don't let one bad row hold up the others
+                    for history_id, entry in batch.items():
+                        self._save({history_id: entry})
+                    return
+                history_id = next(iter(batch))
+                metrics.increment("history_writes_total", status="failed")
+                print(f"History writer: update to conversation {history_id} can't be saved, dropping it: {e}")
+                return
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                for history_id, (user_id, conversation) in batch.items():
+                    turn_count = len(conversation)
+                    db.session.execute(
+                        update(History)
+                        .where(History.id == history_id, History.user_id == user_id,
+                               or_(History.turn_count.is_(None), History.turn_count < turn_count))
+                        .values(transcript=encode_transcript(conversation), turn_count=turn_count, answer="")
+                    )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+history_writer = HistoryWriter()
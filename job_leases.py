@@ -0,0 +1,101 @@
+# job_leases.py
+"""
+Leases that let several processes share periodic jobs.
+
+Each job holds a lease row (JobLease) while it runs and leaves it set to the
+next due time when it finishes. Several processes can therefore try the same
+job and it still runs once per interval. A process that dies mid-job gives
+the job up when its lease expires.
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobLease
+from utils import metrics
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Job:
+    def __init__(self, name, fn, interval_seconds, lease_seconds):
+        self.name = name
+        self.fn = fn
+        self.interval = timedelta(seconds=interval_seconds)
+        # Longest the job may run before another process may take it over
+        self.lease = timedelta(seconds=lease_seconds)
+
+
+def acquire_lease(job, now):
+    """Takes the job's lease if it is due. Returns True if this process should run it now."""
+    claimed = JobLease.query.filter(JobLease.name == job.name, JobLease.leased_until <= now).update(
+        {"holder": HOLDER, "leased_until": now + job.lease}, synchronize_session=False)
+    db.session.commit()
+    if claimed:
+        return True
+    if db.session.get(JobLease, job.name) is not None:
+        return False
+    try:
+        db.session.add(JobLease(name=job.name, holder=HOLDER, leased_until=now + job.lease))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Another process created it first
+        db.session.rollback()
+        return False
+
+
+def finish_lease(job, started_at, status):
+    """Marks the job done. After success it is next due one interval after it started; after a failure, right away."""
+    leased_until = started_at + job.interval if status == "ok" else datetime.utcnow()
+    JobLease.query.filter(JobLease.name == job.name, JobLease.holder == HOLDER).update(
+        {"leased_until": leased_until, "last_run_at": started_at, "last_status": status},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def run_job(job):
+    """Runs one job if it is due and this process wins the lease. Returns the job's result or None."""
+    now = datetime.utcnow()
+    try:
+        if not acquire_lease(job, now):
+            metrics.increment("maintenance_job_runs_total", job=job.name, status="skipped")
+            return None
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not take the lease for {job.name}: {e}")
+        return None
+
+    status = "ok"
+    result = None
+    start = time.perf_counter()
+    try:
+        result = job.fn()
+        print(f"[{datetime.now()}] {job.name}: {result} item(s) done.")
+        metrics.increment("maintenance_job_items_total", result or 0, job=job.name)
+    except Exception as e:
+        db.session.rollback()
+        status = "error"
+        print(f"Error in maintenance job {job.name}: {e}")
+    finally:
+        metrics.observe(f"job:{job.name}", time.perf_counter() - start)
+        metrics.increment("maintenance_job_runs_total", job=job.name, status=status)
+        try:
+            finish_lease(job, now, status)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not release the lease for {job.name}: {e}")
+    return result
+
+
+def delete_stale_leases(job_names, older_than=timedelta(days=7)):
+    """Deletes lease rows of jobs not in job_names that nobody has held for older_than, e.g. renamed or removed jobs."""
+    deleted = JobLease.query.filter(JobLease.name.notin_(list(job_names)),
+                                    JobLease.leased_until < datetime.utcnow() - older_than).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
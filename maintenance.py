@@ -0,0 +1,105 @@
+# maintenance.py
+"""
+Periodic maintenance jobs, run in their own process so web workers only
+handle requests:
+
+    python maintenance.py               # run forever
+    flask maintenance run --once        # run every due job once and exit
+
+Jobs are shared through lease rows (see job_leases.py), so several
+maintenance processes (e.g. one per instance) can run side by side and each
+job still runs once per interval.
+
+Besides history retention, the cache_prewarm job fills the response cache for popular
+questions during off-peak hours (see cache_prewarm.py).
+
+With METRICS_ENABLED=true, job durations and outcomes are recorded, and
+MAINTENANCE_METRICS_PORT serves them in Prometheus format.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app import app
+from cache_prewarm import prewarm_caches
+from job_leases import Job, delete_stale_leases, run_job
+from models import db, History
+from utils import metrics
+
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "15"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+# How often the runner checks for due jobs
+MAINTENANCE_TICK_SECONDS = float(os.getenv("MAINTENANCE_TICK_SECONDS", "60"))
+MAINTENANCE_METRICS_PORT = os.getenv("MAINTENANCE_METRICS_PORT")
+
+
+def delete_old_history():
+    """Deletes history older than HISTORY_RETENTION_DAYS in small batches and returns how many rows went."""
+    cutoff = datetime.utcnow() - timedelta(days=HISTORY_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        # Short transactions keep row locks brief while the web app is writing
+        ids = [row.id for row in db.session.query(History.id)
+               .filter(History.date_posted < cutoff).limit(MAINTENANCE_BATCH_SIZE)]
+        if not ids:
+            break
+        History.query.filter(History.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
+
+
+JOBS = [
+    Job("history_retention", delete_old_history,
+        float(os.getenv("HISTORY_RETENTION_INTERVAL_SECONDS", str(24 * 3600))), lease_seconds=3600),
+    # Does nothing outside PREWARM_HOURS (see cache_prewarm.py)
+    Job("cache_prewarm", prewarm_caches,
+        float(os.getenv("PREWARM_INTERVAL_SECONDS", "3600")), lease_seconds=1800),
+]
+
+# Generated sketches, memes and cached videos live on each web instance's own
+# disk, which this process can't see, so each instance runs media_cleanup.py
+# beside its web workers (started by gunicorn's master). Audio clips for /stream-audio live in each web
+# worker's memory and are expired by the workers (expire_audio_store in app.py).
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port):
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="maintenance-metrics", daemon=True).start()
+    return server
+
+
+def run(once=False, only=()):
+    """Runs due jobs every MAINTENANCE_TICK_SECONDS, or a single round with once=True."""
+    jobs = [job for job in JOBS if not only or job.name in only]
+    if MAINTENANCE_METRICS_PORT and not once:
+        serve_metrics(MAINTENANCE_METRICS_PORT)
+    with app.app_context():
+        db.create_all()
+        # Jobs that were renamed or removed leave their rows behind
+        delete_stale_leases(job.name for job in JOBS)
+        while True:
+            for job in jobs:
+                run_job(job)
+            if once:
+                return
+            time.sleep(MAINTENANCE_TICK_SECONDS)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,70 @@
+# media_cleanup.py
+"""
+Cleanup of files the web service writes to its own disk: generated
+sketches, sketch videos and memes, sketch job status files, and
+half-written video cache files.
+
+These live on the web instance's local disk, which a separate maintenance
+process (a Render worker, a Heroku dyno) never sees, and web workers only
+handle requests. So each web instance runs this as its own small process:
+gunicorn's master starts it when the server is ready and stops it on exit
+(see gunicorn.conf.py). There is one master per instance, so no lease is
+needed. Without gunicorn, run it by hand or from cron:
+
+    python media_cleanup.py                 # run forever
+    flask maintenance clean-media           # clean once and exit
+"""
+import os
+import time
+
+from utils.video_delivery import video_cache
+from utils.video_sketch import VIDEO_SKETCH_STATUS_DIR
+
+GENERATED_MEDIA_TTL_HOURS = float(os.getenv("GENERATED_MEDIA_TTL_HOURS", "24"))
+GENERATED_MEDIA_CLEANUP_INTERVAL_SECONDS = float(os.getenv("GENERATED_MEDIA_CLEANUP_INTERVAL_SECONDS", "3600"))
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+GENERATED_MEDIA_FOLDERS = ("sketches", "sketch_videos", "memes")
+# A video cache file still being written after this long belongs to a stream that died
+STALE_PART_SECONDS = 3600
+
+
+def _delete_older_than(path, cutoff, suffix=""):
+    deleted = 0
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.endswith(suffix) and entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+def delete_old_generated_media(static_folder=STATIC_FOLDER, extra_folders=(VIDEO_SKETCH_STATUS_DIR,)):
+    """Deletes generated media older than GENERATED_MEDIA_TTL_HOURS and stale video cache parts. Returns the count."""
+    cutoff = time.time() - GENERATED_MEDIA_TTL_HOURS * 3600
+    deleted = 0
+    for folder in GENERATED_MEDIA_FOLDERS:
+        deleted += _delete_older_than(os.path.join(static_folder, folder), cutoff)
+    for folder in extra_folders:
+        deleted += _delete_older_than(folder, cutoff)
+    deleted += _delete_older_than(video_cache.directory, time.time() - STALE_PART_SECONDS, suffix=".part")
+    return deleted
+
+
+def run(interval_seconds=GENERATED_MEDIA_CLEANUP_INTERVAL_SECONDS):
+    """Cleans up every interval_seconds until the process is stopped."""
+    while True:
+        try:
+            print(f"Media cleanup: {delete_old_generated_media()} file(s) deleted.")
+        except Exception as e:
+            print(f"Media cleanup error: {e}")
+        time.sleep(interval_seconds)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,11 +1,17 @@
 # models.py
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from utils.transcript_codec import encode_transcript, decode_transcript, dictionaries as transcript_dictionaries
+
+from db_routing import RoutingSession
+
 # Initialize the database object here. app.py will import and configure it.
-db = SQLAlchemy()
+# RoutingSession sends reads to replicas when DATABASE_REPLICA_URLS is set (see db_routing.py).
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,9 +33,70 @@ class User(db.Model, UserMixin):
 class History(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String(1000), nullable=False)
-    answer = db.Column(db.Text, nullable=False)
+    # Plain-text answer or JSON transcript, for rows written before transcript existed
+    answer = db.Column(db.Text, nullable=False, default="")
+    # The conversation encoded by utils/transcript_codec.py; use .conversation to read and write it
+    transcript = db.Column(db.LargeBinary)
+    # Turns in transcript; lets a delayed write never overwrite a longer conversation
+    turn_count = db.Column(db.Integer)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
+    @staticmethod
+    def decode_conversation(answer, transcript):
+        """The conversation stored in these column values, or None for an old plain-text answer."""
+        if transcript is not None:
+            return decode_transcript(transcript)
+        try:
+            turns = json.loads(answer)
+        except (TypeError, ValueError):
+            return None
+        return turns if isinstance(turns, list) else None
+
+    @property
+    def conversation(self):
+        """The conversation as Gemini-format turns, or None for an old plain-text answer."""
+        return self.decode_conversation(self.answer, self.transcript)
+
+    @conversation.setter
+    def conversation(self, turns):
+        self.transcript = encode_transcript(turns)
+        self.turn_count = len(turns)
+        self.answer = ""
+
+    def __repr__(self):
+        return f"History('{self.question}', '{self.date_posted}')"
+
+
+class JobLease(db.Model):
+    """Which process may run a periodic job, and when it is next due (see job_leases.py)."""
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    leased_until = db.Column(db.DateTime, nullable=False)
+    last_run_at = db.Column(db.DateTime)
+    last_status = db.Column(db.String(16))
+
     def __repr__(self):
-        return f"History('{self.question}', '{self.date_posted}')"
\ No newline at end of file
+        return f"JobLease('{self.name}', '{self.holder}', '{self.leased_until}')"
+
+
+class TranscriptDictionary(db.Model):
+    """A zstd dictionary for History.transcript. Rows compressed with it can't be read without it, so never delete one."""
+    # zstd dictionary ids are unsigned 32-bit
+    dict_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"TranscriptDictionary({self.dict_id}, '{self.created_at}')"
+
+
+def load_transcript_dictionaries():
+    """Every stored dictionary, oldest first. Uses its own connection so it never flushes the caller's session."""
+    statement = db.select(TranscriptDictionary.data).order_by(TranscriptDictionary.created_at,
+                                                             TranscriptDictionary.dict_id)
+    with db.engine.connect() as connection:
+        return [data for (data,) in connection.execute(statement)]
+
+
+transcript_dictionaries.set_loader(load_transcript_dictionaries)
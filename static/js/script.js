@@ -22,6 +22,7 @@ window.addEventListener('load', () => {
     const memeImageInput = document.getElementById('meme-image-input');
     const memeTopText = document.getElementById('meme-top-text');
     const memeBottomText = document.getElementById('meme-bottom-text');
+    const memePreview = document.getElementById('meme-preview');
     const suggestTextBtn = document.getElementById('suggest-text-btn');
     const suggestionSpinner = document.getElementById('suggestion-spinner');
 
@@ -29,8 +30,12 @@ window.addEventListener('load', () => {
     // --- 2. GLOBAL VARIABLES & SESSION SETUP ---
     // ... (no changes here)
     let currentAudio = null;
+    let audioQueueId = 0; // Bumped to cancel a sentence queue that is still playing
     let conversationHistory = [];
     let currentDbId = null; // The database ID for the current conversation
+    let mediaCursor = null; // { type, candidates, index } from the last media answer
+    // "another one", "show me another gif", "next one please", ...
+    const FOLLOW_UP_RE = /^(show me |give me |send( me)? |find( me)? )?(another|one more|next|a different)( one)?( gif| image| picture| photo| video)?( please)?[.!?]*$/i;
     const markdownConverter = new showdown.Converter();
     const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
     let recognition;
@@ -39,7 +44,8 @@ window.addEventListener('load', () => {
     const saveSession = () => {
         const sessionData = {
             history: conversationHistory,
-            db_id: currentDbId
+            db_id: currentDbId,
+            media_cursor: mediaCursor
         };
         sessionStorage.setItem('genivus_session', JSON.stringify(sessionData));
     };
@@ -53,6 +59,7 @@ window.addEventListener('load', () => {
             const sessionData = JSON.parse(savedSession);
             conversationHistory = sessionData.history || [];
             currentDbId = sessionData.db_id || null;
+            mediaCursor = sessionData.media_cursor || null;
 
             if (conversationHistory.length === 0) return;
 
@@ -147,7 +154,8 @@ window.addEventListener('load', () => {
     });
     imageUploadInput.addEventListener('change', (event) => {
         const file = event.target.files[0];
-        if (file) uploadAndProcessImage(file);
+        if (file && file.type.startsWith('video/')) uploadAndSketchVideo(file);
+        else if (file) uploadAndProcessImage(file);
         imageUploadInput.value = '';
     });
 
@@ -170,6 +178,62 @@ window.addEventListener('load', () => {
         uploadAndGenerateMeme(file, memeTopText.value, memeBottomText.value);
     });
 
+    // Live preview: the picked image is shrunk once in the browser, then re-captioned by the server as the user types
+    let previewImage = null;
+    let previewTimer = null;
+    let previewRequestId = 0;
+
+    function shrinkImage(file, maxSize) {
+        return createImageBitmap(file).then(bitmap => {
+            const scale = Math.min(1, maxSize / Math.max(bitmap.width, bitmap.height));
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(bitmap.width * scale);
+            canvas.height = Math.round(bitmap.height * scale);
+            canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+            return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.85));
+        });
+    }
+
+    function updateMemePreview() {
+        if (!previewImage) return;
+        const requestId = ++previewRequestId;
+        const formData = new FormData();
+        formData.append('image', previewImage, 'preview.jpg');
+        formData.append('top_text', memeTopText.value);
+        formData.append('bottom_text', memeBottomText.value);
+        fetch('/meme-preview', { method: 'POST', body: formData })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.blob();
+            })
+            .then(blob => {
+                // Ignore previews that arrive after a newer one was requested
+                if (requestId !== previewRequestId) return;
+                if (memePreview.src) URL.revokeObjectURL(memePreview.src);
+                memePreview.src = URL.createObjectURL(blob);
+                memePreview.style.display = 'block';
+            })
+            .catch(error => console.error('Meme preview failed:', error));
+    }
+
+    function scheduleMemePreview() {
+        clearTimeout(previewTimer);
+        previewTimer = setTimeout(updateMemePreview, 150);
+    }
+
+    memeImageInput.addEventListener('change', () => {
+        const file = memeImageInput.files[0];
+        previewImage = null;
+        memePreview.style.display = 'none';
+        if (!file) return;
+        // Browsers that can't decode the file (e.g. HEIC) just go without a preview
+        shrinkImage(file, 480)
+            .then(blob => { previewImage = blob; updateMemePreview(); })
+            .catch(() => {});
+    });
+    memeTopText.addEventListener('input', scheduleMemePreview);
+    memeBottomText.addEventListener('input', scheduleMemePreview);
+
     suggestTextBtn.addEventListener('click', () => {
         const file = memeImageInput.files[0];
         if (!file) {
@@ -186,6 +250,7 @@ window.addEventListener('load', () => {
                 if (data.error) throw new Error(data.error);
                 memeTopText.value = data.top_text || '';
                 memeBottomText.value = data.bottom_text || '';
+                scheduleMemePreview();
             })
             .catch(error => {
                 alert('Sorry, the AI could not come up with a suggestion.');
@@ -240,16 +305,82 @@ window.addEventListener('load', () => {
 
         // Auto-scroll to the new message
         turnDiv.scrollIntoView({ behavior: 'smooth' });
+        return turnDiv;
+    }
+
+    function renderMedia(turnDiv, type, candidate) {
+        let element;
+        if (type === 'youtube') {
+            element = document.createElement('iframe');
+            element.src = candidate.embed_url;
+            element.allow = 'accelerometer; autoplay; encrypted-media; gyroscope; picture-in-picture';
+            element.allowFullscreen = true;
+            element.style.cssText = 'width:100%;aspect-ratio:16/9;border:0;border-radius:8px;margin-top:1rem;';
+        } else if (type === 'video') {
+            element = document.createElement('video');
+            element.src = candidate.url;
+            element.controls = true;
+            element.preload = 'metadata';
+            if (candidate.thumbnail) element.poster = candidate.thumbnail;
+            element.style.cssText = 'width:100%;border-radius:8px;margin-top:1rem;';
+        } else {
+            element = document.createElement('img');
+            element.src = candidate.url;
+            element.alt = candidate.attribution || '';
+            element.style.cssText = 'max-width:100%;border-radius:8px;margin-top:1rem;';
+        }
+        turnDiv.appendChild(element);
+        turnDiv.scrollIntoView({ behavior: 'smooth' });
+    }
+
+    // What the server needs to pick a video rendition that fits this screen and connection
+    function clientHints() {
+        const connection = navigator.connection || {};
+        return {
+            viewport_width: window.innerWidth,
+            dpr: window.devicePixelRatio || 1,
+            downlink: connection.downlink || null,
+            save_data: !!connection.saveData
+        };
+    }
+
+    // Fetch the next candidates' thumbnails (and the very next full image) into the browser cache
+    function warmNextMedia() {
+        if (!mediaCursor) return;
+        const upcoming = mediaCursor.candidates.slice(mediaCursor.index + 1, mediaCursor.index + 3);
+        upcoming.forEach((candidate, i) => {
+            if (candidate.thumbnail) new Image().src = candidate.thumbnail;
+            if (i === 0 && (mediaCursor.type === 'image' || mediaCursor.type === 'gif')) new Image().src = candidate.url;
+        });
+    }
+
+    // Serves "another one" from the candidates we already have, without asking the server
+    function serveNextMedia(text) {
+        if (!mediaCursor || !FOLLOW_UP_RE.test(text.trim())) return false;
+        if (mediaCursor.index + 1 >= mediaCursor.candidates.length) return false;
+
+        mediaCursor.index += 1;
+        const candidate = mediaCursor.candidates[mediaCursor.index];
+        if (welcomeMessage) welcomeMessage.style.display = 'none';
+        renderTurn('user', text);
+        renderMedia(renderTurn('model', candidate.attribution), mediaCursor.type, candidate);
+        conversationHistory.push({ role: 'user', parts: [{ text: text }] });
+        conversationHistory.push({ role: 'model', parts: [{ text: candidate.attribution }] });
+        saveSession();
+        warmNextMedia();
+        return true;
     }
 
     function startNewChat() {
         // ... (no changes in this function)
+        audioQueueId += 1;
         if (currentAudio) {
             currentAudio.pause();
             currentAudio = null;
         }
         conversationHistory = [];
         currentDbId = null;
+        mediaCursor = null;
         sessionStorage.removeItem('genivus_session'); // Clear session storage
         mainConversationContainer.querySelectorAll('.chat-turn').forEach(turn => turn.remove());
         if (welcomeMessage) welcomeMessage.style.display = 'block';
@@ -259,7 +390,7 @@ window.addEventListener('load', () => {
     }
 
     function processText(text) {
-        // ... (no changes in this function)
+        if (serveNextMedia(text)) return;
         if (welcomeMessage) welcomeMessage.style.display = 'none';
         setUIState('processing');
         renderTurn('user', text); // Render the user's message immediately
@@ -272,13 +403,23 @@ window.addEventListener('load', () => {
             body: JSON.stringify({
                 text_input: text,
                 history: conversationHistory, // Send the history *before* the new message
-                db_id: currentDbId
+                db_id: currentDbId,
+                client: clientHints()
             })
         })
         .then(response => response.json())
         .then(data => {
             typingIndicator.style.display = 'none';
-            renderTurn('model', data.text_response); // Render AI response
+            const modelTurn = renderTurn('model', data.text_response); // Render AI response
+
+            // Keep every media candidate so "another one" can be answered locally
+            if (data.media && data.media.candidates.length) {
+                mediaCursor = { type: data.media.type, candidates: data.media.candidates, index: 0 };
+                renderMedia(modelTurn, mediaCursor.type, mediaCursor.candidates[0]);
+                warmNextMedia();
+            } else {
+                mediaCursor = null;
+            }
 
             // Update history and save session
             conversationHistory.push({ role: 'user', parts: [{ text: text }] });
@@ -289,12 +430,9 @@ window.addEventListener('load', () => {
             saveSession();
 
             // Handle audio playback
-            if (data.audio_url && !data.youtube_embed_url) {
-                if (currentAudio) currentAudio.pause();
-                currentAudio = new Audio(data.audio_url);
-                currentAudio.play();
-                setUIState('speaking');
-                currentAudio.onended = () => setUIState('idle');
+            const audioUrls = data.audio_urls || (data.audio_url ? [data.audio_url] : []);
+            if (audioUrls.length && !data.youtube_embed_url) {
+                playAudioQueue(audioUrls);
             } else {
                 setUIState('idle');
             }
@@ -307,6 +445,35 @@ window.addEventListener('load', () => {
         });
     }
 
+    // Plays one audio clip per sentence. The next clip is preloaded while the
+    // current one plays, so the server synthesizes sentence N+1 during sentence N.
+    function playAudioQueue(urls) {
+        if (currentAudio) currentAudio.pause();
+        const queueId = ++audioQueueId;
+        let index = 0;
+        let nextAudio = new Audio(urls[0]);
+
+        const playNext = () => {
+            // A newer answer or a new chat has taken over the speaker
+            if (queueId !== audioQueueId) return;
+            if (index >= urls.length) {
+                setUIState('idle');
+                return;
+            }
+            const audio = nextAudio;
+            index += 1;
+            nextAudio = index < urls.length ? new Audio(urls[index]) : null;
+            if (nextAudio) nextAudio.preload = 'auto';
+            currentAudio = audio;
+            audio.onended = playNext;
+            audio.onerror = playNext;
+            audio.play();
+        };
+
+        setUIState('speaking');
+        playNext();
+    }
+
     // --- THIS IS THE CORRECTED FUNCTION ---
     function handleHistoryClick(event) {
         if (event.target.classList.contains('delete-history-btn')) {
@@ -314,40 +481,41 @@ window.addEventListener('load', () => {
         }
 
         const item = event.currentTarget;
-        const answerString = item.dataset.answer;
         const dbId = item.dataset.dbId;
 
         startNewChat(); // Always clear the current session first
         if (welcomeMessage) welcomeMessage.style.display = 'none';
 
-        // Check if the data is in the new JSON format (a string starting with '[')
-        if (answerString && answerString.trim().startsWith('[')) {
-            try {
-                const historyLog = JSON.parse(answerString);
-
+        // Transcripts are not embedded in the page; fetch this one now
+        fetch(`/history/${dbId}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            if (data.conversation) {
                 // Load the full conversation into the active session
-                conversationHistory = historyLog;
+                conversationHistory = data.conversation;
                 currentDbId = dbId;
                 saveSession(); // Make this the active session in sessionStorage
 
                 // Render the entire chat log
-                historyLog.forEach(turn => {
+                data.conversation.forEach(turn => {
                     renderTurn(turn.role, turn.parts[0].text);
                 });
-            } catch (e) {
-                console.error("Failed to parse history log:", e);
-                // Fallback for malformed JSON
-                renderTurn('user', item.dataset.question);
-                renderTurn('model', "Sorry, this conversation couldn't be loaded.");
+            } else {
+                // It's an old, plain-text answer. Just display it as a single Q&A.
+                renderTurn('user', data.question);
+                renderTurn('model', data.answer);
+                // The session remains "new", so any follow-up message will start a new chat log.
             }
-        } else {
-            // It's an old, plain-text answer. Just display it as a single Q&A.
-            const question = item.dataset.question;
-            renderTurn('user', question);
-            renderTurn('model', answerString);
-            // The session remains "new", so any follow-up message will start a new chat log.
-        }
-        mainConversationContainer.scrollTop = mainConversationContainer.scrollHeight;
+            mainConversationContainer.scrollTop = mainConversationContainer.scrollHeight;
+        })
+        .catch(e => {
+            console.error("Failed to load history log:", e);
+            renderTurn('user', item.dataset.question);
+            renderTurn('model', "Sorry, this conversation couldn't be loaded.");
+        });
     }
 
 
@@ -419,6 +587,52 @@ window.addEventListener('load', () => {
             });
     }
 
+    function uploadAndSketchVideo(file) {
+        if (welcomeMessage) welcomeMessage.style.display = 'none';
+        setUIState('processing');
+        const formData = new FormData();
+        formData.append('video', file);
+        const userTurn = document.createElement('div');
+        userTurn.className = 'chat-turn user-turn';
+        userTurn.textContent = `Generate a sketch video for: ${file.name}`;
+        mainConversationContainer.insertBefore(userTurn, typingIndicator);
+        const aiTurn = document.createElement('div');
+        aiTurn.className = 'chat-turn ai-turn';
+        aiTurn.textContent = 'Uploading your video...';
+        mainConversationContainer.insertBefore(aiTurn, typingIndicator);
+        fetch('/sketch-video', { method: 'POST', body: formData })
+            .then(response => response.json().then(data => {
+                if (!response.ok) throw new Error(data.error || 'Failed to start the sketch.');
+                return data;
+            }))
+            .then(data => new Promise((resolve, reject) => {
+                // The sketch is made in the background; poll until it's done
+                const poll = () => {
+                    fetch(data.status_url)
+                        .then(response => response.json())
+                        .then(status => {
+                            if (status.status === 'done') return resolve(status);
+                            if (status.status === 'error' || status.error) return reject(new Error(status.error || 'The sketch failed.'));
+                            aiTurn.textContent = status.frames_total
+                                ? `Sketching your video... ${Math.floor(100 * status.frames_done / status.frames_total)}%`
+                                : 'Sketching your video...';
+                            setTimeout(poll, 1000);
+                        })
+                        .catch(reject);
+                };
+                poll();
+            }))
+            .then(status => {
+                aiTurn.innerHTML = `<p>Here is the sketch video I generated:</p><video src="${status.video_url}" controls playsinline style="max-width:100%;border-radius:8px;margin-top:1rem;"></video>`;
+                mainConversationContainer.scrollTop = mainConversationContainer.scrollHeight;
+                setUIState('idle');
+            })
+            .catch(error => {
+                aiTurn.textContent = `Sorry, I couldn't create a sketch video. ${error.message}`;
+                setUIState('idle');
+            });
+    }
+
     function uploadAndGenerateMeme(file, topText, bottomText) {
         if (welcomeMessage) welcomeMessage.style.display = 'none';
         setUIState('processing');
@@ -0,0 +1,115 @@
+# transcripts.py
+"""
+One-off tooling for the compact transcript format (utils/transcript_codec.py):
+
+    flask transcripts migrate           # add History.transcript and convert old JSON rows
+    flask transcripts train-dict        # train a zstd dictionary on stored transcripts
+    flask transcripts import-dicts      # store dictionary files from TRANSCRIPT_DICT_DIR in the database
+
+Migrating is safe to interrupt and re-run: it only touches rows that still
+keep their conversation in History.answer. Rows with a plain-text answer
+(from before conversations were saved as JSON) are left as they are.
+
+Dictionaries live in the TranscriptDictionary table, where every web
+instance and worker can read them and deploys can't wipe them. Dictionaries
+trained before that were written to TRANSCRIPT_DICT_DIR; import-dicts copies
+them into the table so the rows compressed with them stay readable.
+"""
+import glob
+import json
+import os
+import random
+
+from sqlalchemy import inspect, text
+
+from models import db, History, TranscriptDictionary
+from utils.transcript_codec import _zstd, dictionaries, transcript_sample, train_dictionary
+
+# Where dictionaries used to be kept, before they were stored in the database
+TRANSCRIPT_DICT_DIR = os.getenv("TRANSCRIPT_DICT_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "instance", "transcript_dicts"))
+
+
+# History columns added after the table was first created
+ADDED_COLUMNS = ("transcript", "turn_count")
+
+
+def ensure_history_columns():
+    """Adds newer History columns to databases created before them. create_all() doesn't alter tables."""
+    existing = {column["name"] for column in inspect(db.engine).get_columns(History.__tablename__)}
+    added = []
+    for name in ADDED_COLUMNS:
+        if name in existing:
+            continue
+        column_type = History.__table__.c[name].type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {History.__tablename__} ADD COLUMN {name} {column_type}"))
+        print(f"✓ Added history.{name}")
+        added.append(name)
+    return added
+
+
+def migrate_transcripts(batch_size=500):
+    """Moves JSON conversations from History.answer into History.transcript. Returns (converted, bytes before, bytes after)."""
+    ensure_history_columns()
+    converted = before = after = 0
+    last_id = 0
+    while True:
+        rows = (History.query.filter(History.id > last_id, History.transcript.is_(None))
+                .order_by(History.id).limit(batch_size).all())
+        if not rows:
+            break
+        for row in rows:
+            last_id = row.id
+            try:
+                turns = json.loads(row.answer)
+            except (TypeError, ValueError):
+                continue
+            if not isinstance(turns, list):
+                continue
+            before += len(row.answer.encode("utf-8"))
+            row.conversation = turns
+            after += len(row.transcript)
+            converted += 1
+        db.session.commit()
+        print(f"  ...converted {converted} row(s) up to id {last_id}")
+    return converted, before, after
+
+
+def store_dictionary(data):
+    """Saves a zstd dictionary in the TranscriptDictionary table, unless it is there already. Returns its dict id."""
+    dict_id = _zstd().ZstdCompressionDict(data).dict_id()
+    if db.session.get(TranscriptDictionary, dict_id) is None:
+        db.session.add(TranscriptDictionary(dict_id=dict_id, data=data))
+        db.session.commit()
+    dictionaries.reset()
+    return dict_id
+
+
+def train_transcript_dictionary(output=None, max_samples=5000, size=32 * 1024):
+    """
+    Trains a zstd dictionary on a random sample of stored transcripts and stores it in the database.
+    output optionally names a file to write a copy to. Returns (dict id, samples used).
+    """
+    ids = [row.id for row in db.session.query(History.id).filter(History.transcript.isnot(None))]
+    samples = []
+    for history_id in random.sample(ids, min(max_samples, len(ids))):
+        conversation = db.session.get(History, history_id).conversation
+        if conversation:
+            samples.append(transcript_sample(conversation))
+        db.session.expunge_all()
+    dictionary = train_dictionary(samples, size)
+    if output:
+        with open(output, "wb") as f:
+            f.write(dictionary)
+    return store_dictionary(dictionary), len(samples)
+
+
+def import_dictionaries(directory=TRANSCRIPT_DICT_DIR):
+    """Stores every *.dict file in directory in the database, oldest file first. Returns the dict ids."""
+    paths = sorted(glob.glob(os.path.join(directory, "*.dict")), key=os.path.getmtime)
+    dict_ids = []
+    for path in paths:
+        with open(path, "rb") as f:
+            dict_ids.append(store_dictionary(f.read()))
+    return dict_ids
@@ -0,0 +1,51 @@
+# user_cache.py
+"""
+Short-lived cache of user identities so Flask-Login does not query the
+database on every authenticated request.
+
+Only id, username and email are cached. A cached user is turned back into a
+session-attached User with merge(load=False), which issues no SQL; anything
+else (password_hash, history) is loaded lazily if a route actually needs it.
+Each worker has its own cache, so a change made in another worker shows up
+after at most USER_CACHE_TTL seconds.
+"""
+import os
+import threading
+
+from cachetools import TTLCache
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+CACHED_FIELDS = ("id", "username", "email")
+
+_lock = threading.Lock()
+_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def user_snapshot(user):
+    return {field: getattr(user, field) for field in CACHED_FIELDS}
+
+
+def get_cached_user(user_id):
+    with _lock:
+        return _cache.get(user_id)
+
+
+def cache_user(user):
+    with _lock:
+        _cache[user.id] = user_snapshot(user)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def attach_user(snapshot):
+    """Rebuilds a persistent User in the current session from a snapshot without querying."""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
@@ -0,0 +1,178 @@
+# utils/intent_batcher.py
+"""
+Micro-batching for intent detection.
+
+Messages that arrive within INTENT_BATCH_MAX_WAIT_MS of each other (up to
+INTENT_BATCH_MAX_SIZE of them) are classified together with one Gemini call
+instead of one call each, and every waiting request gets its own result back.
+Setting INTENT_BATCH_MAX_SIZE=1 turns batching off.
+
+Each item of the batched reply must echo its message's id, and the ids must
+cover the batch exactly once, or the whole batch is classified one message
+at a time. An item whose "content" uses words that aren't in its own message
+is classified on its own as well, so one user's text can never end up in
+another user's answer. Those one-by-one calls run in parallel and must all
+finish within INTENT_BATCH_FALLBACK_SECONDS; a message still unclassified
+then gets the fallback intent, as on any other intent error.
+
+Batching only helps when one process handles concurrent requests (gthread,
+gevent or ASGI workers); with sync workers every batch has one message.
+"""
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils import metrics
+from utils.gemini_answer import get_gemini_answer, get_gemini_answers_batch, INTENT_FALLBACK
+from utils.response_cache import cached
+
+INTENT_BATCH_MAX_SIZE = int(os.getenv("INTENT_BATCH_MAX_SIZE", "8"))
+INTENT_BATCH_MAX_WAIT_MS = float(os.getenv("INTENT_BATCH_MAX_WAIT_MS", "5"))
+# Batches that may be waiting on Gemini at the same time
+INTENT_BATCH_CONCURRENCY = int(os.getenv("INTENT_BATCH_CONCURRENCY", "4"))
+# How long the messages of a rejected batch may take, together, to be classified one by one
+INTENT_BATCH_FALLBACK_SECONDS = float(os.getenv("INTENT_BATCH_FALLBACK_SECONDS", "10"))
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(text):
+    return set(_WORD_RE.findall(str(text).lower()))
+
+
+def match_batch_reply(texts, reply):
+    """
+    Maps a batched intent reply back to texts. Returns one result per text, or None where that text
+    has to be classified on its own. Returns None for the whole batch unless the items' ids are exactly
+    0..len(texts)-1, each once.
+    """
+    if not isinstance(reply, list) or len(reply) != len(texts):
+        return None
+    if not all(isinstance(item, dict) and "intent" in item for item in reply):
+        return None
+    ids = [item.get("id") for item in reply]
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids) or sorted(ids) != list(range(len(texts))):
+        return None
+    results = [None] * len(texts)
+    for item in reply:
+        index = item["id"]
+        content = item.get("content")
+        if isinstance(content, str) and _words(content) <= _words(texts[index]):
+            results[index] = {"intent": item["intent"], "content": content}
+    return results
+
+
+class _Pending:
+    __slots__ = ("text", "event", "result")
+
+    def __init__(self, text):
+        self.text = text
+        self.event = threading.Event()
+        self.result = None
+
+
+class IntentBatcher:
+    def __init__(self, max_batch_size=INTENT_BATCH_MAX_SIZE, max_wait_ms=INTENT_BATCH_MAX_WAIT_MS,
+                 concurrency=INTENT_BATCH_CONCURRENCY, fallback_seconds=INTENT_BATCH_FALLBACK_SECONDS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self.fallback_seconds = fallback_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each worker starts its own collector
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="intent-batch")
+            # Enough for every message of every concurrent batch to be classified on its own at once
+            self._fallback = ThreadPoolExecutor(max_workers=self.concurrency * self.max_batch_size,
+                                                thread_name_prefix="intent-single")
+            threading.Thread(target=self._collect, name="intent-batcher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def classify(self, text, timeout=60):
+        """Returns {"intent": ..., "content": ...} for one message, batched with any concurrent ones."""
+        if self.max_batch_size <= 1:
+            return get_gemini_answer(text)
+        self._ensure_started()
+        pending = _Pending(text)
+        self._queue.put(pending)
+        if not pending.event.wait(timeout):
+            print("Intent batch timed out, returning the fallback intent.")
+            return dict(INTENT_FALLBACK)
+        return pending.result
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        metrics.increment("intent_batches_total")
+        metrics.increment("intent_batch_messages_total", len(batch))
+        texts = [pending.text for pending in batch]
+        results = [None] * len(texts)
+        if len(texts) > 1:
+            try:
+                matched = match_batch_reply(texts, get_gemini_answers_batch(texts))
+                if matched is None:
+                    metrics.increment("intent_batch_rejected_total", reason="ids")
+                    print(f"Gemini batch intent reply did not match {len(texts)} requests, classifying one by one.")
+                else:
+                    results = matched
+                    metrics.increment("intent_batch_rejected_total", results.count(None), reason="content")
+            except Exception as e:
+                print(f"Error in Gemini batch intent analysis: {e}")
+        self._classify_singly(texts, results)
+        for pending, result in zip(batch, results):
+            pending.result = result
+            pending.event.set()
+
+    def _classify_singly(self, texts, results):
+        """Fills the None entries of results by classifying those texts one at a time, in parallel."""
+        # get_gemini_answer falls back to INTENT_FALLBACK on its own errors
+        futures = {self._fallback.submit(get_gemini_answer, texts[index]): index
+                   for index, result in enumerate(results) if result is None}
+        if not futures:
+            return
+        done, not_done = wait(futures, timeout=self.fallback_seconds)
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Error classifying intent on its own: {e}")
+                results[futures[future]] = dict(INTENT_FALLBACK)
+        if not_done:
+            metrics.increment("intent_batch_fallback_timeouts_total", len(not_done))
+            print(f"{len(not_done)} intent(s) not classified within {self.fallback_seconds:g}s, using the fallback intent.")
+        for future in not_done:
+            future.cancel()
+            results[futures[future]] = dict(INTENT_FALLBACK)
+
+
+intent_batcher = IntentBatcher()
+
+
+# The intent depends only on the message, so repeated questions skip Gemini
+@cached("intent", provider="gemini", cacheable=lambda result: isinstance(result, dict) and result != INTENT_FALLBACK)
+def classify_intent(text):
+    return intent_batcher.classify(text)
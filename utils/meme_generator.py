@@ -1,71 +1,175 @@
 # utils/meme_generator.py
-from PIL import Image, ImageDraw, ImageFont
+"""
+Meme rendering: white, black-outlined captions at the top and bottom of an
+image.
+
+Fonts are loaded once per (path, size) and kept in an LRU cache, and the
+outline is drawn in the same pass as the text with stroke_width. Captions
+wrap onto several lines, and their font size is found by binary search: the
+largest size at which the wrapped caption fits the image's width and a share
+of its height. That keeps a render cheap enough for the live preview in the
+meme dialog (render_meme_preview).
+"""
+import functools
 import io
+import os
 import traceback
 
+# Tried in order; MEME_FONT overrides them
+FONT_CANDIDATES = [
+    os.getenv("MEME_FONT", ""),
+    "impact.ttf",
+    "arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+]
+MIN_FONT_SIZE = 10
+# Each caption may use at most this share of the image height
+CAPTION_MAX_HEIGHT = 0.3
+MARGIN = 0.03
+PREVIEW_MAX_SIZE = int(os.getenv("MEME_PREVIEW_MAX_SIZE", "480"))
+
+
+@functools.lru_cache(maxsize=1)
+def _font_path():
+    from PIL import ImageFont
+    for path in FONT_CANDIDATES:
+        if not path:
+            continue
+        try:
+            ImageFont.truetype(path, MIN_FONT_SIZE)
+            return path
+        except IOError:
+            continue
+    print("WARNING: No TrueType font found for memes, using Pillow's default font.")
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def get_font(path, size):
+    """Loads a font once per (path, size)."""
+    from PIL import ImageFont
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+def wrap_text(text, font, max_width):
+    """Greedy word wrap by measured width. A single word wider than max_width gets a line of its own."""
+    lines = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if not current or font.getlength(candidate) <= max_width:
+            current = candidate
+        else:
+            lines.append(current)
+            current = word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _layout(text, size, max_width, max_height):
+    """Returns (font, lines, stroke_width) if the caption fits at this size, else None."""
+    font = get_font(_font_path(), size)
+    lines = wrap_text(text, font, max_width)
+    stroke_width = max(1, size // 15)
+    if any(font.getlength(line) + 2 * stroke_width > max_width for line in lines):
+        return None
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    if line_height * len(lines) + 2 * stroke_width > max_height:
+        return None
+    return font, lines, stroke_width
+
+
+def fit_caption(text, width, height):
+    """Finds the largest font size at which the caption fits, by binary search. Returns (font, lines, stroke_width)."""
+    max_width = width * (1 - 2 * MARGIN)
+    max_height = height * CAPTION_MAX_HEIGHT
+    low, high = MIN_FONT_SIZE, max(MIN_FONT_SIZE, int(height / 6))
+    best = None
+    while low <= high:
+        size = (low + high) // 2
+        layout = _layout(text, size, max_width, max_height)
+        if layout:
+            best = layout
+            low = size + 1
+        else:
+            high = size - 1
+    if best is None:
+        # Too long to fit even at the smallest size; draw it anyway rather than drop it
+        font = get_font(_font_path(), MIN_FONT_SIZE)
+        best = font, wrap_text(text, font, max_width), 1
+    return best
+
+
+def draw_caption(draw, text, width, height, position):
+    font, lines, stroke_width = fit_caption(text, width, height)
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    margin = int(height * MARGIN)
+    if position == "top":
+        y = margin + stroke_width
+    else:
+        y = height - margin - stroke_width - line_height * len(lines)
+    for line in lines:
+        x = (width - font.getlength(line)) / 2
+        draw.text((x, y), line, font=font, fill="white", stroke_width=stroke_width, stroke_fill="black")
+        y += line_height
+
+
+def _image_file(data):
+    # Uploads arrive as bytes, or as a read-only mmap of the spooled file, which is file-like already
+    if hasattr(data, "seek"):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def render_meme(img, top_text, bottom_text):
+    """Draws the captions onto a PIL image in place and returns it."""
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(img)
+    width, height = img.size
+    if top_text and top_text.strip():
+        draw_caption(draw, top_text.upper(), width, height, "top")
+    if bottom_text and bottom_text.strip():
+        draw_caption(draw, bottom_text.upper(), width, height, "bottom")
+    return img
+
+
 def generate_meme(input_image_bytes, output_path, top_text, bottom_text):
     """
     Generates a meme from image bytes and saves it to the output path.
-    Enhanced with better error handling and debugging.
     """
     try:
+        from PIL import Image
+
         # Open the image directly from the in-memory bytes
-        img = Image.open(io.BytesIO(input_image_bytes)).convert("RGB")
-        print(f"DEBUG: Image opened successfully. Size: {img.size}")
-        
-        draw = ImageDraw.Draw(img)
-        width, height = img.size
-        
-        # Simple font sizing (can be improved)
-        font_size = int(height / 10)
-        try:
-            # Try to load a common font, otherwise use default
-            font = ImageFont.truetype("arial.ttf", font_size)
-            print(f"DEBUG: Using Arial font at size {font_size}")
-        except IOError:
-            try:
-                # Try alternative font paths for different systems
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-                print(f"DEBUG: Using DejaVu font at size {font_size}")
-            except IOError:
-                font = ImageFont.load_default()
-                print(f"DEBUG: Using default font")
-
-        # Function to draw text with a black outline
-        def draw_text_with_outline(text, x, y):
-            # Outline
-            draw.text((x-2, y-2), text, font=font, fill="black")
-            draw.text((x+2, y-2), text, font=font, fill="black")
-            draw.text((x-2, y+2), text, font=font, fill="black")
-            draw.text((x+2, y+2), text, font=font, fill="black")
-            # Fill
-            draw.text((x, y), text, font=font, fill="white")
-
-        # Top text
-        if top_text:
-            bbox = draw.textbbox((0, 0), top_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            x = (width - text_width) / 2
-            y = 10  # Padding from top
-            draw_text_with_outline(top_text.upper(), x, y)
-            print(f"DEBUG: Added top text: {top_text}")
-
-        # Bottom text
-        if bottom_text:
-            bbox = draw.textbbox((0, 0), bottom_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            x = (width - text_width) / 2
-            y = height - text_height - 10  # Padding from bottom
-            draw_text_with_outline(bottom_text.upper(), x, y)
-            print(f"DEBUG: Added bottom text: {bottom_text}")
-            
-        # Save the meme
+        img = Image.open(_image_file(input_image_bytes)).convert("RGB")
+        render_meme(img, top_text, bottom_text)
         img.save(output_path, "JPEG")
         print(f"SUCCESS: Meme saved to {output_path}")
         return True
-        
+
     except Exception as e:
         print(f"ERROR in generate_meme: {e}")
         print(f"ERROR Traceback: {traceback.format_exc()}")
-        return False
\ No newline at end of file
+        return False
+
+
+def render_meme_preview(input_image_bytes, top_text, bottom_text, max_size=PREVIEW_MAX_SIZE):
+    """Renders a small JPEG preview of the meme and returns its bytes."""
+    from PIL import Image
+
+    img = Image.open(_image_file(input_image_bytes))
+    # For JPEGs, draft() lets the decoder downscale while decoding, which is much faster
+    img.draft("RGB", (max_size, max_size))
+    img = img.convert("RGB")
+    img.thumbnail((max_size, max_size))
+    render_meme(img, top_text, bottom_text)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
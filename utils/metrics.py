@@ -0,0 +1,355 @@
+# utils/metrics.py
+"""
+Lightweight request tracing and latency metrics.
+
+    with span("gemini_generate", provider="gemini"):
+        ...
+
+Every span is recorded in a per-stage latency histogram (labelled with stage,
+intent and provider) and in the trace of the current request. Histograms are
+rendered in Prometheus text format by render_prometheus().
+
+Everything is off unless METRICS_ENABLED=true; span() then returns a shared
+no-op context manager, so instrumented code pays one attribute lookup.
+
+Counters and histograms live in each process, but /metrics is answered by
+whichever gunicorn worker takes the request. So gunicorn.conf.py has every
+worker call share_with_workers(): the worker then writes a snapshot of its
+counters and histograms to METRICS_DIR/<pid>.json every
+METRICS_FLUSH_SECONDS, and render_prometheus() adds up its own live values
+and every other snapshot there, those of workers that have since exited
+included, so totals never go backwards. The master empties the directory
+when it starts. Gauges are read from the answering worker only and carry a
+pid label.
+"""
+import bisect
+import contextvars
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# Seconds. Upstream calls range from a few ms (cache, DB) to tens of seconds (LLM).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = Counter()
+# name -> callback returning [(labels dict, value), ...], read at scrape time
+_gauges = {}
+# The directory this worker shares its metrics through, if any (see share_with_workers)
+_shared_dir = None
+
+# The trace of the request being handled on this thread: {"labels": {...}, "spans": [...]}
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class _Histogram:
+    __slots__ = ("bucket_counts", "count", "total")
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if index < len(LATENCY_BUCKETS):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += value
+
+
+def observe(stage, seconds, intent="", provider=""):
+    """Records one latency sample for a stage."""
+    if not METRICS_ENABLED:
+        return
+    key = (stage, intent, provider)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(seconds)
+
+
+def increment(name, amount=1, **labels):
+    """Increments a counter, e.g. increment("cache_hits_total", cache="user")."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += amount
+
+
+def register_gauge(name, callback):
+    """Exports callback()'s [(labels, value), ...] as a gauge whenever metrics are rendered."""
+    with _lock:
+        _gauges[name] = callback
+
+
+class _Span:
+    __slots__ = ("stage", "provider", "intent", "start")
+
+    def __init__(self, stage, provider, intent):
+        self.stage = stage
+        self.provider = provider
+        self.intent = intent
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        trace = _current_trace.get()
+        intent = self.intent
+        if trace is not None:
+            intent = intent or trace["labels"].get("intent", "")
+            trace["spans"].append((self.stage, elapsed))
+        observe(self.stage, elapsed, intent, self.provider)
+        if exc_type is not None:
+            increment("span_errors_total", stage=self.stage, provider=self.provider)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage, provider="", intent=""):
+    """Times the wrapped block as one stage of the current request."""
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage, provider, intent)
+
+
+def start_trace(**labels):
+    """Begins collecting spans for the current request."""
+    if not METRICS_ENABLED:
+        return None
+    return _current_trace.set({"labels": dict(labels), "spans": []})
+
+
+def set_trace_label(name, value):
+    """Attaches a label (such as the detected intent) to every later span in this request."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["labels"][name] = value
+
+
+def finish_trace(token):
+    """Ends the current trace and returns its spans as [(stage, seconds), ...]."""
+    if token is None:
+        return []
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace["spans"] if trace else []
+
+
+def current_spans():
+    """Returns the spans recorded so far in the current request."""
+    trace = _current_trace.get()
+    return list(trace["spans"]) if trace else []
+
+
+def server_timing_header(spans):
+    """Formats spans as a Server-Timing header so browser devtools show the breakdown."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans)
+
+
+def _format_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+def _snapshot():
+    with _lock:
+        histograms = {key: (list(h.bucket_counts), h.count, h.total) for key, h in _histograms.items()}
+        return histograms, dict(_counters)
+
+
+def clear_shared(directory=METRICS_DIR):
+    """Deletes the snapshots of a previous run. Called by gunicorn's master before it starts workers."""
+    if not METRICS_ENABLED:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.unlink(path)
+
+
+def share_with_workers(directory=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+    """Makes this (forked) worker publish its metrics in directory and include the other workers' in render_prometheus()."""
+    global _shared_dir
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        # Whatever the master recorded before forking is not this worker's
+        _histograms.clear()
+        _counters.clear()
+    os.makedirs(directory, exist_ok=True)
+    _shared_dir = directory
+    threading.Thread(target=_publish, args=(directory, flush_seconds), name="metrics-publisher", daemon=True).start()
+
+
+def _publish(directory, flush_seconds):
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    while True:
+        time.sleep(flush_seconds)
+        histograms, counters = _snapshot()
+        data = {
+            "histograms": [[list(key), buckets, count, total] for key, (buckets, count, total) in histograms.items()],
+            "counters": [[name, [list(label) for label in labels], value] for (name, labels), value in counters.items()],
+        }
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Could not publish metrics: {e}")
+
+
+def _add_shared(directory, histograms, counters):
+    """Adds every other worker's last snapshot in directory to histograms and counters."""
+    own = os.path.join(directory, f"{os.getpid()}.json")
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Exited and cleaned up, or mid-replace
+            continue
+        for key, buckets, count, total in data["histograms"]:
+            key = tuple(key)
+            mine = histograms.get(key, ([0] * len(LATENCY_BUCKETS), 0, 0.0))
+            histograms[key] = ([a + b for a, b in zip(mine[0], buckets)], mine[1] + count, mine[2] + total)
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+
+
+def render_prometheus():
+    """Returns all metrics of this process, and of the other workers if shared, in Prometheus text exposition format."""
+    histograms, counters = _snapshot()
+    if _shared_dir is not None:
+        _add_shared(_shared_dir, histograms, counters)
+    with _lock:
+        gauges = dict(_gauges)
+
+    lines = [
+        "# HELP stage_latency_seconds Latency of each request stage.",
+        "# TYPE stage_latency_seconds histogram",
+    ]
+    for (stage, intent, provider), (bucket_counts, count, total) in sorted(histograms.items()):
+        base = _format_labels((("stage", stage), ("intent", intent), ("provider", provider)))
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'stage_latency_seconds_bucket{{{base},le="{bound}"}} {cumulative}')
+        lines.append(f'stage_latency_seconds_bucket{{{base},le="+Inf"}} {count}')
+        lines.append(f"stage_latency_seconds_count{{{base}}} {count}")
+        lines.append(f"stage_latency_seconds_sum{{{base}}} {total:.6f}")
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        label_text = _format_labels(labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    for name, callback in sorted(gauges.items()):
+        try:
+            rows = callback()
+        except Exception as e:
+            print(f"Could not read gauge {name}: {e}")
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in rows:
+            if _shared_dir is not None:
+                labels = dict(labels, pid=os.getpid())
+            lines.append(f"{name}{{{_format_labels(sorted(labels.items()))}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class StackSampler:
+    """
+    Optional sampling profiler. A daemon thread snapshots every thread's stack
+    at a fixed interval and counts them as folded stacks (flamegraph.pl format).
+    Enabled with PROFILER_INTERVAL_MS (together with METRICS_ENABLED). Once
+    max_stacks distinct stacks have been seen, samples of new ones are
+    counted under OTHER_STACK so memory stays bounded.
+    """
+    OTHER_STACK = "(other)"
+
+    def __init__(self, interval_seconds, max_stacks=5000):
+        self.interval = interval_seconds
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack = ";".join(reversed(names))
+                with self._lock:
+                    if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                        stack = self.OTHER_STACK
+                    self.stacks[stack] += 1
+
+    def folded(self):
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+_profiler = None
+
+
+def start_profiler():
+    """Starts the stack sampler once per process if PROFILER_INTERVAL_MS is set."""
+    global _profiler
+    interval_ms = os.getenv("PROFILER_INTERVAL_MS")
+    if not METRICS_ENABLED or not interval_ms or _profiler is not None:
+        return _profiler
+    with _lock:
+        if _profiler is None:
+            _profiler = StackSampler(int(interval_ms) / 1000,
+                                     int(os.getenv("PROFILER_MAX_STACKS", "5000"))).start()
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
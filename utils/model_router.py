@@ -0,0 +1,242 @@
+# utils/model_router.py
+"""
+Deadline-bounded, hedged calls to Gemini models.
+
+Each kind of call (a route: intent_detection, answer_text, ...) has an
+ordered list of models, a hedge delay and a deadline:
+
+    model_router.call("answer_text", lambda model_name: ask(model_name))
+
+The first model is called straight away. If it hasn't answered by the hedge
+delay, the next model is called as well and whichever answers first wins;
+the slower call is left to finish in the background, since an HTTP request
+can't be taken back. A model that fails makes way for the next one at once.
+If nothing has answered by the deadline, ModelDeadlineExceeded is raised.
+
+The hedge delay is the model's p95 latency on that route over its last
+`latency_window` successful calls, or the configured hedge_after_seconds
+until there are `min_samples` of them. So in steady state only about one
+call in twenty is hedged.
+
+A hedge is an extra upstream call, so it must get a Gemini rate-limit token
+and concurrency slot (set_hedge_guard) and a free thread in the pool without
+waiting; otherwise it is skipped and the first call is left to answer alone.
+Losing and stuck calls keep their thread until they return, so under load
+hedging backs off instead of queueing behind them.
+
+Routes live in utils/model_routes.json, or in the file named by
+MODEL_ROUTES_CONFIG, and are read once at startup. Per-model latency, wins,
+losses and errors are kept for stats() and exported through utils.metrics.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import metrics
+
+MODEL_ROUTES_CONFIG = os.getenv(
+    "MODEL_ROUTES_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_routes.json"))
+# Model calls that may be in flight at once in one worker, hedges included
+MODEL_ROUTER_THREADS = int(os.getenv("MODEL_ROUTER_THREADS", "16"))
+
+# Every route calls Gemini; hedges are rate-limited as calls to this provider
+PROVIDER = "gemini"
+
+# Used when the config file is missing or a route is not in it: one model, no hedging
+DEFAULT_ROUTE = {"models": ["gemini-pro"], "hedge_after_seconds": None, "deadline_seconds": 30}
+DEFAULT_CONFIG = {"latency_window": 200, "min_samples": 20, "routes": {}}
+
+
+class ModelDeadlineExceeded(TimeoutError):
+    pass
+
+
+def load_routes(path=MODEL_ROUTES_CONFIG):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path) as f:
+            config.update(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"Could not load model routes {path}, using {DEFAULT_ROUTE['models'][0]} everywhere: {e}")
+    return config
+
+
+class _LatencyWindow:
+    __slots__ = ("samples",)
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+
+    def percentile(self, q):
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ModelRouter:
+    def __init__(self, config=None, threads=MODEL_ROUTER_THREADS):
+        config = config or load_routes()
+        self.routes = config["routes"]
+        self.latency_window = config["latency_window"]
+        self.min_samples = config["min_samples"]
+        self.threads = threads
+        self._lock = threading.Lock()
+        # (route, model) -> _LatencyWindow / Counter of outcomes. A call that loses and then fails counts as both.
+        self._latency = {}
+        self._outcomes = {}
+        self._busy = 0
+        self._hedge_guard = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Pools don't survive fork, so each worker creates its own on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="model-call")
+            self._pid = os.getpid()
+
+    def set_hedge_guard(self, guard):
+        """guard(provider) returns a context manager held around every hedge; if entering it raises, no hedge is sent."""
+        self._hedge_guard = guard
+
+    def _submit(self, route_name, model, fn):
+        with self._lock:
+            self._busy += 1
+        future = self._executor.submit(self._timed, route_name, model, fn)
+        future.add_done_callback(self._call_done)
+        return future
+
+    def _call_done(self, future):
+        with self._lock:
+            self._busy -= 1
+
+    def _hedge_slot(self):
+        """(context manager already entered, None) for a hedge that may go out now, or (None, reason) to skip it."""
+        with self._lock:
+            if self._busy >= self.threads:
+                return None, "pool_busy"
+        slot = self._hedge_guard(PROVIDER) if self._hedge_guard else nullcontext()
+        try:
+            slot.__enter__()
+        except Exception:
+            return None, "rate_limit"
+        return slot, None
+
+    def route(self, name):
+        return dict(DEFAULT_ROUTE, **self.routes.get(name, {}))
+
+    def _count(self, route_name, model, outcome):
+        with self._lock:
+            self._outcomes.setdefault((route_name, model), Counter())[outcome] += 1
+        metrics.increment("model_calls_total", route=route_name, model=model, outcome=outcome)
+
+    def hedge_delay(self, route_name, route, model):
+        """Seconds to wait for model before hedging, or None to never hedge."""
+        if route["hedge_after_seconds"] is None:
+            return None
+        with self._lock:
+            window = self._latency.get((route_name, model))
+            if window is not None and len(window.samples) >= self.min_samples:
+                return window.percentile(0.95)
+        return route["hedge_after_seconds"]
+
+    def _timed(self, route_name, model, fn):
+        start = time.perf_counter()
+        try:
+            result = fn(model)
+        except Exception:
+            self._count(route_name, model, "error")
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            window = self._latency.get((route_name, model))
+            if window is None:
+                window = self._latency[(route_name, model)] = _LatencyWindow(self.latency_window)
+            window.samples.append(elapsed)
+        metrics.observe("model_call", elapsed, intent=route_name, provider=model)
+        return result
+
+    def call(self, route_name, fn):
+        """Returns fn(model_name) from the first model on the route to answer. See the module docstring."""
+        self._ensure_started()
+        route = self.route(route_name)
+        models = route["models"]
+        start = time.monotonic()
+        deadline = start + route["deadline_seconds"]
+        running = {}
+        launched = []
+        hedge_at = None
+        last_error = None
+
+        def launch(hedge=False):
+            nonlocal hedge_at
+            model = models[len(launched)]
+            if hedge:
+                slot, skipped = self._hedge_slot()
+                if slot is None:
+                    metrics.increment("model_hedges_skipped_total", route=route_name, reason=skipped)
+                    hedge_at = None
+                    return
+                metrics.increment("model_hedges_total", route=route_name)
+            launched.append(model)
+            self._count(route_name, model, "launched")
+            future = self._submit(route_name, model, fn)
+            if hedge:
+                future.add_done_callback(lambda _: slot.__exit__(None, None, None))
+            running[future] = model
+            delay = self.hedge_delay(route_name, route, model)
+            hedge_at = time.monotonic() + delay if delay is not None and len(launched) < len(models) else None
+
+        launch()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+            done, _ = wait(running, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                model = running.pop(future)
+                if future.exception() is None:
+                    self._count(route_name, model, "win")
+                    for other in running.values():
+                        self._count(route_name, other, "lost")
+                    return future.result()
+                last_error = future.exception()
+            if not running:
+                if len(launched) == len(models):
+                    raise last_error
+                print(f"Model {launched[-1]} failed on {route_name}, falling back: {last_error}")
+                launch()
+            elif hedge_at is not None and time.monotonic() >= hedge_at:
+                launch(hedge=True)
+
+        for model in running.values():
+            self._count(route_name, model, "timeout")
+        raise ModelDeadlineExceeded(f"No model answered {route_name} within {route['deadline_seconds']}s.")
+
+    def stats(self):
+        """Per route and model: outcome counts, win rate and p50/p95 latency in this worker."""
+        with self._lock:
+            keys = sorted(set(self._outcomes) | set(self._latency))
+            rows = []
+            for route_name, model in keys:
+                outcomes = self._outcomes.get((route_name, model), Counter())
+                window = self._latency.get((route_name, model))
+                rows.append({
+                    "route": route_name,
+                    "model": model,
+                    **{outcome: outcomes[outcome] for outcome in ("launched", "win", "lost", "error", "timeout")},
+                    "win_rate": outcomes["win"] / outcomes["launched"] if outcomes["launched"] else None,
+                    "p50_seconds": window.percentile(0.5) if window and window.samples else None,
+                    "p95_seconds": window.percentile(0.95) if window and window.samples else None,
+                })
+        return rows
+
+
+model_router = ModelRouter()
@@ -0,0 +1,225 @@
+# utils/rate_limit.py
+"""
+Token-bucket rate limiting and concurrency control for upstream calls.
+
+Buckets are keyed per user ("user:42"), per provider ("provider:gemini") and
+globally ("global"). Limits come from env vars in "<requests>/<seconds>" form:
+
+    RATE_LIMIT_USER=30/60          each user: 30 requests per minute, bursts of 30
+    RATE_LIMIT_GLOBAL=600/60       all users together
+    RATE_LIMIT_GEMINI=120/60       one var per provider (GEMINI, SERPAPI, GIPHY, PEXELS)
+    UPSTREAM_CONCURRENCY_GEMINI=8  in-flight calls per worker process
+
+With REDIS_URL set the buckets are shared by all workers; otherwise each
+process keeps its own. A caller over its limit waits in line until tokens
+free up. Only when that wait would pass the request deadline does it fail
+with RateLimitExceeded, which carries a retry_after hint. All the buckets
+of one acquire() are taken in a single atomic step (under a lock, or in one
+Lua script), so a caller rejected by one bucket never spends a token from
+another. The deadline bounds how long a waiting request holds its worker.
+"""
+import os
+import random
+import threading
+import time
+
+from utils import metrics
+from utils.redis_client import get_redis
+
+PROVIDERS = ("gemini", "serpapi", "giphy", "pexels")
+DEFAULT_LIMITS = {"user": "30/60"}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, bucket, retry_after):
+        super().__init__(f"Rate limit exceeded for {bucket}")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def parse_limit(value):
+    """Parses "30/60" into (rate per second, capacity). Returns None for an empty value."""
+    if not value:
+        return None
+    count, _, seconds = value.partition("/")
+    count = float(count)
+    seconds = float(seconds or 1)
+    return count / seconds, count
+
+
+class MemoryBackend:
+    """Per-process buckets. Used when REDIS_URL is not set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def try_acquire(self, buckets):
+        """
+        Takes `cost` tokens from every bucket, or from none of them.
+        buckets is a list of (key, rate, capacity, cost). Returns 0 on success,
+        otherwise the seconds until all buckets could have enough tokens.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, rate, capacity, cost in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                levels.append(tokens)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+            if wait:
+                return wait
+            for (key, rate, capacity, cost), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost, now)
+            return 0.0
+
+
+_REDIS_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[(i - 1) * 3 + 1])
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[(i - 1) * 3 + 1])
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+
+class RedisBackend:
+    """Buckets shared by every worker, updated atomically by a Lua script."""
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self.script = self.client.register_script(_REDIS_SCRIPT)
+
+    def try_acquire(self, buckets):
+        keys = [self.prefix + key for key, _, _, _ in buckets]
+        args = []
+        for _, rate, capacity, cost in buckets:
+            args.extend([rate, capacity, cost])
+        return float(self.script(keys=keys, args=args))
+
+
+def _make_backend():
+    if os.getenv("REDIS_URL"):
+        try:
+            return RedisBackend(get_redis())
+        except Exception as e:
+            print(f"Could not use Redis for rate limits, falling back to per-process buckets: {e}")
+    return MemoryBackend()
+
+
+class RateLimiter:
+    def __init__(self, backend=None, limits=None, concurrency=None):
+        self.backend = backend or _make_backend()
+        self.limits = limits if limits is not None else self._limits_from_env()
+        if concurrency is None:
+            concurrency = self._concurrency_from_env()
+        self.semaphores = {provider: threading.BoundedSemaphore(count) for provider, count in concurrency.items()}
+
+    @staticmethod
+    def _limits_from_env():
+        limits = {}
+        for name in ("user", "global") + PROVIDERS:
+            limit = parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", DEFAULT_LIMITS.get(name, "")))
+            if limit:
+                limits[name] = limit
+        return limits
+
+    @staticmethod
+    def _concurrency_from_env():
+        return {
+            provider: int(os.environ[f"UPSTREAM_CONCURRENCY_{provider.upper()}"])
+            for provider in PROVIDERS
+            if os.getenv(f"UPSTREAM_CONCURRENCY_{provider.upper()}")
+        }
+
+    def acquire(self, deadline, user_id=None, provider=None, include_global=False, cost=1):
+        """
+        Waits until the user, provider and/or global buckets all have capacity.
+        deadline is a time.monotonic() value; raises RateLimitExceeded if the
+        wait would run past it.
+        """
+        buckets = []
+        if user_id is not None and "user" in self.limits:
+            buckets.append((f"user:{user_id}",) + self.limits["user"] + (cost,))
+        if provider is not None and provider in self.limits:
+            buckets.append((f"provider:{provider}",) + self.limits[provider] + (cost,))
+        if include_global and "global" in self.limits:
+            buckets.append(("global",) + self.limits["global"] + (cost,))
+        if not buckets:
+            return
+
+        label = buckets[0][0].split(":")[0]
+        start = time.monotonic()
+        waited = False
+        while True:
+            try:
+                wait = self.backend.try_acquire(buckets)
+            except Exception as e:
+                # Fail open: an unreachable Redis must not take the whole app down
+                print(f"Rate limit backend error, allowing request: {e}")
+                return
+            if not wait:
+                if waited:
+                    metrics.observe("rate_limit_wait", time.monotonic() - start, provider=provider or label)
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                metrics.increment("rate_limit_rejections_total", bucket=provider or label)
+                raise RateLimitExceeded(provider or label, retry_after=max(1, int(wait + 0.999)))
+            # Jitter keeps waiters that wake together from retrying in lockstep
+            time.sleep(min(wait * random.uniform(1.0, 1.2), remaining))
+            waited = True
+
+    def upstream_slot(self, provider, deadline):
+        """Context manager that holds one of the provider's concurrency slots for an upstream call."""
+        return _UpstreamSlot(self, provider, deadline)
+
+
+class _UpstreamSlot:
+    def __init__(self, limiter, provider, deadline):
+        self.limiter = limiter
+        self.provider = provider
+        self.deadline = deadline
+        self.semaphore = None
+
+    def __enter__(self):
+        self.limiter.acquire(self.deadline, provider=self.provider)
+        semaphore = self.limiter.semaphores.get(self.provider)
+        if semaphore is not None:
+            if not semaphore.acquire(timeout=max(0.0, self.deadline - time.monotonic())):
+                metrics.increment("rate_limit_rejections_total", bucket=f"concurrency:{self.provider}")
+                raise RateLimitExceeded(self.provider, retry_after=1)
+            self.semaphore = semaphore
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.semaphore is not None:
+            self.semaphore.release()
+        return False
@@ -0,0 +1,23 @@
+# utils/redis_client.py
+import os
+import threading
+
+_lock = threading.Lock()
+_client = None
+
+
+def get_redis():
+    """
+    Returns a shared Redis client for REDIS_URL, or None when Redis is not configured.
+    redis-py reconnects after fork, so one client per process is safe with --preload.
+    """
+    global _client
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(redis_url)
+    return _client
@@ -0,0 +1,188 @@
+# utils/response_cache.py
+"""
+Cache of upstream results that don't depend on who is asking: intent
+detection, media searches, first-turn answers and answer audio.
+
+With REDIS_URL set, entries are shared by every worker and by the
+maintenance process, which prewarms them for popular questions during
+off-peak hours (see cache_prewarm.py). Without Redis each worker keeps its
+own entries in up to RESPONSE_CACHE_MEMORY_MB of memory.
+
+Entries live for RESPONSE_CACHE_TTL_HOURS, fact-check and text answers for
+RESPONSE_CACHE_ANSWER_TTL_HOURS. Errors and empty results are not stored,
+and answers to follow-up questions (which depend on the conversation so
+far) are not cached at all. On a hit nothing waits for a rate-limit slot.
+
+With METRICS_ENABLED, lookups are counted per namespace and outcome, and
+hits by whether the entry was prewarmed (response_cache_lookups_total).
+"""
+import base64
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from cachetools import TTLCache
+
+from utils import metrics
+from utils.redis_client import get_redis
+from utils.single_flight import normalize_query
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24"))
+RESPONSE_CACHE_ANSWER_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_ANSWER_TTL_HOURS", str(RESPONSE_CACHE_TTL_HOURS)))
+RESPONSE_CACHE_MEMORY_MB = float(os.getenv("RESPONSE_CACHE_MEMORY_MB", "32"))
+
+
+class PrewarmBudgetExhausted(Exception):
+    pass
+
+
+class _Prewarm:
+    __slots__ = ("budget", "refresh_within", "upstream_calls", "uncached")
+
+    def __init__(self, budget, refresh_within):
+        self.budget = budget
+        self.refresh_within = refresh_within
+        self.upstream_calls = 0
+        # Upstream results that could not be stored (errors, no results)
+        self.uncached = 0
+
+
+class ResponseCache:
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, memory_mb=RESPONSE_CACHE_MEMORY_MB):
+        self.enabled = enabled
+        self._upstream_guard = None
+        self._lock = threading.Lock()
+        # Sized in bytes of stored JSON; each entry also carries its own expiry
+        self._memory = TTLCache(maxsize=int(memory_mb * 2 ** 20), getsizeof=len,
+                                ttl=max(RESPONSE_CACHE_TTL_HOURS, RESPONSE_CACHE_ANSWER_TTL_HOURS) * 3600)
+        self._local = threading.local()
+
+    def set_upstream_guard(self, guard):
+        """guard(provider) returns a context manager held around every upstream call, e.g. a rate-limit slot."""
+        self._upstream_guard = guard
+
+    @property
+    def shared(self):
+        return get_redis() is not None
+
+    @staticmethod
+    def _redis_key(namespace, key):
+        return f"respcache:{namespace}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def _read(self, namespace, key):
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                payload = self._memory.get((namespace, key))
+        else:
+            try:
+                payload = client.get(self._redis_key(namespace, key))
+            except Exception as e:
+                print(f"Response cache Redis error, calling upstream directly: {e}")
+                return None
+        return json.loads(payload) if payload is not None else None
+
+    def _write(self, namespace, key, result, ttl, prewarmed):
+        entry = {"exp": time.time() + ttl, "pw": prewarmed}
+        if isinstance(result, bytes):
+            entry["b"] = base64.b64encode(result).decode("ascii")
+        else:
+            entry["v"] = result
+        payload = json.dumps(entry, separators=(",", ":"))
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                try:
+                    self._memory[(namespace, key)] = payload
+                except ValueError:
+                    # Larger than the whole cache
+                    pass
+            return
+        try:
+            client.set(self._redis_key(namespace, key), payload, px=int(ttl * 1000))
+        except Exception as e:
+            print(f"Response cache Redis error, result not stored: {e}")
+
+    @staticmethod
+    def _value(entry):
+        if "b" in entry:
+            return base64.b64decode(entry["b"])
+        value = entry["v"]
+        return tuple(value) if isinstance(value, list) else value
+
+    def _count(self, namespace, outcome, prewarm, prewarmed=None):
+        labels = {"namespace": namespace, "outcome": outcome, "source": "prewarm" if prewarm else "request"}
+        if prewarmed is not None:
+            labels["prewarmed"] = "true" if prewarmed else "false"
+        metrics.increment("response_cache_lookups_total", **labels)
+
+    def _call_upstream(self, fn, provider, prewarm):
+        if prewarm is not None:
+            if prewarm.upstream_calls >= prewarm.budget:
+                raise PrewarmBudgetExhausted()
+            prewarm.upstream_calls += 1
+        guard = self._upstream_guard(provider) if self._upstream_guard and provider else nullcontext()
+        with guard:
+            return fn()
+
+    def call(self, namespace, key, fn, provider=None, ttl_hours=RESPONSE_CACHE_TTL_HOURS, cacheable=None):
+        """
+        Returns the cached result for key, or calls fn() and stores its result if cacheable(result) is true.
+        key=None means the result must not be cached. provider is passed to the upstream guard on a miss.
+        """
+        prewarm = getattr(self._local, "prewarm", None)
+        if not self.enabled or key is None:
+            self._count(namespace, "bypass", prewarm)
+            return self._call_upstream(fn, provider, prewarm)
+
+        entry = self._read(namespace, key)
+        now = time.time()
+        # While prewarming, entries that would expire soon are fetched again
+        if entry is not None and entry["exp"] > now + (prewarm.refresh_within if prewarm else 0):
+            self._count(namespace, "hit", prewarm, entry.get("pw", False))
+            return self._value(entry)
+        self._count(namespace, "miss" if entry is None or entry["exp"] <= now else "refresh", prewarm)
+
+        result = self._call_upstream(fn, provider, prewarm)
+        if cacheable is None or cacheable(result):
+            self._write(namespace, key, result, ttl_hours * 3600, prewarmed=prewarm is not None)
+        elif prewarm is not None:
+            prewarm.uncached += 1
+        return result
+
+    @contextmanager
+    def prewarming(self, budget, refresh_within):
+        """
+        Within this block (on this thread), results are stored as prewarmed, entries expiring within
+        refresh_within seconds count as misses, and the upstream calls made are counted. Once budget
+        calls have been made, the next miss raises PrewarmBudgetExhausted.
+        """
+        self._local.prewarm = state = _Prewarm(budget, refresh_within)
+        try:
+            yield state
+        finally:
+            self._local.prewarm = None
+
+
+response_cache = ResponseCache()
+
+
+def cached(namespace, provider=None, ttl_hours=RESPONSE_CACHE_TTL_HOURS, key=None, cacheable=None):
+    """
+    Decorator that serves fn(query, ...) from the response cache.
+    By default the key is the normalized query; key(*args, **kwargs) may return a different one, or None to skip the cache.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if key else normalize_query(args[0])
+            return response_cache.call(namespace, cache_key, lambda: fn(*args, **kwargs), provider=provider,
+                                       ttl_hours=ttl_hours, cacheable=cacheable)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,138 @@
+# utils/single_flight.py
+"""
+Single-flight request coalescing.
+
+When several requests ask for the same thing at the same time, only the first
+one (the leader) calls the upstream. The others wait for it and get the same
+result, or the same error; except when the leader was turned away by the
+rate limiter, since that token was the leader's own: then the followers
+coalesce again behind a new leader that asks for its own. This is not a cache: once the leader finishes, the next caller makes
+a fresh call.
+
+Inside one process, threads share the call through an Event. With
+SINGLE_FLIGHT_SHARED=true and REDIS_URL set, workers coordinate as well: the
+leader takes a short Redis lock and publishes its result for a few seconds,
+and followers in other workers poll for it.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+from utils import metrics
+from utils.rate_limit import RateLimitExceeded
+from utils.redis_client import get_redis
+
+SINGLE_FLIGHT_SHARED = os.getenv("SINGLE_FLIGHT_SHARED", "false").lower() == "true"
+# Followers give up waiting after this long and make their own call
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "30"))
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a search query."""
+    return " ".join(str(query).lower().split())
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, shared=SINGLE_FLIGHT_SHARED, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.shared = shared
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Runs fn() once for all concurrent callers with the same key and returns its result to each of them."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.event.wait(self.timeout):
+                if isinstance(call.error, RateLimitExceeded):
+                    # The leader's token was refused, not the upstream call; the followers try again with their own
+                    metrics.increment("single_flight_calls_total", group=self.name, role="retried")
+                    return self.do(key, fn)
+                metrics.increment("single_flight_calls_total", group=self.name, role="follower")
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # The leader is stuck; don't let it hold this request hostage
+            return fn()
+
+        try:
+            call.result = self._run_shared(key, fn) if self.shared else fn()
+            metrics.increment("single_flight_calls_total", group=self.name, role="leader")
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run_shared(self, key, fn):
+        client = get_redis()
+        if client is None:
+            return fn()
+        redis_key = f"singleflight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+        try:
+            is_leader = client.set(f"{redis_key}:lock", token, nx=True, px=int(self.timeout * 1000))
+        except Exception as e:
+            print(f"Single-flight Redis error, calling upstream directly: {e}")
+            return fn()
+
+        if is_leader:
+            try:
+                result = fn()
+                client.set(f"{redis_key}:result", json.dumps(result), px=5000)
+                return result
+            finally:
+                if client.get(f"{redis_key}:lock") == token.encode():
+                    client.delete(f"{redis_key}:lock")
+
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            # Check the lock first so a result published in between is not missed
+            leader_done = not client.exists(f"{redis_key}:lock")
+            payload = client.get(f"{redis_key}:result")
+            if payload is not None:
+                metrics.increment("single_flight_calls_total", group=self.name, role="remote_follower")
+                result = json.loads(payload)
+                return tuple(result) if isinstance(result, list) else result
+            if leader_done:
+                break
+            time.sleep(0.05)
+        return fn()
+
+
+def single_flight(name):
+    """Decorator for fn(query) upstream lookups: concurrent calls with the same normalized query share one call."""
+    group = SingleFlight(name)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(query, *args, **kwargs):
+            key = normalize_query(query)
+            if args or kwargs:
+                key = f"{key}|{json.dumps([args, kwargs], sort_keys=True, default=str)}"
+            return group.do(key, lambda: fn(query, *args, **kwargs))
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorator
@@ -1,14 +1,34 @@
 # utils/sketch_generator.py
-import cv2
-import numpy as np
 import traceback
 
+def sketch_frame(img):
+    """Turns one BGR image (a NumPy array) into a grayscale pencil sketch."""
+    import cv2
+
+    # Convert to grayscale
+    gray_image = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # Invert the grayscale image
+    inverted_gray_image = 255 - gray_image
+    
+    # Apply Gaussian blur
+    blurred_image = cv2.GaussianBlur(inverted_gray_image, (21, 21), 0)
+    
+    # Invert the blurred image
+    inverted_blurred_image = 255 - blurred_image
+    
+    # Create pencil sketch effect
+    return cv2.divide(gray_image, inverted_blurred_image, scale=256.0)
+
 def generate_sketch(input_image_bytes, output_path):
     """
     Generates a sketch from image bytes and saves it to the output path.
     Enhanced with better error handling and debugging.
     """
     try:
+        import cv2
+        import numpy as np
+
         # Convert byte data to a NumPy array
         nparr = np.frombuffer(input_image_bytes, np.uint8)
         print(f"DEBUG: Created numpy array of size {len(nparr)}")
@@ -23,21 +43,7 @@ def generate_sketch(input_image_bytes, output_path):
 
         print(f"DEBUG: Image decoded successfully. Shape: {img.shape}")
 
-        # Convert to grayscale
-        gray_image = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        print(f"DEBUG: Converted to grayscale. Shape: {gray_image.shape}")
-        
-        # Invert the grayscale image
-        inverted_gray_image = 255 - gray_image
-        
-        # Apply Gaussian blur
-        blurred_image = cv2.GaussianBlur(inverted_gray_image, (21, 21), 0)
-        
-        # Invert the blurred image
-        inverted_blurred_image = 255 - blurred_image
-        
-        # Create pencil sketch effect
-        pencil_sketch = cv2.divide(gray_image, inverted_blurred_image, scale=256.0)
+        pencil_sketch = sketch_frame(img)
         
         # Save the sketch
         success = cv2.imwrite(output_path, pencil_sketch)
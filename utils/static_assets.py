@@ -0,0 +1,176 @@
+# utils/static_assets.py
+"""
+Fingerprinted, precompressed CSS and JS for the chat UI.
+
+build_assets() (run `flask assets build` or `python -m utils.static_assets`
+at deploy time) minifies everything under static/css and static/js, names
+each file after a hash of its content (css/chat.1a2b3c4d5e6f.css), writes
+gzip and, if the brotli package is installed, brotli variants next to it in
+static/dist, and records the mapping in static/dist/manifest.json.
+
+Templates link assets with asset_url('css/chat.css'). With a manifest that
+points at /assets/<hashed name>, which is served with the best encoding the
+browser accepts and cached as immutable for a year: a changed file gets a
+new name, so a cached copy never goes stale. Without a manifest, or in
+debug mode, asset_url() falls back to the plain /static URL.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+ASSET_SOURCES = ("css", "js")
+ASSET_EXTENSIONS = (".css", ".js")
+ASSET_MAX_AGE = 365 * 24 * 3600
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_CSS_TOKENS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/', re.S)
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def _minify_css_code(code):
+    code = re.sub(r"\s+", " ", code)
+    code = re.sub(r"\s*([{};,])\s*", r"\1", code)
+    return re.sub(r":\s+", ":", code)
+
+
+def minify_css(text):
+    """Drops comments and redundant whitespace. Quoted strings are kept as they are."""
+    parts = []
+    position = 0
+    for match in _CSS_TOKENS.finditer(text):
+        parts.append(_minify_css_code(text[position:match.start()]))
+        if not match.group().startswith("/*"):
+            parts.append(match.group())
+        position = match.end()
+    parts.append(_minify_css_code(text[position:]))
+    return "".join(parts).replace(";}", "}").strip()
+
+
+def minify_js(text):
+    """
+    Strips indentation, blank lines and whole-line // comments. Deliberately
+    no more than that: anything cleverer needs a real JS parser, and
+    compression takes care of most of the rest.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def _write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(static_folder, output_dir=None):
+    """Builds static/dist from the CSS and JS sources and returns the manifest."""
+    output_dir = output_dir or os.path.join(static_folder, "dist")
+    brotli = _brotli()
+    manifest = {}
+    written = set()
+    for source in ASSET_SOURCES:
+        source_dir = os.path.join(static_folder, source)
+        if not os.path.isdir(source_dir):
+            continue
+        for name in sorted(os.listdir(source_dir)):
+            base, extension = os.path.splitext(name)
+            if extension not in ASSET_EXTENSIONS:
+                continue
+            with open(os.path.join(source_dir, name), encoding="utf-8") as f:
+                data = MINIFIERS[extension](f.read()).encode("utf-8")
+            hashed = f"{source}/{base}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+            path = os.path.join(output_dir, hashed)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            variants = {"": data, ".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli:
+                variants[".br"] = brotli.compress(data, quality=11)
+            for suffix, content in variants.items():
+                # A compressed variant that isn't smaller isn't worth serving
+                if suffix and len(content) >= len(data):
+                    continue
+                _write(path + suffix, content)
+                written.add(hashed + suffix)
+            manifest[f"{source}/{name}"] = hashed
+
+    # Drop outputs of earlier builds
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, "/")
+            if relative not in written and relative != "manifest.json":
+                os.unlink(os.path.join(root, name))
+    os.makedirs(output_dir, exist_ok=True)
+    _write(os.path.join(output_dir, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+class StaticAssets:
+    def __init__(self):
+        self.app = None
+        self.output_dir = None
+        self.manifest = {}
+
+    def init_app(self, app):
+        self.app = app
+        self.output_dir = os.path.join(app.static_folder, "dist")
+        self.manifest = self.load_manifest()
+        app.add_url_rule("/assets/<path:filename>", "static_asset", self.serve)
+        app.jinja_env.globals["asset_url"] = self.asset_url
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.output_dir, "manifest.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def asset_url(self, filename):
+        from flask import url_for
+        hashed = self.manifest.get(filename)
+        # In debug mode edits to the sources should show up without a rebuild
+        if hashed and not self.app.debug:
+            return url_for("static_asset", filename=hashed)
+        return url_for("static", filename=filename)
+
+    def serve(self, filename):
+        from flask import abort, request, send_from_directory
+        from werkzeug.security import safe_join
+
+        path = safe_join(self.output_dir, filename)
+        if path is None or not filename.endswith(ASSET_EXTENSIONS) or not os.path.isfile(path):
+            abort(404)
+        encoding, suffix = None, ""
+        for candidate, candidate_suffix in ENCODINGS:
+            if request.accept_encodings[candidate] and os.path.isfile(path + candidate_suffix):
+                encoding, suffix = candidate, candidate_suffix
+                break
+        response = send_from_directory(self.output_dir, filename + suffix, mimetype=mimetypes.guess_type(filename)[0],
+                                       conditional=True, max_age=ASSET_MAX_AGE)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        return response
+
+
+static_assets = StaticAssets()
+
+
+if __name__ == "__main__":
+    static_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+    for source, hashed in build_assets(static_folder).items():
+        print(f"{source} -> dist/{hashed}")
@@ -1,29 +1,193 @@
 # utils/text_to_speech.py
 
-from gtts import gTTS
 import io
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
-def convert_text_to_speech(text, output_path=None):
+from utils.metrics import span
+from utils.response_cache import response_cache
+
+
+class TTSBackend:
+    """
+    Base class for text-to-speech engines.
+    Subclasses implement synthesize() and return the audio as bytes.
+    """
+    name = None
+    mimetype = "audio/mpeg"
+    extension = ".mp3"
+
+    def synthesize(self, text):
+        raise NotImplementedError
+
+
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS. Needs network access for every call."""
+    name = "gtts"
+    mimetype = "audio/mpeg"
+    extension = ".mp3"
+
+    def __init__(self, lang="en", tld="co.in"):
+        # Using 'co.in' for a different voice accent, which can sometimes be clearer
+        self.lang = lang
+        self.tld = tld
+
+    def synthesize(self, text):
+        from gtts import gTTS
+        tts = gTTS(text=text, lang=self.lang, tld=self.tld)
+        audio_buffer = io.BytesIO()
+        tts.write_to_fp(audio_buffer)
+        return audio_buffer.getvalue()
+
+
+class EspeakBackend(TTSBackend):
+    """Offline CPU engine using the espeak-ng (or espeak) command line tool."""
+    name = "espeak"
+    mimetype = "audio/wav"
+    extension = ".wav"
+
+    def __init__(self, voice="en", speed=160):
+        self.voice = voice
+        self.speed = speed
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def synthesize(self, text):
+        if not self.binary:
+            raise RuntimeError("espeak-ng is not installed.")
+        result = subprocess.run(
+            [self.binary, "-v", self.voice, "-s", str(self.speed), "--stdout"],
+            input=text.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=30,
+            check=True,
+        )
+        return result.stdout
+
+
+TTS_BACKENDS = {
+    GTTSBackend.name: GTTSBackend,
+    EspeakBackend.name: EspeakBackend,
+}
+
+_backend_instances = {}
+
+
+def get_tts_backend(name=None):
+    """
+    Returns the configured TTS backend instance.
+    The backend is chosen with the TTS_BACKEND env var ('gtts' or 'espeak').
+    """
+    name = (name or os.getenv("TTS_BACKEND", "gtts")).lower()
+    if name not in TTS_BACKENDS:
+        print(f"Unknown TTS backend '{name}', falling back to gtts.")
+        name = GTTSBackend.name
+    if name not in _backend_instances:
+        _backend_instances[name] = TTS_BACKENDS[name]()
+    return _backend_instances[name]
+
+
+_MARKDOWN_RE = re.compile(r"[*_#`>~]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_into_sentences(text, max_chars=300):
+    """
+    Splits an answer into speakable sentences.
+    Markdown symbols are stripped and very long sentences are cut on word boundaries
+    so each chunk stays quick to synthesize.
+    """
+    if not text:
+        return []
+    cleaned = _MARKDOWN_RE.sub("", text)
+    sentences = []
+    for sentence in _SENTENCE_RE.split(cleaned):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+_tts_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TTS_WORKERS", "2")),
+    thread_name_prefix="tts",
+)
+# Sentences of one reply that may be queued on the pool at once, so a long answer can't hold up everyone else's audio
+TTS_MAX_IN_FLIGHT = int(os.getenv("TTS_MAX_IN_FLIGHT", "2"))
+
+
+def synthesize_sentences(sentences, backend=None, max_in_flight=TTS_MAX_IN_FLIGHT):
+    """
+    Synthesizes each sentence in the background and returns one future per sentence.
+    At most max_in_flight sentences are on the pool at a time; the next one is queued
+    as soon as one finishes. Sentences are queued in order, so sentence N+1 is being
+    synthesized while the browser is still playing sentence N.
+    """
+    backend = backend or get_tts_backend()
+    futures = [Future() for _ in sentences]
+    remaining = iter(range(len(sentences)))
+    lock = threading.Lock()
+
+    def queue_next():
+        while True:
+            with lock:
+                index = next(remaining, None)
+            if index is None:
+                return
+            future = futures[index]
+            # Cancelled futures belong to audio the browser will never fetch (see expire_audio_store)
+            if future.set_running_or_notify_cancel():
+                break
+        running = _tts_executor.submit(convert_text_to_speech, sentences[index], None, backend)
+
+        def finished(done):
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+            queue_next()
+
+        running.add_done_callback(finished)
+
+    for _ in range(min(max_in_flight, len(sentences))):
+        queue_next()
+    return futures
+
+
+def synthesize(text, backend=None):
+    """Audio bytes for text, from the response cache if this backend has spoken the same sentence before."""
+    backend = backend or get_tts_backend()
+    return response_cache.call("tts", f"{backend.name}:{text}", lambda: backend.synthesize(text), cacheable=bool)
+
+
+def convert_text_to_speech(text, output_path=None, backend=None):
     """
     Converts text to speech.
-    - If output_path is provided, it saves the audio as an MP3 file.
+    - If output_path is provided, it saves the audio to that file.
     - If output_path is None, it returns the audio data as bytes.
     """
+    backend = backend or get_tts_backend()
     try:
-        # Using 'co.in' for a different voice accent, which can sometimes be clearer
-        tts = gTTS(text=text, lang='en', tld='co.in')
+        with span("tts_synthesize", provider=backend.name):
+            audio_bytes = synthesize(text, backend)
 
         if output_path:
             # Original functionality: Save to a file if a path is provided
-            tts.save(output_path)
+            with open(output_path, "wb") as f:
+                f.write(audio_bytes)
             return output_path
-        else:
-            # NEW functionality: Save to an in-memory bytes buffer
-            audio_buffer = io.BytesIO()
-            tts.write_to_fp(audio_buffer)
-            audio_buffer.seek(0) # Rewind the buffer to the beginning
-            return audio_buffer.getvalue()
+        return audio_bytes
 
     except Exception as e:
-        print(f"Error in gTTS conversion: {e}")
-        return None
\ No newline at end of file
+        print(f"Error in {backend.name} TTS conversion: {e}")
+        return None
@@ -0,0 +1,256 @@
+# utils/transcript_codec.py
+"""
+Compact binary storage for conversation transcripts (History.transcript).
+
+A transcript is a list of Gemini-format turns,
+[{"role": "user", "parts": [{"text": ...}]}, ...]. Instead of JSON it is
+stored as a header followed by a (usually compressed) body:
+
+    header  b"T" + version + compression + body format
+    turns   varint turn count, then per turn: role byte, varint part count,
+            and for each part a varint length and the UTF-8 text
+    json    compact JSON, for transcripts with anything other than text parts
+
+The body is compressed with zstd when the zstandard package is installed,
+otherwise with zlib, and stored raw when compression would not help. zstd can
+use a dictionary trained on our own transcripts (`flask transcripts
+train-dict`), which matters because most rows are only a few turns long.
+Dictionaries are looked up by the id zstd writes into every frame, so a row
+can only be read while its dictionary exists. They are therefore stored in
+the database (TranscriptDictionary in models.py, which registers itself as
+the loader here), never only on local disk, and encode_transcript refuses to
+write a row whose dictionary isn't stored there.
+"""
+import json
+import os
+import threading
+import time
+import zlib
+
+TRANSCRIPT_ZSTD_LEVEL = int(os.getenv("TRANSCRIPT_ZSTD_LEVEL", "9"))
+# After a lookup misses, unknown dictionary ids fail without re-reading the table for this long
+TRANSCRIPT_DICT_RELOAD_SECONDS = float(os.getenv("TRANSCRIPT_DICT_RELOAD_SECONDS", "30"))
+
+MAGIC = b"T"
+VERSION = 1
+COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD = 0, 1, 2
+FORMAT_TURNS, FORMAT_JSON = 0, 1
+
+ROLES = ("user", "model")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+class MissingTranscriptDictionary(ValueError):
+    """A transcript was compressed with a zstd dictionary that isn't in the transcript_dictionary table."""
+
+    def __init__(self, dict_id):
+        super().__init__(f"zstd dictionary {dict_id} is not in the transcript_dictionary table; "
+                         "import it with `flask transcripts import-dicts`.")
+        self.dict_id = dict_id
+
+
+_zstandard = None
+
+
+def _zstd():
+    """The zstandard module, or None if it isn't installed. Looked up once; a failed import is slow."""
+    global _zstandard
+    if _zstandard is None:
+        try:
+            import zstandard
+            _zstandard = zstandard
+        except ImportError:
+            _zstandard = False
+    return _zstandard or None
+
+
+class _Dictionaries:
+    """
+    zstd dictionaries keyed by dict id, loaded once from loader() and again
+    when a row needs one this process hasn't seen, at most once per
+    reload_seconds so a corrupt or foreign row can't make every read scan
+    the table. loader returns the raw dictionaries oldest first; the last
+    one is used for new rows.
+    """
+
+    def __init__(self, loader=None, reload_seconds=TRANSCRIPT_DICT_RELOAD_SECONDS):
+        self.loader = loader
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._newest = None
+        self._loaded_at = None
+
+    def set_loader(self, loader):
+        with self._lock:
+            self.loader = loader
+            self._by_id = None
+
+    def _load(self):
+        zstandard = _zstd()
+        by_id, newest = {}, None
+        if zstandard is not None and self.loader is not None:
+            try:
+                stored = self.loader()
+            except Exception as e:
+                # New rows are then written without a dictionary, which needs nothing to read back
+                print(f"Could not load transcript dictionaries: {e}")
+                stored = []
+            for data in stored:
+                newest = zstandard.ZstdCompressionDict(bytes(data))
+                by_id[newest.dict_id()] = newest
+        self._by_id, self._newest = by_id, newest
+        self._loaded_at = time.monotonic()
+
+    def get(self, dict_id):
+        """The dictionary with this id, or None if it isn't stored (as of the last reload_seconds)."""
+        with self._lock:
+            if self._by_id is None or (dict_id not in self._by_id
+                                       and time.monotonic() - self._loaded_at >= self.reload_seconds):
+                # A worker started before a new dictionary was trained
+                self._load()
+            return self._by_id.get(dict_id)
+
+    def newest(self):
+        with self._lock:
+            if self._by_id is None:
+                self._load()
+            return self._newest
+
+    def reset(self):
+        with self._lock:
+            self._by_id = None
+
+
+dictionaries = _Dictionaries()
+# zstd compressor/decompressor objects are not thread-safe, so each thread keeps its own
+_local = threading.local()
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _pack_turns(turns):
+    """Returns the turns body, or None if a turn has anything but a known role and text parts."""
+    out = bytearray()
+    _write_varint(out, len(turns))
+    for turn in turns:
+        if not isinstance(turn, dict) or set(turn) != {"role", "parts"} or turn["role"] not in ROLE_CODES:
+            return None
+        parts = turn["parts"]
+        if not isinstance(parts, list):
+            return None
+        out.append(ROLE_CODES[turn["role"]])
+        _write_varint(out, len(parts))
+        for part in parts:
+            if not isinstance(part, dict) or set(part) != {"text"} or not isinstance(part["text"], str):
+                return None
+            text = part["text"].encode("utf-8")
+            _write_varint(out, len(text))
+            out += text
+    return bytes(out)
+
+
+def _unpack_turns(body):
+    count, pos = _read_varint(body, 0)
+    turns = []
+    for _ in range(count):
+        role = ROLES[body[pos]]
+        part_count, pos = _read_varint(body, pos + 1)
+        parts = []
+        for _ in range(part_count):
+            length, pos = _read_varint(body, pos)
+            parts.append({"text": body[pos:pos + length].decode("utf-8")})
+            pos += length
+        turns.append({"role": role, "parts": parts})
+    return turns
+
+
+def _compress(body):
+    zstandard = _zstd()
+    if zstandard is not None:
+        dictionary = dictionaries.newest()
+        key = ("compressor", dictionary.dict_id() if dictionary else None)
+        compressors = getattr(_local, "compressors", None)
+        if compressors is None:
+            compressors = _local.compressors = {}
+        compressor = compressors.get(key)
+        if compressor is None:
+            compressor = compressors[key] = zstandard.ZstdCompressor(
+                level=TRANSCRIPT_ZSTD_LEVEL, dict_data=dictionary, write_content_size=True)
+        return COMPRESSION_ZSTD, compressor.compress(body)
+    return COMPRESSION_ZLIB, zlib.compress(body)
+
+
+def _decompress(compression, payload):
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(payload)
+    if compression == COMPRESSION_ZSTD:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ValueError("This transcript is zstd-compressed; install the zstandard package to read it.")
+        dict_id = zstandard.get_frame_parameters(payload).dict_id
+        dictionary = dictionaries.get(dict_id) if dict_id else None
+        if dict_id and dictionary is None:
+            raise MissingTranscriptDictionary(dict_id)
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(payload)
+    raise ValueError(f"Unknown transcript compression {compression}")
+
+
+def encode_transcript(turns):
+    """Encodes a list of Gemini-format turns into bytes for History.transcript."""
+    body = _pack_turns(turns)
+    body_format = FORMAT_TURNS
+    if body is None:
+        body, body_format = json.dumps(turns, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), FORMAT_JSON
+    compression, payload = _compress(body)
+    if len(payload) >= len(body):
+        compression, payload = COMPRESSION_NONE, body
+    elif compression == COMPRESSION_ZSTD:
+        dict_id = _zstd().get_frame_parameters(payload).dict_id
+        # A row written with a dictionary that isn't stored could never be read again
+        if dict_id and dictionaries.get(dict_id) is None:
+            raise ValueError(f"zstd dictionary {dict_id} is not stored; refusing to write a transcript with it.")
+    return MAGIC + bytes((VERSION, compression, body_format)) + payload
+
+
+def decode_transcript(data):
+    """Decodes bytes written by encode_transcript back into a list of turns."""
+    data = bytes(data)
+    if data[:1] != MAGIC or data[1] != VERSION:
+        raise ValueError("Not an encoded transcript")
+    body = _decompress(data[2], data[4:])
+    if data[3] == FORMAT_TURNS:
+        return _unpack_turns(body)
+    return json.loads(body)
+
+
+def transcript_sample(turns):
+    """The uncompressed body of a transcript, as fed to dictionary training."""
+    body = _pack_turns(turns)
+    return body if body is not None else json.dumps(turns, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def train_dictionary(samples, size=32 * 1024):
+    """Trains a zstd dictionary from transcript_sample() outputs and returns its bytes."""
+    zstandard = _zstd()
+    if zstandard is None:
+        raise RuntimeError("Training a dictionary needs the zstandard package.")
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
@@ -0,0 +1,207 @@
+# utils/uploads.py
+"""
+Checks image uploads before anything reads them whole.
+
+check_upload_size() turns a request away on its Content-Length alone,
+before the multipart body is parsed. Werkzeug spools the parsed file to
+disk past 500 KB. open_image_upload() then reads only the first
+SNIFF_BYTES of it to tell what kind of image it is (by magic bytes, not by
+file name) and how many pixels it has (from the header), and rejects:
+
+- files that aren't a JPEG, PNG, GIF, WebP, BMP or HEIC/HEIF image (415);
+- files over UPLOAD_MAX_IMAGE_MB (413), for uploads without a
+  Content-Length;
+- images over UPLOAD_MAX_PIXELS (413). A small, highly compressed file can
+  decode to gigabytes, so the pixel count matters more than the file size.
+
+An accepted upload's .data is plain bytes up to UPLOAD_SPOOL_KB. Larger
+ones are a read-only mmap of the spooled file, which np.frombuffer() and
+PIL read without copying it into the worker's heap. HEIC/HEIF uploads are
+converted to JPEG, as before; one whose pixels don't decode is rejected
+(415) like any other unreadable image.
+
+MAX_CONTENT_LENGTH (set in app.py) still bounds every request, including
+chunked ones that send no Content-Length.
+"""
+import io
+import mmap
+import os
+import shutil
+import tempfile
+
+from utils import metrics
+
+UPLOAD_MAX_IMAGE_MB = float(os.getenv("UPLOAD_MAX_IMAGE_MB", "20"))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(40_000_000)))
+UPLOAD_SPOOL_KB = int(os.getenv("UPLOAD_SPOOL_KB", "512"))
+SNIFF_BYTES = 64 * 1024
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+# ISO base media "ftyp" brands of HEIC/HEIF still images
+HEIF_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1"}
+# Extension of the image generated from each kind of upload. The output is a single frame, and OpenCV can't
+# reliably write GIF, so a GIF becomes a PNG.
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "gif": ".png", "bmp": ".bmp", "webp": ".webp", "heif": ".jpg"}
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def check_upload_size(max_mb=UPLOAD_MAX_IMAGE_MB):
+    """Rejects the current request if its declared body is larger than max_mb. Call before touching request.files."""
+    from flask import request
+    if request.content_length and request.content_length > max_mb * 1024 * 1024:
+        metrics.increment("uploads_total", outcome="too_large")
+        raise UploadRejected(f"Uploads can be at most {max_mb:g} MB.", 413)
+
+
+def sniff_image_type(head):
+    """The image type the first bytes of a file belong to, or None."""
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "heif"
+    return None
+
+
+def _register_heif():
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+
+
+def image_dimensions(head, stream, kind):
+    """(width, height) from the image header, without decoding any pixels."""
+    from PIL import Image
+
+    if kind == "heif":
+        _register_heif()
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            return img.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        # The size lies beyond the sniffed bytes (e.g. a JPEG with a large EXIF block); Image.open still only reads headers
+        stream.seek(0)
+        with Image.open(stream) as img:
+            return img.size
+
+
+class ImageUpload:
+    """An accepted image upload. Use as a context manager so a mapped file is released."""
+
+    def __init__(self, data, ext, kind, width, height, spool=None):
+        self.data = data
+        self.ext = ext
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self._spool = spool
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # Something still holds a view of it; it's unmapped when that is garbage collected
+                pass
+        if self._spool is not None:
+            self._spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _map(stream):
+    """Maps the (spooled) upload read-only. Streams without a file behind them are copied to one first."""
+    spool = None
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        spool = tempfile.TemporaryFile()
+        stream.seek(0)
+        shutil.copyfileobj(stream, spool)
+        spool.flush()
+        fileno = spool.fileno()
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), spool
+
+
+def _heif_to_jpeg(stream):
+    from PIL import Image
+    _register_heif()
+    stream.seek(0)
+    buffer = io.BytesIO()
+    with Image.open(stream) as img:
+        img.convert("RGB").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def open_image_upload(file_storage, max_mb=UPLOAD_MAX_IMAGE_MB, max_pixels=UPLOAD_MAX_PIXELS,
+                      spool_kb=UPLOAD_SPOOL_KB):
+    """Checks an uploaded image and returns it as an ImageUpload. Raises UploadRejected."""
+    from PIL import Image
+
+    stream = file_storage.stream
+    stream.seek(0)
+    head = stream.read(SNIFF_BYTES)
+    kind = sniff_image_type(head)
+    if kind is None:
+        metrics.increment("uploads_total", outcome="not_an_image")
+        raise UploadRejected("That file isn't an image I can read. Try a JPEG, PNG, GIF, WebP or HEIC.", 415)
+
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    if size > max_mb * 1024 * 1024:
+        metrics.increment("uploads_total", outcome="too_large")
+        raise UploadRejected(f"Images can be at most {max_mb:g} MB.", 413)
+
+    try:
+        width, height = image_dimensions(head, stream, kind)
+    except Image.DecompressionBombError:
+        # Pillow refuses to even open images far past its own limit
+        metrics.increment("uploads_total", outcome="too_many_pixels")
+        raise UploadRejected(f"That image has too many pixels; the limit is {max_pixels / 1e6:g} megapixels.", 413)
+    except Exception as e:
+        print(f"Could not read image header: {e}")
+        metrics.increment("uploads_total", outcome="unreadable")
+        raise UploadRejected("That image looks damaged and can't be opened.", 415)
+    if width * height > max_pixels:
+        metrics.increment("uploads_total", outcome="too_many_pixels")
+        raise UploadRejected(f"That image is {width}x{height}; images can have at most "
+                             f"{max_pixels / 1e6:g} megapixels.", 413)
+
+    if kind == "heif":
+        try:
+            data = _heif_to_jpeg(stream)
+        except Exception as e:
+            # The header parsed but the pixels don't decode
+            print(f"Could not convert HEIC image: {e}")
+            metrics.increment("uploads_total", outcome="unreadable")
+            raise UploadRejected("That image looks damaged and can't be opened.", 415)
+        metrics.increment("uploads_total", outcome="accepted", kind=kind)
+        return ImageUpload(data, ".jpg", kind, width, height)
+
+    metrics.increment("uploads_total", outcome="accepted", kind=kind)
+    # Named after what the file is, never after what the client called it
+    ext = EXTENSIONS[kind]
+    stream.seek(0)
+    if size <= spool_kb * 1024:
+        return ImageUpload(stream.read(), ext, kind, width, height)
+    data, spool = _map(stream)
+    return ImageUpload(data, ext, kind, width, height, spool)
@@ -0,0 +1,226 @@
+# utils/video_delivery.py
+"""
+Picks the right video rendition for a client and keeps a bounded disk cache
+of popular clips for /stream-video.
+
+Pexels already transcodes every clip into several MP4 renditions, so instead
+of transcoding ourselves we choose the largest one that fits the client's
+viewport and connection. A clip is written to the cache the
+VIDEO_CACHE_MIN_HITS-th time it is streamed; after that it is served from
+disk. The least recently used clips are evicted once the cache grows past
+VIDEO_CACHE_MAX_MB.
+
+Only https URLs on VIDEO_STREAM_HOSTS (Pexels by default, subdomains
+included) are fetched, redirects included, so /stream-video can't be used
+to make the server fetch arbitrary URLs.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from cachetools import LRUCache
+
+from utils import metrics
+
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "video_cache"))
+VIDEO_CACHE_MAX_BYTES = int(float(os.getenv("VIDEO_CACHE_MAX_MB", "500")) * 1024 * 1024)
+VIDEO_CACHE_MAX_FILE_BYTES = int(float(os.getenv("VIDEO_CACHE_MAX_FILE_MB", "50")) * 1024 * 1024)
+VIDEO_CACHE_MIN_HITS = int(os.getenv("VIDEO_CACHE_MIN_HITS", "2"))
+VIDEO_STREAM_HOSTS = tuple(host.strip().lower() for host in os.getenv("VIDEO_STREAM_HOSTS", "pexels.com").split(",")
+                           if host.strip())
+VIDEO_STREAM_MAX_REDIRECTS = 3
+# Pexels serves MP4; anything else is streamed but not cached
+CACHED_CONTENT_TYPE = "video/mp4"
+CACHED_EXTENSION = ".mp4"
+
+# Rough MP4 bitrates (Mbit/s) by rendition width, used to match a rendition to the client's bandwidth
+BITRATE_BY_WIDTH = ((426, 0.7), (640, 1.5), (960, 2.5), (1280, 4.0), (1920, 8.0), (2560, 14.0))
+DEFAULT_VIEWPORT_WIDTH = 1280
+
+
+def estimated_bitrate(width):
+    for max_width, mbps in BITRATE_BY_WIDTH:
+        if width <= max_width:
+            return mbps
+    return 25.0
+
+
+def choose_rendition(renditions, viewport_width=None, dpr=None, downlink=None, save_data=False):
+    """
+    Returns the largest rendition that is no wider than the client can show and
+    whose estimated bitrate fits its measured downlink (Mbit/s). Falls back to
+    the smallest rendition. renditions must be sorted by width, smallest first.
+    """
+    if not renditions:
+        return None
+    target_width = (viewport_width or DEFAULT_VIEWPORT_WIDTH) * min(dpr or 1, 2)
+    budget = downlink * 0.8 if downlink else None
+    if save_data:
+        target_width = min(target_width, 640)
+
+    chosen = renditions[0]
+    for rendition in renditions:
+        if rendition["width"] > target_width:
+            break
+        if budget is not None and estimated_bitrate(rendition["width"]) > budget:
+            break
+        chosen = rendition
+    return chosen
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def client_hints(headers, body_hints):
+    """
+    Reads viewport/bandwidth hints from HTTP Client Hints headers, falling back
+    to the values the chat UI sends in the request body.
+    """
+    body_hints = body_hints or {}
+    save_data = headers.get("Save-Data", "").lower() == "on" or bool(body_hints.get("save_data"))
+    return {
+        "viewport_width": _to_number(headers.get("Viewport-Width")) or _to_number(body_hints.get("viewport_width")),
+        "dpr": _to_number(headers.get("DPR")) or _to_number(body_hints.get("dpr")),
+        "downlink": _to_number(headers.get("Downlink")) or _to_number(body_hints.get("downlink")),
+        "save_data": save_data,
+    }
+
+
+class VideoNotAllowed(Exception):
+    pass
+
+
+def is_allowed_video_url(url, hosts=VIDEO_STREAM_HOSTS):
+    """Whether url is an https URL on one of hosts or their subdomains, on the default port and without credentials."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return False
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or parts.username or parts.password or port not in (None, 443):
+        return False
+    return any(host == allowed or host.endswith("." + allowed) for allowed in hosts)
+
+
+class VideoCache:
+    def __init__(self, directory=VIDEO_CACHE_DIR, max_bytes=VIDEO_CACHE_MAX_BYTES,
+                 max_file_bytes=VIDEO_CACHE_MAX_FILE_BYTES, min_hits=VIDEO_CACHE_MIN_HITS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.min_hits = min_hits
+        self._hits = LRUCache(maxsize=10000)
+        self._lock = threading.Lock()
+
+    def _path(self, url):
+        # Only MP4 clips are cached, so the name follows from the URL alone and a lookup is a single stat
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + CACHED_EXTENSION)
+
+    def lookup(self, url):
+        """Returns (path, mimetype) for a cached clip, or None."""
+        path = self._path(url)
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except FileNotFoundError:
+            # Never cached, or evicted just now
+            metrics.increment("video_cache_lookups_total", result="miss")
+            return None
+        metrics.increment("video_cache_lookups_total", result="hit")
+        return path, CACHED_CONTENT_TYPE
+
+    def _should_cache(self, url):
+        with self._lock:
+            hits = self._hits.get(url, 0) + 1
+            self._hits[url] = hits
+        return hits >= self.min_hits
+
+    def stream(self, url, chunk_size=1024 * 1024):
+        """
+        Streams a clip from upstream and returns (chunks, content_type). Popular
+        clips are copied to the cache while they are being sent.
+        """
+        target = url
+        for _ in range(VIDEO_STREAM_MAX_REDIRECTS + 1):
+            if not is_allowed_video_url(target):
+                raise VideoNotAllowed(target)
+            # Redirects are followed by hand so every hop is checked against the allowed hosts
+            req = requests.get(target, stream=True, proxies={"http": None, "https": None}, timeout=30,
+                               allow_redirects=False)
+            if not req.is_redirect:
+                break
+            req.close()
+            target = urljoin(target, req.headers["location"])
+        else:
+            raise VideoNotAllowed(target)
+        req.raise_for_status()
+        content_type = req.headers.get("content-type", CACHED_CONTENT_TYPE)
+        length = int(req.headers.get("content-length") or 0)
+        cache_it = (content_type.split(";")[0].strip().lower() == CACHED_CONTENT_TYPE
+                    and self._should_cache(url) and length <= self.max_file_bytes)
+
+        def generate():
+            part = None
+            written = 0
+            complete = False
+            if cache_it:
+                os.makedirs(self.directory, exist_ok=True)
+                part = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+            try:
+                for chunk in req.iter_content(chunk_size=chunk_size):
+                    if part is not None:
+                        written += len(chunk)
+                        if written > self.max_file_bytes:
+                            part.close()
+                            os.unlink(part.name)
+                            part = None
+                        else:
+                            part.write(chunk)
+                    yield chunk
+                complete = True
+            finally:
+                req.close()
+                if part is not None:
+                    part.close()
+                    if complete:
+                        os.replace(part.name, self._path(url))
+                        self.evict()
+                    else:
+                        os.unlink(part.name)
+
+        return generate(), content_type
+
+    def evict(self):
+        """Deletes least recently used clips until the cache fits in max_bytes."""
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+video_cache = VideoCache()
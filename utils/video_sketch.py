@@ -0,0 +1,235 @@
+# utils/video_sketch.py
+"""
+Turns a short video clip into a pencil-sketch video, frame by frame.
+
+Frames go through a three-stage pipeline: the job thread decodes them with
+OpenCV, a pool of worker processes runs sketch_frame() on them, and an
+encoder thread writes the results in order. At most VIDEO_SKETCH_IN_FLIGHT
+frames are being filtered and at most as many are waiting for the encoder,
+so memory stays flat however long the clip is.
+
+The worker processes are started from a forkserver (spawn where there is
+none), not forked from the web worker, so they don't inherit its threads,
+locks and database connections. They default to two: the web worker needs
+the CPU too. Raise VIDEO_SKETCH_WORKERS on a host that only sketches.
+
+Jobs run in the background. Their status is written to a small JSON file in
+VIDEO_SKETCH_STATUS_DIR, outside static/ so user ids and errors aren't
+served, and any worker can answer the status endpoint. At most
+VIDEO_SKETCH_MAX_JOBS jobs may be queued or running per worker; beyond that
+new uploads are turned away.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils import metrics
+from utils.sketch_generator import sketch_frame
+
+VIDEO_SKETCH_WORKERS = int(os.getenv("VIDEO_SKETCH_WORKERS", str(min(2, os.cpu_count() or 1))))
+VIDEO_SKETCH_IN_FLIGHT = int(os.getenv("VIDEO_SKETCH_IN_FLIGHT", str(2 * VIDEO_SKETCH_WORKERS)))
+VIDEO_SKETCH_MAX_JOBS = int(os.getenv("VIDEO_SKETCH_MAX_JOBS", "4"))
+VIDEO_SKETCH_MAX_MB = float(os.getenv("VIDEO_SKETCH_MAX_MB", "100"))
+VIDEO_SKETCH_MAX_SECONDS = float(os.getenv("VIDEO_SKETCH_MAX_SECONDS", "60"))
+VIDEO_SKETCH_MAX_WIDTH = int(os.getenv("VIDEO_SKETCH_MAX_WIDTH", "1280"))
+VIDEO_SKETCH_STATUS_DIR = os.getenv("VIDEO_SKETCH_STATUS_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "sketch_jobs"))
+
+# Tried in order; the first one this OpenCV build can write wins. Browsers play H.264 and VP8.
+CODECS = (("avc1", ".mp4"), ("VP80", ".webm"), ("mp4v", ".mp4"))
+
+
+class JobsFull(Exception):
+    pass
+
+
+def pool_context():
+    """The multiprocessing context for sketch worker processes: forkserver, or spawn where there is none."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _resize_and_sketch(frame, width):
+    import cv2
+    if width and frame.shape[1] > width:
+        height = int(frame.shape[0] * width / frame.shape[1]) // 2 * 2
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return sketch_frame(frame)
+
+
+def _open_writer(output_base, fps, size):
+    import cv2
+    for fourcc, extension in CODECS:
+        path = output_base + extension
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size, isColor=False)
+        if writer.isOpened():
+            return writer, path
+        writer.release()
+        if os.path.exists(path):
+            os.unlink(path)
+    raise RuntimeError("No usable video codec in this OpenCV build.")
+
+
+def sketch_video(input_path, output_base, pool, in_flight=VIDEO_SKETCH_IN_FLIGHT,
+                 max_seconds=VIDEO_SKETCH_MAX_SECONDS, max_width=VIDEO_SKETCH_MAX_WIDTH, progress=None):
+    """
+    Sketches every frame of input_path with the given process pool and writes
+    the result to output_base + a codec-specific extension. Calls
+    progress(frames_done, frames_total) as it goes. Returns the output path.
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError("Could not read the video.")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    frames_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    max_frames = int(max_seconds * fps) if max_seconds else None
+    if max_frames and (not frames_total or frames_total > max_frames):
+        frames_total = max_frames
+
+    encode_queue = queue.Queue(maxsize=in_flight)
+    state = {"writer": None, "path": None, "error": None, "done": 0}
+
+    def encode():
+        try:
+            while True:
+                frame = encode_queue.get()
+                if frame is None:
+                    return
+                if state["writer"] is None:
+                    height, width = frame.shape[:2]
+                    state["writer"], state["path"] = _open_writer(output_base, fps, (width, height))
+                state["writer"].write(frame)
+                state["done"] += 1
+                if progress:
+                    progress(state["done"], frames_total)
+        except Exception as e:
+            state["error"] = e
+            # Keep draining so the decoder never blocks on a full queue
+            while encode_queue.get() is not None:
+                pass
+
+    encoder = threading.Thread(target=encode, name="video-sketch-encoder", daemon=True)
+    encoder.start()
+    pending = deque()
+    frames_read = 0
+    try:
+        while max_frames is None or frames_read < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames_read += 1
+            pending.append(pool.submit(_resize_and_sketch, frame, max_width))
+            if len(pending) >= in_flight:
+                encode_queue.put(pending.popleft().result())
+            if state["error"]:
+                break
+        while pending:
+            encode_queue.put(pending.popleft().result())
+    finally:
+        capture.release()
+        for future in pending:
+            future.cancel()
+        encode_queue.put(None)
+        encoder.join()
+        if state["writer"] is not None:
+            state["writer"].release()
+
+    if state["error"]:
+        raise state["error"]
+    if not state["done"]:
+        raise ValueError("The video has no frames.")
+    return state["path"]
+
+
+class VideoSketchJobs:
+    def __init__(self, workers=VIDEO_SKETCH_WORKERS, max_jobs=VIDEO_SKETCH_MAX_JOBS, status_dir=VIDEO_SKETCH_STATUS_DIR):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.status_dir = status_dir
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Pools don't survive fork, so each worker creates its own on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+            # One clip at a time gets the whole process pool; the rest wait their turn
+            self._runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-sketch")
+            self._slots = threading.BoundedSemaphore(self.max_jobs)
+            self._pid = os.getpid()
+
+    def _status_path(self, job_id):
+        return os.path.join(self.status_dir, f"{job_id}.json")
+
+    def _write_status(self, job_id, **status):
+        path = self._status_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, path)
+
+    def status(self, job_id):
+        """Returns the job's status dict, or None if there is no such job."""
+        try:
+            with open(self._status_path(os.path.basename(job_id))) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def submit(self, input_path, output_dir, user_id):
+        """Queues a clip for sketching and returns its job id. Raises JobsFull if too many are queued."""
+        self._ensure_started()
+        if not self._slots.acquire(blocking=False):
+            raise JobsFull()
+        job_id = f"{user_id}_{uuid.uuid4().hex}"
+        os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(self.status_dir, exist_ok=True)
+        self._write_status(job_id, user_id=user_id, status="queued", frames_done=0, frames_total=0)
+        self._runner.submit(self._run, job_id, input_path, output_dir, user_id)
+        return job_id
+
+    def _run(self, job_id, input_path, output_dir, user_id):
+        start = time.perf_counter()
+        last_write = [0.0]
+
+        def progress(done, total):
+            # Status files are cheap, but not cheap enough to rewrite for every frame
+            now = time.monotonic()
+            if now - last_write[0] >= 0.5:
+                last_write[0] = now
+                self._write_status(job_id, user_id=user_id, status="running",
+                                   frames_done=done, frames_total=total)
+
+        try:
+            self._write_status(job_id, user_id=user_id, status="running", frames_done=0, frames_total=0)
+            path = sketch_video(input_path, os.path.join(output_dir, job_id), self._pool, progress=progress)
+            self._write_status(job_id, user_id=user_id, status="done",
+                               filename=os.path.basename(path), seconds=time.perf_counter() - start)
+            metrics.increment("video_sketch_jobs_total", status="done")
+        except Exception as e:
+            print(f"Error in video sketch job {job_id}: {e}")
+            self._write_status(job_id, user_id=user_id, status="error", error=str(e))
+            metrics.increment("video_sketch_jobs_total", status="error")
+        finally:
+            metrics.observe("video_sketch", time.perf_counter() - start)
+            try:
+                os.unlink(input_path)
+            except OSError:
+                pass
+            self._slots.release()
+
+
+video_sketch_jobs = VideoSketchJobs()
@@ -0,0 +1,162 @@
+# utils/youtube_ranking.py
+"""
+Ranks YouTube search results so official uploads come first and playlists,
+compilations and hour-long mixes come last.
+
+Every keyword list is compiled into a single regex that runs over the
+lowercased channel name or title, so each video costs one scan of each. (An
+re.IGNORECASE pattern is several times slower.) Each video is scored in a
+single pass from configurable weights, and the stable sort keeps SerpApi's
+order among videos with the same score.
+
+The keyword lists and weights live in utils/youtube_ranking.json, or in the
+file named by YOUTUBE_RANKING_CONFIG. The file is re-read when its mtime
+changes, at most once every YOUTUBE_RANKING_RELOAD_SECONDS, so lists can be
+edited without restarting the workers.
+"""
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+YOUTUBE_RANKING_CONFIG = os.getenv(
+    "YOUTUBE_RANKING_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "youtube_ranking.json"))
+YOUTUBE_RANKING_RELOAD_SECONDS = float(os.getenv("YOUTUBE_RANKING_RELOAD_SECONDS", "5"))
+
+# Used when the config file is missing or a key is left out
+DEFAULT_CONFIG = {
+    "official_channels": [],
+    "playlist_keywords": [],
+    "long_video_seconds": 3600,
+    "weights": {"official_channel": 100, "playlist_title": -10, "long_video": -10},
+}
+
+
+def compile_matcher(keywords):
+    """
+    Compiles keywords into one regex that finds any of them in lowercased text.
+    Longer keywords come first so overlapping ones match the most specific.
+    Returns None for an empty list.
+    """
+    keywords = sorted({k.strip().lower() for k in keywords if k and k.strip()}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+def parse_duration(length):
+    """Turns "4:12" or "1:02:03" into seconds. Returns None if it can't be parsed."""
+    if not length:
+        return None
+    seconds = 0
+    try:
+        for part in str(length).split(":"):
+            seconds = seconds * 60 + int(part)
+    except ValueError:
+        return None
+    return seconds
+
+
+class VideoRanker:
+    def __init__(self, config=None):
+        config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.weights = dict(DEFAULT_CONFIG["weights"], **config.get("weights", {}))
+        self.official_matcher = compile_matcher(config["official_channels"])
+        self.playlist_matcher = compile_matcher(config["playlist_keywords"])
+        self.long_video_seconds = config["long_video_seconds"]
+        # SerpApi lengths repeat a lot ("3:45", "4:12"), so parse each one once
+        self._is_long = functools.lru_cache(maxsize=4096)(self._parse_is_long)
+
+    def _parse_is_long(self, length):
+        duration = parse_duration(length)
+        return duration is not None and duration >= self.long_video_seconds
+
+    def score(self, video):
+        return self._scores([video])[0]
+
+    def _scores(self, videos):
+        official = self.official_matcher.search if self.official_matcher else None
+        playlist = self.playlist_matcher.search if self.playlist_matcher else None
+        is_long = self._is_long
+        official_weight = self.weights["official_channel"]
+        playlist_weight = self.weights["playlist_title"]
+        long_weight = self.weights["long_video"]
+        scores = []
+        for video in videos:
+            score = 0
+            if official and official((video.get("channel") or "").lower()):
+                score += official_weight
+            if playlist and playlist((video.get("title") or "").lower()):
+                score += playlist_weight
+            if is_long(video.get("length") or ""):
+                score += long_weight
+            scores.append(score)
+        return scores
+
+    def rank(self, videos, limit=None):
+        """Returns videos best first; ties keep their original order."""
+        # Scores take only a handful of values, so bucketing beats a full sort
+        buckets = {}
+        for video, score in zip(videos, self._scores(videos)):
+            bucket = buckets.get(score)
+            if bucket is None:
+                bucket = buckets[score] = []
+            bucket.append(video)
+        ranked = []
+        for score in sorted(buckets, reverse=True):
+            ranked.extend(buckets[score])
+            if limit is not None and len(ranked) >= limit:
+                return ranked[:limit]
+        return ranked
+
+
+class RankingConfig:
+    """Holds the current VideoRanker and rebuilds it when the config file changes."""
+
+    def __init__(self, path=YOUTUBE_RANKING_CONFIG, reload_seconds=YOUTUBE_RANKING_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._ranker = None
+
+    def ranker(self):
+        now = time.monotonic()
+        if self._ranker is not None and now - self._checked_at < self.reload_seconds:
+            return self._ranker
+        with self._lock:
+            if self._ranker is None or now - self._checked_at >= self.reload_seconds:
+                self._checked_at = now
+                self._reload()
+        return self._ranker
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if self._ranker is not None and mtime == self._mtime:
+            return
+        config = None
+        if mtime is not None:
+            try:
+                with open(self.path) as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                # Keep ranking with the last good config rather than failing searches
+                print(f"Could not load YouTube ranking config {self.path}: {e}")
+                if self._ranker is not None:
+                    self._mtime = mtime
+                    return
+        self._ranker = VideoRanker(config)
+        self._mtime = mtime
+
+
+ranking_config = RankingConfig()
+
+
+def rank_videos(videos, limit=None):
+    return ranking_config.ranker().rank(videos, limit)
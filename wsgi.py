@@ -1,7 +1,11 @@
-from app import app, db
+from app import app, db, create_test_user
 import os
 
 def init_db():
+    """
+    Creates the database and tables. Runs once per deployment from the gunicorn
+    master (see gunicorn.conf.py) or from `python wsgi.py`, never on import.
+    """
     with app.app_context():
         try:
             # Ensure the instance folder exists
@@ -17,23 +21,20 @@ def init_db():
             # Create all tables
             db.create_all()
             print("Database tables created successfully")
+            from transcripts import ensure_history_columns
+            ensure_history_columns()
             
             # Create a test user if none exists
-            from models import User
-            if not User.query.filter_by(email='test@example.com').first():
-                user = User(username='test', email='test@example.com')
-                user.set_password('test123')
-                db.session.add(user)
-                db.session.commit()
-                print("Created test user")
+            create_test_user()
+
+            # Forked workers must open their own connections
+            db.engine.dispose()
             
         except Exception as e:
             print(f"Error initializing database: {e}")
             raise
 
-# Initialize the database
-init_db()
-
 if __name__ == "__main__":
+    init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)